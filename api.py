@@ -0,0 +1,245 @@
+"""Versioned JSON read API under ``/api/v1``.
+
+Lists use the same keyset cursors as the HTML pages, ``?fields=`` picks the
+read-model attributes to return, and responses are compressed with brotli
+or gzip according to ``Accept-Encoding``. ``/api/v1/posts/export`` streams
+every post as NDJSON in keyset batches, each read on a connection checked
+out for that batch only, so neither memory use nor the time a pooled
+connection is held grows with the table.
+"""
+import functools
+import gzip
+import json
+import logging
+import sqlite3
+import zlib
+import brotli
+from operator import attrgetter
+from flask import Blueprint, current_app, jsonify, request
+from markupsafe import escape
+from werkzeug.exceptions import HTTPException
+from conditional import conditional_page
+from content import SQL_TOKENS, clean_text, validate_input
+from db import get_read_db
+from models import SNIPPET_END, SNIPPET_START, Comment, Post, decode_cursor
+from ratelimit import rate_limit
+from readmodels import CommentView, FeedCard, PostDetail, SearchHit, fetch
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_PAGE_SIZE = 100
+
+
+class InvalidParameter(ValueError):
+    """An API parameter is invalid; the message goes back to the client."""
+
+
+def negotiate_encoding():
+    accepted = request.accept_encodings
+    if accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compression_level(encoding):
+    return current_app.config['API_BROTLI_QUALITY' if encoding == 'br' else 'API_GZIP_LEVEL']
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level)
+
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of byte chunks, flushing after each so every batch reaches the client."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+@api.after_request
+def compress_response(response):
+    if response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    # Генератор потокового ответа выполняется уже после выхода из контекста: уровень берем сейчас
+    level = compression_level(encoding)
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['API_COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@api.errorhandler(InvalidParameter)
+def invalid_parameter(e):
+    return jsonify({'error': str(e)}), 400
+
+
+@api.errorhandler(HTTPException)
+def http_error(e):
+    return jsonify({'error': e.description}), e.code
+
+
+@api.errorhandler(sqlite3.Error)
+def database_error(e):
+    logging.error(f'API database error: {e}')
+    return jsonify({'error': 'Database error'}), 500
+
+
+def page_size(default):
+    limit = request.args.get('limit', default, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidParameter(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+def cursor_param(name):
+    """The raw ``name`` cursor from the query string; InvalidParameter if it cannot be decoded."""
+    cursor = request.args.get(name)
+    if cursor is not None and decode_cursor(cursor) is None:
+        raise InvalidParameter(f'{name} is not a valid cursor')
+    return cursor
+
+
+@functools.lru_cache(maxsize=256)
+def _field_getter(model, fields):
+    names = model.__slots__ if fields is None else tuple(dict.fromkeys(fields.split(',')))
+    unknown = [name for name in names if name not in model.__slots__]
+    if unknown:
+        raise InvalidParameter(f'Unknown fields: {", ".join(unknown)}; available: {", ".join(model.__slots__)}')
+    getter = attrgetter(*names)
+    if len(names) == 1:
+        return lambda row: {names[0]: getter(row)}
+    return lambda row: dict(zip(names, getter(row)))
+
+
+def serializer(model):
+    """Return a function turning a ``model`` row into a dict of the fields asked for in ``?fields=``."""
+    return _field_getter(model, request.args.get('fields') or None)
+
+
+def highlight(snippet):
+    return str(escape(snippet or '')).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+@api.route('/posts')
+@rate_limit('api')
+@conditional_page('feed')
+def list_posts():
+    serialize = serializer(FeedCard)
+    posts, next_cursor, prev_cursor = Post.get_feed(before=cursor_param('before'),
+                                                    after=cursor_param('after'),
+                                                    limit=page_size(Post.FEED_PAGE_SIZE))
+    return jsonify({'posts': [serialize(post) for post in posts], 'next': next_cursor, 'prev': prev_cursor})
+
+
+@api.route('/posts/<int:post_id>')
+@rate_limit('api')
+@conditional_page('post:{post_id}')
+def get_post(post_id):
+    serialize = serializer(PostDetail)
+    post = Post.get_by_id(post_id)
+    if post is None:
+        return jsonify({'error': 'Post not found'}), 404
+    return jsonify(serialize(post))
+
+
+@api.route('/posts/<int:post_id>/comments')
+@rate_limit('api')
+@conditional_page('post:{post_id}')
+def list_comments(post_id):
+    serialize = serializer(CommentView)
+    comments, next_cursor = Comment.get_page(post_id, after=cursor_param('after'),
+                                             limit=page_size(Comment.PAGE_SIZE))
+    return jsonify({'comments': [serialize(comment) for comment in comments], 'next': next_cursor})
+
+
+@api.route('/search')
+@rate_limit('search')
+def search():
+    serialize = serializer(SearchHit)
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    if not query or not validate_input(query, 100, forbidden=SQL_TOKENS):
+        raise InvalidParameter('q must be 1 to 100 characters without SQL syntax')
+    per_page = page_size(Post.SEARCH_PAGE_SIZE)
+    last_page = Post.search_pages(per_page)
+    if not 1 <= page <= last_page:
+        raise InvalidParameter(f'page must be between 1 and {last_page}')
+    posts, has_next = Post.search(clean_text(query), page=page, per_page=per_page)
+    results = []
+    for post in posts:
+        item = serialize(post)
+        if 'snippet' in item:
+            item['snippet'] = highlight(item['snippet'])
+        results.append(item)
+    return jsonify({'posts': results, 'page': page, 'has_next': has_next})
+
+
+@api.route('/posts/export')
+@rate_limit('api_export')
+def export_posts():
+    """Every post as one JSON object per line, oldest first; ``after_id`` resumes an interrupted export."""
+    serialize = serializer(PostDetail)
+    after_id = request.args.get('after_id', 0, type=int)
+    batch_size = current_app.config['API_EXPORT_BATCH']
+    pool = current_app.extensions['db_read_pool']
+    sql = f'''
+        SELECT {PostDetail.COLUMNS}
+        FROM posts p
+        JOIN users u ON p.author_id = u.id
+        WHERE p.id > ?
+        ORDER BY p.id
+        LIMIT ?
+    '''
+
+    def generate(last_id):
+        while True:
+            # Соединение берется на одну пачку: медленный клиент не держит его и читающую транзакцию
+            conn = pool.acquire()
+            try:
+                rows = fetch(conn, PostDetail, sql, (last_id, batch_size)).fetchall()
+            finally:
+                pool.release(conn)
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield ''.join(json.dumps(serialize(row), ensure_ascii=False) + '\n' for row in rows).encode()
+            if len(rows) < batch_size:
+                return
+
+    return current_app.response_class(generate(after_id), mimetype='application/x-ndjson')
+
+
+@api.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+@api.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+def not_found(path):
+    # Иначе неизвестный путь попал бы в общий обработчик и получил HTML-редирект
+    return jsonify({'error': 'Not found'}), 404
+
+def init_app(app):
+    app.config.setdefault('API_COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('API_GZIP_LEVEL', 6)
+    app.config.setdefault('API_BROTLI_QUALITY', 5)
+    app.config.setdefault('API_EXPORT_BATCH', 500)
+    # Кириллица в \uXXXX занимает в шесть раз больше байт
+    app.json.ensure_ascii = False
+    app.register_blueprint(api)
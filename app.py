@@ -2,54 +2,95 @@ import os
 import logging
 import secrets
 from flask import Flask
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Загружаем переменные окружения
 load_dotenv()
 
-# Настройка логирования
-log_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-log_handler = RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=5)
-log_handler.setFormatter(log_formatter)
-log_handler.setLevel(logging.WARNING)  # Уровень WARNING для продакшена
+app = Flask(__name__, instance_path=os.environ.get('INSTANCE_PATH') or None)
 
+# Настройка логирования: запись в файл идет из отдельного потока через очередь
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'WARNING')  # Уровень WARNING для продакшена
+app.config['LOG_TARGET'] = os.environ.get('LOG_TARGET', 'file')  # file — файл на воркер, stderr — общий сборщик
+if os.environ.get('LOG_DIR'):
+    app.config['LOG_DIR'] = os.environ['LOG_DIR']
+
+import logconfig
+logconfig.init_app(app)
 logger = logging.getLogger()
-logger.setLevel(logging.WARNING)
-logger.addHandler(log_handler)
 
 if os.environ.get('FLASK_ENV') != 'development':
     logging.getLogger('werkzeug').setLevel(logging.WARNING)
 
-app = Flask(__name__)
 app.secret_key = os.environ['SESSION_SECRET']  # Обязательный ключ из .env
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))  # не меньше числа потоков gunicorn
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['PAGE_CACHE_BACKEND'] = os.environ.get('PAGE_CACHE_BACKEND', 'memory')  # filesystem — общий для воркеров
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 60))
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['HASH_MAX_PENDING'] = int(os.environ.get('HASH_MAX_PENDING', 2 * app.config['HASH_WORKERS']))
+app.config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE', 'memory')  # sqlite — общий для воркеров
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))  # за nginx — 1
+if app.config['TRUSTED_PROXIES']:
+    # Иначе remote_addr — адрес прокси: все клиенты делят одно ведро лимитера и проходят allowlist /metrics
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+if os.environ.get('RATE_LIMIT_ENABLED', '1') == '0':
+    app.config['RATE_LIMITS'] = {}  # только для нагрузочных тестов
+app.config['WRITE_QUEUE_ENABLED'] = os.environ.get('WRITE_QUEUE_ENABLED', '1') == '1'
+app.config['UPLOAD_VARIANT_WORKERS'] = int(os.environ.get('UPLOAD_VARIANT_WORKERS', 2))
+app.config['PROVISION_ON_STARTUP'] = os.environ.get('PROVISION_ON_STARTUP', '1') == '1'  # 0 — только flask provision
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None  # обязателен, если /metrics доступен через прокси
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # доля профилируемых запросов
+app.config['PROFILE_SLOW_THRESHOLD'] = float(os.environ.get('PROFILE_SLOW_THRESHOLD', 0.5))  # секунды
+app.config['PROFILER'] = os.environ.get('PROFILER', 'cprofile')  # или pyinstrument
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'  # только за nginx/apache с X-Sendfile
+app.config['TEMPLATE_BYTECODE_CACHE'] = os.environ.get('TEMPLATE_BYTECODE_CACHE', '1') == '1'  # instance/jinja_cache, общий для воркеров
+app.config['MAINTENANCE_SCHEDULER'] = os.environ.get('MAINTENANCE_SCHEDULER', '1') == '1'  # 0 — только flask maintenance (cron)
+app.config['SNAPSHOT_INTERVAL'] = int(os.environ.get('SNAPSHOT_INTERVAL', 3600))  # 0 — без снимков
+app.config['SNAPSHOT_READ_SCOPES'] = tuple(filter(None, os.environ.get('SNAPSHOT_READ_SCOPES', '').split(',')))  # search,admin
 
-# Настройка директории загрузок
-import stat
-upload_dir = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
-try:
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir, mode=0o750)
-    os.chmod(upload_dir, 0o750)
-    for filename in os.listdir(upload_dir):
-        file_path = os.path.join(upload_dir, filename)
-        if os.path.isfile(file_path):
-            os.chmod(file_path, 0o640)
-except OSError as e:
-    logger.error(f'Ошибка настройки директории загрузки: {e}')
-    raise
+import db
+import cache
+import conditional
+import passwords
+import ratelimit
+import writequeue
+import uploads
+import instrumentation
+import auth
+import templating
+import assets
+import maintenance
+import snapshots
+db.init_app(app)
+cache.init_app(app)
+conditional.init_app(app)
+passwords.init_app(app)
+ratelimit.init_app(app)
+writequeue.init_app(app)
+uploads.init_app(app)
+instrumentation.init_app(app)
+auth.init_app(app)
+templating.init_app(app)
+assets.init_app(app)
+snapshots.init_app(app)
+maintenance.init_app(app)
 
 # Добавление заголовков безопасности
 @app.after_request
 def add_security_headers(response):
+    # Собранные ассеты раздаются с нашего домена, CDN нужен только без сборки
+    cdn = '' if app.extensions['assets'] else ' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com'
     response.headers['Content-Security-Policy'] = (
         "default-src 'self'; "
-        "script-src 'self' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
-        "style-src 'self' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
+        f"script-src 'self'{cdn}; "
+        f"style-src 'self'{cdn}; "
         "img-src 'self' data:; "
-        "font-src 'self' https://cdnjs.cloudflare.com;"
+        f"font-src 'self'{' https://cdnjs.cloudflare.com' if cdn else ''};"
     )
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -58,16 +99,21 @@ def add_security_headers(response):
     response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
     return response
 
-from models import init_db
 from routes import *
+import api
+api.init_app(app)
+if app.config['TEMPLATE_PRECOMPILE']:
+    templating.compile_all(app)  # после routes: фильтры шаблонов уже зарегистрированы
+import commands
+import provisioning
 
-with app.app_context():
-    try:
-        init_db()
-        logger.info('База данных успешно инициализирована.')
-    except Exception as e:
-        logger.error(f'Ошибка инициализации базы данных: {e}')
-        raise
+# Схема, администратор и права на загрузки готовятся один раз (flask provision);
+# при обычном старте воркер только сверяет маркер
+try:
+    provisioning.init_app(app)
+except Exception as e:
+    logger.error(f'Ошибка инициализации базы данных: {e}')
+    raise
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=False)
@@ -0,0 +1,320 @@
+"""Static asset pipeline: vendored libraries, fingerprinted bundles, precompressed files.
+
+``flask build-assets`` downloads the third-party libraries the layout used to
+load from CDNs into ``static/vendor``, concatenates and minifies them together
+with ``style.css`` and ``script.js`` into ``app.<hash>.css`` / ``app.<hash>.js``
+in ``static/dist``, copies the fonts the CSS refers to under hashed names,
+writes ``.gz`` and ``.br`` siblings and a ``manifest.json``. Templates call ``asset_url('app.css')``;
+``/assets/<file>`` serves the precompressed sibling the client accepts, with
+a year-long immutable Cache-Control since the names change with the content.
+
+Every vendored file is checked against a pinned hash: the SRI hashes of the
+old layout in VENDOR, and sha384 hashes in ``static/vendor.lock.json`` for the
+rest (DOMPurify, the Font Awesome fonts). A file without a pin is refused;
+``--update-lock`` pins it only when a second, independent CDN (LOCK_MIRRORS)
+serves the same bytes, and the result is reviewed and committed.
+
+Without a build (a fresh checkout) ``asset_url`` returns None and the layout
+falls back to the CDN links and the unbundled files.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+import urllib.parse
+import urllib.request
+import brotli
+import rcssmin
+import rjsmin
+from flask import current_app, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+# Локальный путь (относительно static/vendor), URL и SRI-хэш из прежнего base.html
+VENDOR = [
+    ('bootstrap/bootstrap.min.css', 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+     'sha384-9ndCyUaIbzAi2FUVXJi0CjmCapSmO7SnpJef0486qhLnuZ2cdeRhO02iuK6FUUVM'),
+    ('bootstrap/bootstrap.bundle.min.js',
+     'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+     'sha384-geWF76RCwLtnZ8qwWowPQNguL3RmwHVBC9FhGdlKrxdiJJigb/j/68SIy3Te4Bkz'),
+    ('fontawesome/css/all.min.css', 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+     'sha512-9usAa10IRO0HhonpyAIVpjrylPvoDwiPUiKdWk5t3PyolY1cOd4DSE0Ga+ri4AuTroPR5aQvXU9xC6qOPnzFeg=='),
+    # script.js вызывает DOMPurify, но раньше он нигде не подключался
+    ('dompurify/purify.min.js', 'https://cdn.jsdelivr.net/npm/dompurify@3.0.6/dist/purify.min.js', None),
+]
+
+BUNDLES = {
+    'app.css': ['vendor/bootstrap/bootstrap.min.css', 'vendor/fontawesome/css/all.min.css', 'style.css'],
+    'app.js': ['vendor/bootstrap/bootstrap.bundle.min.js', 'vendor/dompurify/purify.min.js', 'script.js'],
+}
+
+VENDOR_LOCK = 'vendor.lock.json'
+LOCK_ALGORITHM = 'sha384'
+
+# Второй CDN для файлов без хэша в VENDOR: закрепляем только то, что совпало на обоих
+LOCK_MIRRORS = {
+    'https://cdn.jsdelivr.net/npm/dompurify@3.0.6/': 'https://unpkg.com/dompurify@3.0.6/',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/':
+        'https://cdn.jsdelivr.net/npm/@fortawesome/fontawesome-free@6.0.0/',
+}
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+COMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+
+class AssetError(Exception):
+    """A vendored file is missing, cannot be downloaded or does not match its hash."""
+
+
+def static_folder(app):
+    return app.static_folder
+
+
+def dist_folder(app):
+    return app.config['ASSETS_DIR']
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def integrity_of(data, algorithm=LOCK_ALGORITHM):
+    return f'{algorithm}-{base64.b64encode(hashlib.new(algorithm, data).digest()).decode()}'
+
+
+def check_integrity(data, integrity, name):
+    actual = integrity_of(data, integrity.partition('-')[0])
+    if actual != integrity:
+        raise AssetError(f'{name}: hash mismatch, got {actual}')
+
+
+def lock_path(app):
+    return os.path.join(static_folder(app), VENDOR_LOCK)
+
+
+def load_lock(app):
+    try:
+        with open(lock_path(app), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def download(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def mirror_url(url):
+    """The same file on the LOCK_MIRRORS counterpart of ``url``'s CDN, or None."""
+    for prefix, mirror in LOCK_MIRRORS.items():
+        if url.startswith(prefix):
+            return mirror + url[len(prefix):]
+    return None
+
+
+def vendor(app, offline=False, update_lock=False):
+    """Make sure every VENDOR file (and the fonts its CSS refers to) is in static/vendor; return the names fetched.
+
+    With ``update_lock`` files that have no pinned hash yet are pinned in the
+    lock file instead of being refused, provided the mirror serves the same bytes.
+    """
+    root = os.path.join(static_folder(app), 'vendor')
+    lock = load_lock(app)
+    fetched, pinned = [], []
+
+    def ensure(name, url, integrity=None):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+        elif offline:
+            raise AssetError(f'{name} is not vendored and downloads are disabled')
+        else:
+            data = download(url)
+            fetched.append(name)
+        integrity = integrity or lock.get(name)
+        if integrity is None:
+            if not update_lock:
+                raise AssetError(f'{name} has no pinned hash in {VENDOR_LOCK}; '
+                                 f'run flask build-assets --update-lock and review the result')
+            mirror = mirror_url(url)
+            if mirror is None or offline:
+                raise AssetError(f'{name} cannot be pinned: it needs a download from a second CDN')
+            if integrity_of(download(mirror)) != integrity_of(data):
+                raise AssetError(f'{name}: {url} and {mirror} serve different files, not pinning')
+            lock[name] = integrity = integrity_of(data)
+            pinned.append(name)
+        # Проверяем и уже лежащие файлы: правка руками не должна уйти в бандл незамеченной
+        check_integrity(data, integrity, name)
+        if name in fetched:
+            write_atomic(path, data)
+        return data
+
+    for name, url, integrity in VENDOR:
+        data = ensure(name, url, integrity)
+        if name.endswith('.css'):
+            for reference in css_references(data.decode('utf-8')):
+                font = posixpath.normpath(posixpath.join(posixpath.dirname(name), reference))
+                ensure(font, urllib.parse.urljoin(url, reference))
+    if pinned:
+        write_atomic(lock_path(app), (json.dumps(lock, indent=2, sort_keys=True) + '\n').encode())
+    return fetched
+
+
+def split_reference(reference):
+    """Split a url(...) target into the file path and its ``?query``/``#fragment``; None for non-local targets."""
+    if reference.startswith(('data:', 'http:', 'https:', '//', '#')):
+        return None
+    path = re.split(r'[?#]', reference, 1)[0]
+    return path, reference[len(path):]
+
+
+def css_references(css):
+    """Relative file paths referenced by url(...) in a stylesheet."""
+    references = (split_reference(reference) for _, reference in CSS_URL.findall(css))
+    return list(dict.fromkeys(reference[0] for reference in references if reference))
+
+
+def minify_css(css):
+    return rcssmin.cssmin(css)
+
+
+def minify_js(js):
+    return rjsmin.jsmin(js)
+
+
+def fingerprint(name, data):
+    stem, ext = posixpath.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def emit(app, name, data, manifest):
+    """Write a hashed file and its compressed siblings; record it in the manifest."""
+    hashed = fingerprint(name, data)
+    path = os.path.join(dist_folder(app), hashed)
+    if not os.path.exists(path):
+        write_atomic(path, data)
+        write_atomic(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        write_atomic(path + '.br', brotli.compress(data, quality=11))
+    manifest[name] = hashed
+    return hashed
+
+
+def bundle_css(app, sources, manifest):
+    static = static_folder(app)
+    parts = []
+    for source in sources:
+        path = os.path.join(static, source)
+        with open(path, encoding='utf-8') as f:
+            css = f.read()
+
+        def rewrite(match, source_dir=os.path.dirname(path)):
+            reference = split_reference(match.group(2))
+            if reference is None:
+                return match.group(0)
+            target, suffix = os.path.normpath(os.path.join(source_dir, reference[0])), reference[1]
+            with open(target, 'rb') as f:
+                hashed = emit(app, 'fonts/' + os.path.basename(target), f.read(), manifest)
+            # Бандл лежит в той же папке dist, поэтому ссылка относительная
+            return f'url({hashed}{suffix})'
+
+        css = CSS_URL.sub(rewrite, css)
+        parts.append(css if source.endswith('.min.css') else minify_css(css))
+    return '\n'.join(parts).encode('utf-8')
+
+
+def bundle_js(app, sources):
+    parts = []
+    for source in sources:
+        with open(os.path.join(static_folder(app), source), encoding='utf-8') as f:
+            js = f.read()
+        parts.append(js if source.endswith('.min.js') else minify_js(js))
+    # Точка с запятой между файлами: конец одного не должен продолжить выражение другого
+    return '\n;\n'.join(parts).encode('utf-8')
+
+
+def remove_stale(folder, keep):
+    """Delete files under ``folder`` (fonts/ included) whose path is not in ``keep``, and emptied directories."""
+    for root, dirs, files in os.walk(folder, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, folder).replace(os.sep, '/')
+            if re.sub(r'\.(gz|br)$', '', relative) not in keep:
+                os.unlink(path)
+        if root != folder and not os.listdir(root):
+            os.rmdir(root)
+
+
+def build(app, offline=False, clean=False):
+    """Vendor, bundle and fingerprint the assets; return the manifest."""
+    vendor(app, offline=offline)
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        data = bundle_css(app, sources, manifest) if name.endswith('.css') else bundle_js(app, sources)
+        emit(app, name, data, manifest)
+    folder = dist_folder(app)
+    write_atomic(os.path.join(folder, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    if clean:
+        remove_stale(folder, set(manifest.values()) | {'manifest.json'})
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def load_manifest(app):
+    try:
+        with open(os.path.join(dist_folder(app), 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def asset_url(name):
+    """URL of the fingerprinted build of ``name`` (e.g. ``'app.css'``), or None when assets are not built."""
+    hashed = current_app.extensions['assets'].get(name)
+    return url_for('asset', filename=hashed) if hashed else None
+
+
+def serve_asset(filename):
+    folder = dist_folder(current_app)
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        # Без abort: общий обработчик ошибок превратил бы 404 в редирект на HTML-страницу
+        return current_app.response_class('Not Found', status=404, mimetype='text/plain')
+    accepted = request.accept_encodings
+    name, encoding = filename, None
+    for candidate, suffix in COMPRESSED:
+        if accepted[candidate] and os.path.isfile(path + suffix):
+            name, encoding = filename + suffix, candidate
+            break
+    # Тип по исходному имени, иначе для .gz/.br отдался бы application/gzip
+    response = send_from_directory(folder, name, conditional=True,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                   max_age=current_app.config['ASSETS_MAX_AGE'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+    app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+    app.extensions['assets'] = load_manifest(app)
+    # Страницы ссылаются на хэшированные имена: новая сборка должна сменить ETag и ключи кэша страниц
+    if app.extensions['assets']:
+        manifest = json.dumps(app.extensions['assets'], sort_keys=True).encode()
+        app.config['ETAG_SALT'] += hashlib.sha1(manifest).hexdigest()[:12]
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
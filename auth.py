@@ -0,0 +1,115 @@
+"""The signed-in user and the route decorators that check it.
+
+The session only stores the user id. ``current_user()`` resolves it once per
+request (memoized on ``g``) through a small per-worker LRU cache whose key
+also carries the user's version stamp. Stamps live in a small file store in
+``AUTH_STAMP_DIR`` shared by every worker on the host, whatever the page
+cache backend: ``invalidate_user`` bumps the stamp after a role change (also
+from ``flask set-admin``, a separate process), so the next request in any
+worker loads the user from the database again.
+"""
+import functools
+import logging
+import os
+import sqlite3
+from flask import current_app, flash, g, jsonify, redirect, request, session, url_for
+from cache import FileSystemCache, LRUCache
+from db import get_read_db
+from readmodels import SessionUser, fetch
+
+
+def _user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def load_user(user_id):
+    """Return the SessionUser for ``user_id`` or None, going to the database only on a cache miss.
+
+    Raises ``sqlite3.Error`` when the database cannot be read.
+    """
+    cache = current_app.extensions['user_cache']
+    stamp = current_app.extensions['user_stamps'].get(_user_tag(user_id)) or 0
+    key = f'{user_id}:{stamp}'
+    user = cache.get(key)
+    if user is None:
+        # Ошибку БД не глотаем: вызывающий должен отличать её от удаленного пользователя
+        user = fetch(get_read_db(), SessionUser, f'SELECT {SessionUser.COLUMNS} FROM users WHERE id = ?',
+                     (user_id,)).fetchone()
+        # Удаленного пользователя тоже запоминаем, чтобы не ходить в БД с каждой его сессией
+        cache.set(key, user or False)
+    return user or None
+
+
+def current_user():
+    """Return the signed-in SessionUser for this request, or None."""
+    if '_current_user' not in g:
+        user_id = session.get('user_id')
+        try:
+            user = load_user(user_id) if isinstance(user_id, int) else None
+        except sqlite3.Error as e:
+            # БД временно недоступна: запрос идет как анонимный, но из сессии не выходим
+            logging.error(f'Could not load user {user_id}: {e}')
+            user, user_id = None, None
+        if user is None and user_id is not None:
+            session.clear()  # пользователь удален: сессия больше недействительна
+        g._current_user = user
+    return g._current_user
+
+
+def invalidate_user(user_id):
+    """Forget cached copies of a user in every worker after their role or account changed."""
+    current_app.extensions['user_stamps'].incr(_user_tag(user_id))
+
+
+def _wants_json(json_response):
+    return json_response or request.is_json
+
+
+def _guard(view, json_response, check):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = check(_wants_json(json_response))
+        return denied if denied is not None else view(*args, **kwargs)
+    return wrapper
+
+
+def _require_login(as_json):
+    if current_user() is not None:
+        return None
+    if as_json:
+        return jsonify({'message': 'Login required'}), 401
+    flash('Необходимо войти в систему!', 'danger')
+    return redirect(url_for('login'))
+
+
+def _require_admin(as_json):
+    denied = _require_login(as_json)
+    if denied is not None or current_user().is_admin:
+        return denied
+    if as_json:
+        return jsonify({'message': 'Permission denied'}), 403
+    flash('Недостаточно прав доступа!', 'danger')
+    return redirect(url_for('index'))
+
+
+def login_required(view=None, *, json_response=False):
+    """Let only signed-in users through; others are redirected to the login page (401 for JSON)."""
+    if view is None:
+        return functools.partial(login_required, json_response=json_response)
+    return _guard(view, json_response, _require_login)
+
+
+def admin_required(view=None, *, json_response=False):
+    """Let only administrators through; others are redirected (401/403 for JSON)."""
+    if view is None:
+        return functools.partial(admin_required, json_response=json_response)
+    return _guard(view, json_response, _require_admin)
+
+
+def init_app(app):
+    app.config.setdefault('AUTH_CACHE_TTL', 30)
+    app.config.setdefault('AUTH_CACHE_MAX_ENTRIES', 4096)
+    app.config.setdefault('AUTH_STAMP_DIR', os.path.join(app.instance_path, 'user_stamps'))
+    app.extensions['user_stamps'] = FileSystemCache(app.config['AUTH_STAMP_DIR'], default_ttl=0)
+    app.extensions['user_cache'] = LRUCache(app.config['AUTH_CACHE_MAX_ENTRIES'], app.config['AUTH_CACHE_TTL'])
+    app.context_processor(lambda: {'current_user': current_user()})
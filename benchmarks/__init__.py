@@ -0,0 +1,32 @@
+"""Benchmarks for the blog storage and request paths.
+
+Each module is runnable on its own, e.g. ``python -m benchmarks.read_concurrency``,
+and works against a throwaway database so ``blog.db`` is never touched.
+"""
+import contextlib
+import os
+import statistics
+import tempfile
+
+
+@contextlib.contextmanager
+def scratch_database():
+    """Create an initialized database in a temporary directory and chdir into it."""
+    from models import init_db
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as tmpdir:
+        os.chdir(tmpdir)
+        try:
+            init_db()
+            yield os.path.join(tmpdir, 'blog.db')
+        finally:
+            os.chdir(cwd)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    """Return the requested percentiles of a list of latencies."""
+    if len(samples) < 2:
+        return {p: (samples[0] if samples else 0.0) for p in points}
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {p: cuts[p - 1] for p in points}
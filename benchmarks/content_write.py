@@ -0,0 +1,65 @@
+"""Write-path micro-benchmarks for post and comment bodies.
+
+Compares the old per-submission ``bleach.clean`` calls and per-call
+validation with the shared cleaners of ``content``. ``prepare_body`` also
+renders the HTML body and the excerpt, which is work reads no longer do.
+
+    python -m benchmarks.content_write --number 2000
+"""
+import argparse
+import re
+import timeit
+
+import bleach
+
+import content
+
+COMMENT = 'Отличный пост! <strong>Спасибо</strong> за подробный разбор, жду продолжения.'
+POST = '\n\n'.join(
+    f'Абзац {i}: <em>быстрый</em> разбор кэша, <strong>индексов</strong> и <script>alert({i})</script> '
+    'пула соединений SQLite; ещё немного текста для объёма & проверки экранирования.\n'
+    'Вторая строка абзаца с <a href="javascript:void(0)">ссылкой</a>.'
+    for i in range(12))
+
+
+def old_validate(input_str, max_length, pattern=None):
+    if not input_str or len(input_str.strip()) == 0 or len(input_str) > max_length:
+        return False
+    if pattern and not re.match(pattern, input_str):
+        return False
+    dangerous_chars = [';', '--', '/*', '*/', '<', '>', '"', "'", '&']
+    if any(char in input_str for char in dangerous_chars):
+        return False
+    return True
+
+
+CASES = [
+    ('validate username, per-call list', lambda: old_validate('reader_42', 50, r'^[\w]+$')),
+    ('validate username, compiled', lambda: content.validate_input('reader_42', 50, content.USERNAME_PATTERN)),
+    ('comment, bleach.clean per call',
+     lambda: bleach.clean(COMMENT, tags=['p', 'br', 'strong', 'em'], strip=True)),
+    ('comment, shared Cleaner', lambda: content.clean_html(COMMENT)),
+    ('comment, prepare_body', lambda: content.prepare_body(COMMENT)),
+    ('post, bleach.clean per call',
+     lambda: bleach.clean(POST, tags=['p', 'br', 'strong', 'em'], strip=True)),
+    ('post, shared Cleaner', lambda: content.clean_html(POST)),
+    ('post, prepare_body + excerpt', lambda: content.prepare_body(POST, 200)),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    content.clean_html('')  # первое обращение импортирует bleach и строит очистители
+    print(f'post body: {len(POST)} chars, comment: {len(COMMENT)} chars')
+    print(f'{"case":<36} {"us/call":>9}')
+    for name, fn in CASES:
+        best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+        print(f'{name:<36} {best / args.number * 1e6:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
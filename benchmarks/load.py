@@ -0,0 +1,427 @@
+"""Load test of the blog routes through the Flask test client or a local gunicorn.
+
+A throwaway data directory is seeded with ``benchmarks.seed``, then
+``--concurrency`` virtual users run a weighted mix of ``index``,
+``view_post``, ``search``, ``add_comment`` and ``login`` for ``--seconds``
+and the throughput and p50/p95/p99 latency of each route are reported.
+Forms are submitted with a real CSRF token and session cookie; only the
+measured request is timed, not the page fetched to get the token.
+
+Recorded traffic can be replayed instead of the mix. Each line of the file
+is a JSON object like ``{"method": "POST", "path": "/post/3/comment",
+"data": {...}, "name": "add_comment", "status": 302}``; only ``path`` is
+required and POSTs get a CSRF token when the data has none.
+
+``--output`` writes the results as JSON; ``--baseline`` compares against
+such a file and exits with status 1 when a route got slower or lower in
+throughput by more than ``--tolerance``.
+
+    python -m benchmarks.load --target gunicorn --workers 4 --threads 4 --concurrency 32 --seconds 30
+    python -m benchmarks.load --mix index=70,view_post=25,add_comment=5 --output before.json
+    python -m benchmarks.load --replay traffic.jsonl --baseline before.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from benchmarks import percentiles
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'index=40,view_post=35,search=15,add_comment=7,login=3'
+
+CSRF_TOKEN = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+
+ROUTE_PATTERNS = (
+    (re.compile(r'^/$|^/\?'), 'index'),
+    (re.compile(r'^/post/\d+/comment'), 'add_comment'),
+    (re.compile(r'^/post/\d+'), 'view_post'),
+    (re.compile(r'^/search'), 'search'),
+    (re.compile(r'^/login'), 'login'),
+    (re.compile(r'^/register'), 'register'),
+    (re.compile(r'^/uploads/'), 'uploaded_file'),
+)
+
+
+class HTTPClient:
+    """Keep-alive HTTP client with a minimal cookie jar, one per virtual user."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Сервер закрыл keep-alive соединение: повторяем один раз на новом
+            self.conn.close()
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        payload = response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return response.status, payload
+
+    def close(self):
+        self.conn.close()
+
+
+class FlaskClient:
+    """The same interface over the Flask test client, in process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class VirtualUser:
+    def __init__(self, make_client, dataset, seed):
+        self.make_client = make_client
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.client = make_client()
+        self._token = None
+
+    def csrf_token(self, client=None):
+        if client is not None or self._token is None:
+            status, body = (client or self.client).request('GET', '/login')
+            match = CSRF_TOKEN.search(body)
+            if not match:
+                raise RuntimeError(f'No CSRF token on /login (status {status})')
+            if client is not None:
+                return match.group(1).decode()
+            self._token = match.group(1).decode()
+        return self._token
+
+    def random_post(self):
+        first, last = self.dataset['posts']
+        # Как и в seed: популярные посты получают большую часть просмотров
+        return first + int((last - first + 1) * self.rng.random() ** 3)
+
+    def close(self):
+        self.client.close()
+
+
+def scenario_index(user):
+    return user.client, 'GET', '/', None, (200,)
+
+
+def scenario_view_post(user):
+    return user.client, 'GET', f'/post/{user.random_post()}', None, (200,)
+
+
+def scenario_search(user):
+    from benchmarks.seed import WORDS
+    return user.client, 'GET', '/search?' + urlencode({'q': user.rng.choice(WORDS)}), None, (200,)
+
+
+def scenario_add_comment(user):
+    data = {'csrf_token': user.csrf_token(), 'author_name': 'load test',
+            'content': f'Комментарий нагрузочного теста {user.rng.random():.6f}'}
+    return user.client, 'POST', f'/post/{user.random_post()}/comment', data, (302,)
+
+
+def scenario_login(user):
+    from benchmarks.seed import BENCHMARK_PASSWORD
+    # Вход выполняет отдельный клиент, чтобы остальные сценарии оставались анонимными
+    client = user.make_client()
+    data = {'csrf_token': user.csrf_token(client), 'username': f'user{user.rng.randrange(user.dataset["users"])}',
+            'password': BENCHMARK_PASSWORD}
+    return client, 'POST', '/login', data, (302,)
+
+
+SCENARIOS = {
+    'index': scenario_index,
+    'view_post': scenario_view_post,
+    'search': scenario_search,
+    'add_comment': scenario_add_comment,
+    'login': scenario_login,
+}
+
+
+def route_name(path):
+    for pattern, name in ROUTE_PATTERNS:
+        if pattern.search(path):
+            return name
+    return path.split('?', 1)[0]
+
+
+def load_replay(path):
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry.setdefault('method', 'POST' if entry.get('data') else 'GET')
+                entry.setdefault('name', route_name(entry['path']))
+                entries.append(entry)
+    return entries
+
+
+def replay_scenario(entries):
+    lock = threading.Lock()
+    cycle = itertools.cycle(entries)
+
+    def scenario(user):
+        with lock:
+            entry = next(cycle)
+        data = dict(entry['data']) if entry.get('data') is not None else None
+        if entry['method'].upper() == 'POST' and data is not None and 'csrf_token' not in data:
+            data['csrf_token'] = user.csrf_token()
+        expected = (entry['status'],) if 'status' in entry else None
+        return user.client, entry['method'].upper(), entry['path'], data, expected, entry['name']
+
+    return scenario
+
+
+def run(make_client, dataset, pick, concurrency, seconds, warmup):
+    """Drive ``concurrency`` virtual users; return ``{route: [(latency, status, ok), ...]}``."""
+    results = [dict() for _ in range(concurrency)]
+    started = threading.Event()
+    deadline = [0.0, 0.0]
+
+    def virtual_user(slot):
+        user = VirtualUser(make_client, dataset, seed=slot)
+        started.wait()
+        try:
+            while time.monotonic() < deadline[1]:
+                name, prepared = pick(user)
+                client, method, path, data, expected = prepared[:5]
+                name = prepared[5] if len(prepared) > 5 else name
+                request_started = time.perf_counter()
+                try:
+                    status, _ = client.request(method, path, data)
+                except (http.client.HTTPException, OSError):
+                    status = 0
+                latency = time.perf_counter() - request_started
+                if client is not user.client:
+                    client.close()
+                if time.monotonic() < deadline[0]:
+                    continue
+                ok = status in expected if expected else 0 < status < 500
+                results[slot].setdefault(name, []).append((latency, status, ok))
+        finally:
+            user.close()
+
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    now = time.monotonic()
+    deadline[:] = [now + warmup, now + warmup + seconds]
+    started.set()
+    for thread in threads:
+        thread.join()
+
+    merged = {}
+    for per_user in results:
+        for name, samples in per_user.items():
+            merged.setdefault(name, []).extend(samples)
+    return merged
+
+
+def summarize(samples, seconds):
+    summary = {}
+    for name, rows in sorted(samples.items()):
+        latencies = [latency for latency, _, _ in rows]
+        p = percentiles(latencies, points=(50, 95, 99))
+        summary[name] = {
+            'requests': len(rows),
+            'rps': len(rows) / seconds,
+            'p50_ms': p[50] * 1000,
+            'p95_ms': p[95] * 1000,
+            'p99_ms': p[99] * 1000,
+            'errors': sum(1 for _, _, ok in rows if not ok),
+            'rate_limited': sum(1 for _, status, _ in rows if status == 429),
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f'{"route":<14} {"requests":>9} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7} {"429":>5}')
+    for name, row in summary.items():
+        print(f'{name:<14} {row["requests"]:>9} {row["rps"]:>9.1f} {row["p50_ms"]:>8.2f} '
+              f'{row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f} {row["errors"]:>7} {row["rate_limited"]:>5}')
+
+
+def compare(summary, baseline, tolerance):
+    """Return the regressions of ``summary`` against a previous run."""
+    regressions = []
+    for name, before in baseline.items():
+        after = summary.get(name)
+        if after is None:
+            continue
+        if after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95_ms"]:.2f} -> {after["p95_ms"]:.2f} ms')
+        if after['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {before["rps"]:.1f} -> {after["rps"]:.1f} req/s')
+    return regressions
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f'Unknown route in --mix: {name!r} (known: {", ".join(SCENARIOS)})')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not listen on port {port} within {timeout}s')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def dataset_of(database):
+    from db import connect
+    conn = connect(database, readonly=True)
+    try:
+        first, last = conn.execute('SELECT MIN(id), MAX(id) FROM posts').fetchone()
+        users = conn.execute("SELECT COUNT(*) FROM users WHERE email LIKE '%@bench.local'").fetchone()[0]
+    finally:
+        conn.close()
+    return {'posts': (first or 1, last or 1), 'users': max(users, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('testclient', 'gunicorn'), default='testclient')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Route weights (default {DEFAULT_MIX}).')
+    parser.add_argument('--replay', help='JSON-lines file of recorded requests to replay instead of the mix.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--database', help='Use a copy of this database instead of seeding one.')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--rate-limits', action='store_true', help='Keep the per-IP rate limits on.')
+    parser.add_argument('--output', help='Write the results as JSON.')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='blog-load-') as tmpdir:
+        database = os.path.join(tmpdir, 'blog.db')
+        env = {
+            'SESSION_SECRET': 'benchmark',
+            'DATABASE_PATH': database,
+            'UPLOAD_FOLDER': os.path.join(tmpdir, 'uploads'),
+            'INSTANCE_PATH': os.path.join(tmpdir, 'instance'),
+            'RATE_LIMIT_ENABLED': '1' if args.rate_limits else '0',
+        }
+        # db.DATABASE читается при импорте, поэтому окружение выставляется до импорта приложения
+        os.environ.update(env)
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        process = None
+        try:
+            if args.database:
+                from db import connect
+                source = connect(os.path.join(cwd, args.database), readonly=True)
+                target = connect(database)
+                source.backup(target)
+                source.close()
+                target.close()
+            else:
+                from benchmarks.seed import seed
+                started = time.perf_counter()
+                counts = seed(database, args.users, args.posts, args.comments)
+                print('seeded users {}, posts {}, comments {}'.format(*counts),
+                      f'in {time.perf_counter() - started:.1f}s')
+            dataset = dataset_of(database)
+
+            if args.target == 'gunicorn':
+                port = free_port()
+                process = subprocess.Popen(
+                    [sys.executable, '-m', 'gunicorn', '--pythonpath', REPO_ROOT, '-w', str(args.workers),
+                     '--threads', str(args.threads), '-b', f'127.0.0.1:{port}', '--log-level', 'warning',
+                     'app:app'],
+                    cwd=tmpdir, env=dict(os.environ, **env))
+                wait_for_port(port, process)
+                make_client = lambda: HTTPClient('127.0.0.1', port)  # noqa: E731
+            else:
+                from app import app
+                make_client = lambda: FlaskClient(app)  # noqa: E731
+
+            if args.replay:
+                scenario = replay_scenario(load_replay(os.path.join(cwd, args.replay)))
+                pick = lambda user: (None, scenario(user))  # noqa: E731
+            else:
+                mix = parse_mix(args.mix)
+                names, weights = list(mix), list(mix.values())
+
+                def pick(user):
+                    name = user.rng.choices(names, weights)[0]
+                    return name, SCENARIOS[name](user)
+
+            samples = run(make_client, dataset, pick, args.concurrency, args.seconds, args.warmup)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+            os.chdir(cwd)
+
+    summary = summarize(samples, args.seconds)
+    print(f'{args.target}, concurrency {args.concurrency}, {args.seconds:g}s')
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'target': args.target, 'concurrency': args.concurrency, 'routes': summary}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f)['routes'], args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
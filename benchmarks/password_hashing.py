@@ -0,0 +1,69 @@
+"""Login hashing throughput versus PBKDF2 cost, inline versus the hashing pool.
+
+For each iteration count, ``--clients`` threads verify passwords for
+``--seconds`` either on the calling thread (the old login path) or through
+``passwords.HashingExecutor``. Rejected attempts are the 429s the pool
+hands out once ``--max-pending`` jobs are in flight.
+
+    python -m benchmarks.password_hashing --iterations 100000 600000
+"""
+import argparse
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from benchmarks import percentiles
+from passwords import HashingBusy, HashingExecutor
+
+
+def run(verify, password_hash, clients, seconds):
+    stop = threading.Event()
+    latencies, rejected = [], [0]
+
+    def client():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                verify(password_hash, 'correct horse battery')
+            except HashingBusy:
+                rejected[0] += 1
+                time.sleep(0.001)
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    p = percentiles(latencies)
+    return len(latencies) / seconds, p[50], p[99], rejected[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, nargs='+', default=[100000, 300000, 600000])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    executor = HashingExecutor(workers=args.workers, max_pending=args.max_pending, timeout=30)
+    try:
+        print(f'{"iterations":>10} {"mode":>7} {"logins/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"rejected":>9}')
+        for iterations in args.iterations:
+            password_hash = generate_password_hash('correct horse battery', f'pbkdf2:sha256:{iterations}')
+            for mode, verify in (('inline', check_password_hash),
+                                 ('pool', lambda h, p: executor.run(check_password_hash, h, p))):
+                rate, p50, p99, rejected = run(verify, password_hash, args.clients, args.seconds)
+                print(f'{iterations:>10} {mode:>7} {rate:>9.1f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {rejected:>9}')
+    finally:
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Read throughput of the feed query while a writer keeps posting comments.
+
+Compares the old rollback-journal setup against the WAL configuration from
+``db.STORAGE_PRAGMAS`` with read-only reader connections.
+
+    python -m benchmarks.read_concurrency --readers 4 --seconds 5
+"""
+import argparse
+import sqlite3
+import threading
+import time
+
+from benchmarks import scratch_database, percentiles
+from db import STORAGE_PRAGMAS, connect
+
+LEGACY_PRAGMAS = {'journal_mode': 'DELETE', 'foreign_keys': 'ON'}
+
+FEED_QUERY = '''
+    SELECT p.*, u.username
+    FROM posts p
+    JOIN users u ON p.author_id = u.id
+    ORDER BY p.created_at DESC
+    LIMIT 20
+'''
+
+
+def seed(path, pragmas, posts):
+    conn = connect(path, pragmas=pragmas)
+    conn.executemany(
+        'INSERT INTO posts (title, content, author_id) VALUES (?, ?, 1)',
+        [(f'Post {i}', 'lorem ipsum ' * 200) for i in range(posts)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def run(path, pragmas, readonly, readers, seconds):
+    stop = threading.Event()
+    reads, read_latencies, writes, locked = [0] * readers, [], [0], [0]
+
+    def reader(slot):
+        conn = connect(path, pragmas=pragmas, readonly=readonly)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(FEED_QUERY).fetchall()
+            except sqlite3.OperationalError:
+                locked[0] += 1
+                continue
+            read_latencies.append(time.perf_counter() - started)
+            reads[slot] += 1
+        conn.close()
+
+    def writer():
+        conn = connect(path, pragmas=pragmas)
+        while not stop.is_set():
+            try:
+                conn.execute('INSERT INTO comments (post_id, author_name, content) VALUES (1, ?, ?)',
+                             ('bench', 'comment ' * 20))
+                conn.commit()
+                writes[0] += 1
+            except sqlite3.OperationalError:
+                locked[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    p = percentiles(read_latencies)
+    print(f'  reads/s {sum(reads) / seconds:10.1f}   writes/s {writes[0] / seconds:8.1f}   '
+          f'read p50 {p[50] * 1000:.2f}ms p99 {p[99] * 1000:.2f}ms   lock errors {locked[0]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--posts', type=int, default=2000)
+    args = parser.parse_args()
+
+    for label, pragmas, readonly in (('rollback journal', LEGACY_PRAGMAS, False),
+                                     ('WAL + read-only readers', STORAGE_PRAGMAS, True)):
+        with scratch_database() as path:
+            seed(path, pragmas, args.posts)
+            print(f'{label}:')
+            run(path, pragmas, readonly, args.readers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
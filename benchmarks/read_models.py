@@ -0,0 +1,91 @@
+"""Time and memory per 10k rows: ``SELECT *`` into sqlite3.Row versus the read models.
+
+Each case fetches the same rows the way the code used to (every column,
+``sqlite3.Row``, or a ``User`` built field by field) and the way it does now
+(an explicit projection built straight into a slotted read model). Memory is
+what the fetched list keeps alive, measured with ``tracemalloc``.
+
+    python -m benchmarks.read_models --rows 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.seed import seed
+from db import connect
+from models import User
+from readmodels import AdminCommentRow, CommentView, FeedCard, fetch
+
+
+def old_users(conn, limit):
+    users = []
+    for user_data in conn.execute('SELECT * FROM users LIMIT ?', (limit,)).fetchall():
+        users.append(User(user_data['id'], user_data['username'], user_data['email'],
+                          user_data['password_hash'], user_data['is_admin']))
+    return users
+
+
+def new_users(conn, limit):
+    return [User(*row) for row in conn.execute(f'SELECT {User.COLUMNS} FROM users LIMIT ?', (limit,))]
+
+
+CASES = [
+    ('feed cards', lambda conn, limit: conn.execute('''
+        SELECT p.*, u.username FROM posts p JOIN users u ON p.author_id = u.id
+        ORDER BY p.created_at DESC, p.id DESC LIMIT ?''', (limit,)).fetchall(),
+     lambda conn, limit: fetch(conn, FeedCard, f'''
+        SELECT {FeedCard.COLUMNS} FROM posts p JOIN users u ON p.author_id = u.id
+        ORDER BY p.created_at DESC, p.id DESC LIMIT ?''', (limit,)).fetchall()),
+    ('comments', lambda conn, limit: conn.execute(
+        'SELECT * FROM comments ORDER BY created_at, id LIMIT ?', (limit,)).fetchall(),
+     lambda conn, limit: fetch(conn, CommentView, f'SELECT {CommentView.COLUMNS} FROM comments '
+                               'ORDER BY created_at, id LIMIT ?', (limit,)).fetchall()),
+    ('admin comments', lambda conn, limit: conn.execute(
+        'SELECT * FROM comments ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall(),
+     lambda conn, limit: fetch(conn, AdminCommentRow, f'SELECT {AdminCommentRow.COLUMNS} FROM comments '
+                               'ORDER BY created_at DESC, id DESC LIMIT ?', (limit,)).fetchall()),
+    ('users', old_users, new_users),
+]
+
+
+def measure(fn, conn, limit, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = fn(conn, limit)
+        best = min(best, time.perf_counter() - started)
+        del rows
+    tracemalloc.start()
+    rows = fn(conn, limit)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(rows), best, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as tmpdir:
+        path = os.path.join(tmpdir, 'blog.db')
+        # Пароль хэшируется один раз на всех пользователей; дешевый метод, чтобы не ждать
+        seed(path, users=args.rows, posts=args.rows, comments=args.rows, password_method='pbkdf2:sha256:1000')
+        conn = connect(path)
+        try:
+            print(f'{"case":<16} {"variant":<12} {"rows":>6} {"ms/10k":>8} {"KiB/10k":>9}')
+            for name, old, new in CASES:
+                for variant, fn in (('SELECT *', old), ('read model', new)):
+                    count, seconds, retained = measure(fn, conn, args.rows, args.repeat)
+                    scale = 10000 / max(count, 1)
+                    print(f'{name:<16} {variant:<12} {count:>6} {seconds * 1000 * scale:8.1f} '
+                          f'{retained / 1024 * scale:9.0f}')
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Template compile and render times over a 1k-post feed.
+
+Compiles every template from source and from a warm bytecode cache, then
+renders ``index.html`` with ``--posts`` feed cards for an anonymous and a
+signed-in visitor, and the card loop alone the old way (``url_for`` and
+``csrf_token()`` per card) against the hoisted ``url_for_each`` version.
+
+    python -m benchmarks.render --posts 1000 --number 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OLD_LOOP = '''{% for post in posts %}
+<a href="{{ url_for('view_post', post_id=post.id) }}">{{ post.title }}</a>
+{% if post.image_path %}<img src="{{ url_for('uploaded_file', filename=post.image_path, variant='thumb') }}">{% endif %}
+<a href="{{ url_for('view_post', post_id=post.id) }}">Читать далее</a>
+<form action="{{ url_for('delete_post', post_id=post.id) }}" method="POST">
+<input type="hidden" name="csrf_token" value="{{ csrf_token() }}"></form>
+{% endfor %}'''
+
+HOISTED_LOOP = '''{% set post_href = url_for_each('view_post', 'post_id') %}
+{% set thumb_src = url_for_each('uploaded_file', 'filename', variant='thumb') %}
+{% set delete_href = url_for_each('delete_post', 'post_id') %}
+{% set csrf = csrf_token() %}
+{% for post in posts %}
+<a href="{{ post_href(post.id) }}">{{ post.title }}</a>
+{% if post.image_path %}<img src="{{ thumb_src(post.image_path) }}">{% endif %}
+<a href="{{ post_href(post.id) }}">Читать далее</a>
+<form action="{{ delete_href(post.id) }}" method="POST">
+<input type="hidden" name="csrf_token" value="{{ csrf }}"></form>
+{% endfor %}'''
+
+
+def feed(count):
+    from readmodels import FeedCard
+    return [FeedCard(i, f'Пост номер {i} о производительности шаблонов', 'Короткий анонс поста. ' * 8,
+                     f'{i:064x}.png' if i % 3 == 0 else None, '2025-01-01 12:00:00', i % 17, None, f'user{i % 50}')
+            for i in range(count, 0, -1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as tmpdir:
+        os.chdir(tmpdir)  # как startup.py: импорт app не должен трогать файлы репозитория
+        os.environ.update(SESSION_SECRET='benchmark', DATABASE_PATH=os.path.join(tmpdir, 'blog.db'),
+                          UPLOAD_FOLDER=os.path.join(tmpdir, 'uploads'),
+                          INSTANCE_PATH=os.path.join(tmpdir, 'instance'))
+        sys.path.insert(0, REPO_ROOT)
+        from flask import g, render_template, session
+        from app import app
+        from readmodels import SessionUser
+        import templating
+
+        def compile_cold(bytecode_cache):
+            app.jinja_env.cache.clear()
+            app.jinja_env.bytecode_cache = bytecode_cache
+            return templating.compile_all(app)[1]
+
+        warm_cache = app.jinja_env.bytecode_cache  # заполнен при импорте app (TEMPLATE_PRECOMPILE)
+        count = len(app.jinja_env.list_templates(extensions=('html',)))
+        print(f'compile {count} templates:')
+        for name, cache in (('from source', None), ('from bytecode cache', warm_cache)):
+            best = min(compile_cold(cache) for _ in range(args.repeat))
+            print(f'  {name:<24} {best * 1000:8.1f} ms')
+
+        posts = feed(args.posts)
+        old_loop, hoisted_loop = app.jinja_env.from_string(OLD_LOOP), app.jinja_env.from_string(HOISTED_LOOP)
+
+        def report(name, fn):
+            fn()
+            best = min(timeit.repeat(fn, number=args.number, repeat=args.repeat))
+            print(f'  {name:<28} {best / args.number * 1000:8.2f}')
+
+        def index():
+            return render_template('index.html', posts=posts, total_posts=len(posts))
+
+        print(f'render with {args.posts} posts (ms per render):')
+        with app.test_request_context('/'):
+            report('index.html, anonymous', index)
+        with app.test_request_context('/'):
+            session['user_id'] = 1
+            g._current_user = SessionUser(1, 'admin', 1)
+            report('index.html, signed in', index)
+            report('card loop, per-card url_for', lambda: old_loop.render(posts=posts))
+            report('card loop, hoisted', lambda: hoisted_loop.render(posts=posts))
+
+
+if __name__ == '__main__':
+    main()
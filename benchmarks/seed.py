@@ -0,0 +1,99 @@
+"""Seed a database with deterministic synthetic users, posts and comments.
+
+Bodies go through ``content.prepare_body`` like real submissions, comments
+are skewed towards a few popular posts, and every user shares the password
+``BENCHMARK_PASSWORD`` so login traffic can be replayed.
+
+    python -m benchmarks.seed --database /tmp/blog.db --users 1000 --posts 20000 --comments 200000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from content import prepare_body
+from db import connect
+from migrations import migrate
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+WORDS = ('sqlite', 'кэш', 'индекс', 'flask', 'gunicorn', 'запрос', 'пагинация', 'поиск', 'шаблон',
+         'производительность', 'транзакция', 'журнал', 'python', 'профилирование', 'нагрузка',
+         'блог', 'комментарий', 'сессия', 'пул', 'соединение', 'оптимизация', 'latency', 'throughput')
+
+BATCH = 5000
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def body(rng, paragraphs):
+    return '\n\n'.join(' '.join(sentence(rng, rng.randint(6, 14)) for _ in range(rng.randint(2, 5)))
+                       + (' <strong>' + rng.choice(WORDS) + '</strong>' if rng.random() < 0.3 else '')
+                       for _ in range(paragraphs))
+
+
+def seed(path, users=100, posts=1000, comments=10000, seed=42, password_method='pbkdf2:sha256'):
+    """Create or extend the database at ``path``; returns the ``(users, posts, comments)`` counts."""
+    rng = random.Random(seed)
+    conn = connect(path)
+    try:
+        migrate(conn)
+        password_hash = generate_password_hash(BENCHMARK_PASSWORD, password_method)
+        start = datetime(2024, 1, 1)
+
+        conn.executemany(
+            'INSERT OR IGNORE INTO users (username, email, password_hash, created_at) VALUES (?, ?, ?, ?)',
+            ((f'user{i}', f'user{i}@bench.local', password_hash,
+              (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'))
+             for i in range(users)))
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE email LIKE '%@bench.local'")]
+
+        # Несколько десятков вариантов текста: bleach на каждый из 100 тыс. постов занял бы минуты
+        bodies = [prepare_body(body(rng, rng.randint(2, 6)), 200) for _ in range(50)]
+        for offset in range(0, posts, BATCH):
+            conn.executemany(
+                'INSERT INTO posts (title, content, content_html, excerpt, content_text, author_id, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((sentence(rng, rng.randint(3, 8))[:200], *rng.choice(bodies), rng.choice(user_ids),
+                  (start + timedelta(minutes=5 * i)).strftime('%Y-%m-%d %H:%M:%S'))
+                 for i in range(offset, min(posts, offset + BATCH))))
+            conn.commit()
+        post_ids = [row[0] for row in conn.execute('SELECT id FROM posts ORDER BY id')]
+
+        comment_bodies = [prepare_body(sentence(rng, rng.randint(4, 20))) for _ in range(50)]
+        for offset in range(0, comments if post_ids else 0, BATCH):
+            rows = []
+            for i in range(offset, min(comments, offset + BATCH)):
+                # Степенное распределение: немногие посты собирают большую часть комментариев
+                post_id = post_ids[int(len(post_ids) * rng.random() ** 3)]
+                source, html, *_ = rng.choice(comment_bodies)
+                rows.append((post_id, f'reader {i % 997}', source, html,
+                             (start + timedelta(minutes=5 * len(post_ids), seconds=i)).strftime('%Y-%m-%d %H:%M:%S')))
+            conn.executemany(
+                'INSERT INTO comments (post_id, author_name, content, content_html, created_at) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+            conn.commit()
+
+        return tuple(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                     for table in ('users', 'posts', 'comments'))
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', required=True, help='Database file to create or extend.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--comments', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    counts = seed(args.database, args.users, args.posts, args.comments, args.seed)
+    print('users {}, posts {}, comments {} in {}'.format(*counts, args.database))
+
+
+if __name__ == '__main__':
+    main()
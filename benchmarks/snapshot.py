@@ -0,0 +1,115 @@
+"""Comment insert latency while the database is being backed up.
+
+A writer thread commits one comment at a time (as Comment.create does
+without the write queue) while the main thread copies a ``--posts`` post
+database over and over for ``--seconds``:
+
+* ``throttled backup`` — ``snapshots.backup`` with the default step size and sleep;
+* ``one-step backup`` — the backup API copying everything in a single step;
+* ``locked file copy`` — what a hand-made backup has to do: hold the write
+  lock (``BEGIN IMMEDIATE``) while copying the file.
+
+    python -m benchmarks.snapshot --posts 20000 --seconds 5
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from benchmarks import percentiles, scratch_database
+from db import STORAGE_PRAGMAS, connect
+import snapshots
+
+INSERT = 'INSERT INTO comments (post_id, author_name, content) VALUES (?, ?, ?)'
+PARAMS = (1, 'bench', 'a short benchmark comment')
+
+
+def seed(path, posts):
+    conn = connect(path)
+    conn.executemany('INSERT INTO posts (title, content, author_id) VALUES (?, ?, 1)',
+                     ((f'Post {i}', f'Body of post {i}. ' * 120) for i in range(posts)))
+    conn.commit()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+
+
+def locked_copy(source, target):
+    conn = connect(source)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # Без WAL копия файла базы неполна, поэтому копируются оба
+        shutil.copyfile(source, target)
+        if os.path.exists(source + '-wal'):
+            shutil.copyfile(source + '-wal', target + '-wal')
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def run(path, copy, seconds, pause):
+    stop = threading.Event()
+    latencies, errors = [], [0]
+
+    def writer():
+        conn = connect(path, pragmas=STORAGE_PRAGMAS)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(INSERT, PARAMS)
+                conn.commit()
+            except sqlite3.Error:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            time.sleep(pause)
+        conn.close()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    copies, copy_time, deadline = 0, 0.0, time.monotonic() + seconds
+    target = os.path.join(os.path.dirname(path), 'copy.db')
+    try:
+        while time.monotonic() < deadline:
+            if copy is None:
+                time.sleep(0.05)
+                continue
+            started = time.perf_counter()
+            copy(path, target)
+            copy_time += time.perf_counter() - started
+            copies += 1
+    finally:
+        stop.set()
+        thread.join()
+    p = percentiles(latencies)
+    copy_line = f'   copy {copy_time / copies * 1000:8.1f}ms x{copies}' if copies else ''
+    print(f'  commits {len(latencies):6d}   p50 {p[50] * 1000:6.2f}ms   p99 {p[99] * 1000:7.2f}ms   '
+          f'max {max(latencies) * 1000:7.2f}ms   errors {errors[0]}{copy_line}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pause', type=float, default=0.002, help='writer sleep between commits, seconds')
+    parser.add_argument('--pages', type=int, default=256, help='pages per throttled backup step')
+    parser.add_argument('--sleep', type=float, default=0.005, help='sleep between throttled steps, seconds')
+    args = parser.parse_args()
+
+    with scratch_database() as path:
+        seed(path, args.posts)
+        print(f'database {os.path.getsize(path) / 2 ** 20:.1f} MiB')
+        scenarios = [
+            ('no backup', None),
+            ('throttled backup', lambda source, target: snapshots.backup(source, target, args.pages, args.sleep)),
+            ('one-step backup', lambda source, target: snapshots.backup(source, target, -1, 0)),
+            ('locked file copy', locked_copy),
+        ]
+        for name, copy in scenarios:
+            print(f'{name}:')
+            run(path, copy, args.seconds, args.pause)
+
+
+if __name__ == '__main__':
+    main()
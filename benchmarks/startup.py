@@ -0,0 +1,71 @@
+"""Worker boot time: first boot, re-provisioning boot and ordinary boot.
+
+Each boot is a fresh interpreter importing ``app`` against a throwaway data
+directory holding ``--uploads`` files. The first boot provisions (schema,
+admin hash, permission walk); a re-provisioning boot removes the marker
+first, which is what every boot used to cost; an ordinary boot only checks
+the marker.
+
+    python -m benchmarks.startup --uploads 20000 --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import sys, time
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started, 'bleach' in sys.modules, 'PIL' in sys.modules)
+'''
+
+
+def boot(tmpdir):
+    env = dict(os.environ,
+               SESSION_SECRET='benchmark',
+               DATABASE_PATH=os.path.join(tmpdir, 'blog.db'),
+               UPLOAD_FOLDER=os.path.join(tmpdir, 'uploads'),
+               INSTANCE_PATH=os.path.join(tmpdir, 'instance'),
+               PYTHONPATH=REPO_ROOT)
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=tmpdir, env=env, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[0]), output[1] == 'True', output[2] == 'True'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=5000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='blog-bench-') as tmpdir:
+        upload_dir = os.path.join(tmpdir, 'uploads')
+        os.makedirs(upload_dir)
+        for i in range(args.uploads):
+            with open(os.path.join(upload_dir, f'{i:064x}.jpg'), 'wb') as f:
+                f.write(b'\xff\xd8\xff')
+        marker = os.path.join(tmpdir, 'instance', 'provisioned')
+
+        first, _, _ = boot(tmpdir)
+        forced, warm = [], []
+        for _ in range(args.runs):
+            os.unlink(marker)
+            forced.append(boot(tmpdir)[0])
+        for _ in range(args.runs):
+            seconds, bleach_loaded, pillow_loaded = boot(tmpdir)
+            warm.append(seconds)
+
+    print(f'{args.uploads} uploads, median of {args.runs} boots (import app)')
+    print(f'{"first boot":>24} {first * 1000:9.1f} ms')
+    print(f'{"re-provisioning boot":>24} {statistics.median(forced) * 1000:9.1f} ms')
+    print(f'{"ordinary boot":>24} {statistics.median(warm) * 1000:9.1f} ms')
+    print(f'bleach imported at boot: {bleach_loaded}, Pillow imported at boot: {pillow_loaded}')
+
+
+if __name__ == '__main__':
+    main()
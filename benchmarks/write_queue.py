@@ -0,0 +1,82 @@
+"""Comment insert throughput: one commit per row versus the group-commit queue.
+
+``--writers`` threads insert comments for ``--seconds``. In ``per-row`` mode
+each thread has its own connection and commits every INSERT, as
+Comment.create used to; in ``queue`` mode they all go through
+``writequeue.WriteQueue``.
+
+    python -m benchmarks.write_queue --writers 16 --seconds 5
+"""
+import argparse
+import sqlite3
+import threading
+import time
+
+from benchmarks import scratch_database, percentiles
+from db import STORAGE_PRAGMAS, connect
+from writequeue import WriteQueue
+
+INSERT = 'INSERT INTO comments (post_id, author_name, content) VALUES (?, ?, ?)'
+PARAMS = (1, 'bench', 'a short benchmark comment')
+
+
+def run(insert, writers, seconds):
+    stop = threading.Event()
+    latencies, errors = [], [0]
+
+    def writer():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                insert()
+            except sqlite3.Error:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    p = percentiles(latencies)
+    print(f'  comments/s {len(latencies) / seconds:10.1f}   p50 {p[50] * 1000:.2f}ms   '
+          f'p99 {p[99] * 1000:.2f}ms   errors {errors[0]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--synchronous', default='FULL', help='PRAGMA synchronous for both modes')
+    parser.add_argument('--window', type=float, default=0.0, help='group-commit batch window in seconds')
+    args = parser.parse_args()
+    pragmas = dict(STORAGE_PRAGMAS, synchronous=args.synchronous)
+
+    with scratch_database() as path:
+        conn = connect(path, pragmas=pragmas)
+        conn.execute("INSERT INTO posts (title, content, author_id) VALUES ('bench', 'bench', 1)")
+        conn.commit()
+        conn.close()
+
+        local = threading.local()
+
+        def per_row():
+            if not hasattr(local, 'conn'):
+                local.conn = connect(path, pragmas=pragmas)
+            local.conn.execute(INSERT, PARAMS)
+            local.conn.commit()
+
+        print('per-row commit:')
+        run(per_row, args.writers, args.seconds)
+
+        write_queue = WriteQueue(path, pragmas=pragmas, batch_window=args.window)
+        print('group-commit queue:')
+        run(lambda: write_queue.execute(INSERT, PARAMS), args.writers, args.seconds)
+        write_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Rendered-page cache for anonymous traffic.
+
+Pages are stored under keys that embed the current generation of each of
+their tags (``feed``, ``post:<id>``). Invalidating a tag bumps its
+generation, so exactly the pages carrying that tag stop matching without
+enumerating keys. The in-process ``memory`` backend is per worker; use the
+``filesystem`` backend to share pages and invalidations between gunicorn
+workers.
+"""
+import fcntl
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, get_flashed_messages, make_response, request, session
+from flask_wtf.csrf import generate_csrf
+
+CSRF_PLACEHOLDER = '__PAGE_CACHE_CSRF_TOKEN__'
+
+
+class NullCache:
+    """Backend that stores nothing; used when caching is disabled."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry TTL."""
+
+    def __init__(self, max_entries=512, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._counters = {}  # счетчики не вытесняются вместе со страницами
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+
+class FileSystemCache:
+    """Cache shared by every worker on the host, one pickle file per key."""
+
+    def __init__(self, directory, default_ttl=60):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                value, expires_at = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((value, expires_at), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def incr(self, key):
+        # Блокировка файла, чтобы воркеры не потеряли инкремент друг друга
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                value = (self.get(key) or 0) + 1
+                self.set(key, value, ttl=0)
+                return value
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def create_backend(app):
+    backend = app.config['PAGE_CACHE_BACKEND']
+    ttl = app.config['PAGE_CACHE_TTL']
+    if backend == 'memory':
+        return LRUCache(app.config['PAGE_CACHE_MAX_ENTRIES'], ttl)
+    if backend == 'filesystem':
+        return FileSystemCache(app.config['PAGE_CACHE_DIR'], ttl)
+    if backend in (None, 'null', 'none'):
+        return NullCache()
+    raise ValueError(f'Unknown PAGE_CACHE_BACKEND: {backend!r}')
+
+
+def get_cache():
+    return current_app.extensions['page_cache']
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def invalidate(*tags):
+    """Drop every cached page carrying one of ``tags``."""
+    cache = get_cache()
+    for tag in tags:
+        cache.incr(_tag_key(tag))
+
+
+def generation(tag):
+    """Return the current generation of ``tag``; it grows by one on every ``invalidate``."""
+    return get_cache().get(_tag_key(tag)) or 0
+
+
+def is_cacheable_request():
+    """Only anonymous GETs without pending flash messages share a cached page."""
+    return (request.method == 'GET'
+            and 'user_id' not in session
+            and '_flashes' not in session)
+
+
+def page_key(tags):
+    generations = '.'.join(str(generation(tag)) for tag in tags)
+    # Соль меняется с шаблонами и сборкой ассетов: после деплоя старые страницы не отдаются
+    return f'page:{current_app.config.get("ETAG_SALT", "")}:{request.full_path}:{generations}'
+
+
+def cached_page(*tag_templates):
+    """Cache the rendered page of a view for anonymous visitors.
+
+    ``tag_templates`` are formatted with the view arguments, e.g.
+    ``cached_page('post:{post_id}')``. The CSRF token embedded in forms is
+    swapped for a placeholder before storing and re-issued on every hit.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            if not is_cacheable_request():
+                return view(**view_args)
+
+            key = page_key([tag.format(**view_args) for tag in tag_templates])
+            cache = get_cache()
+            body = cache.get(key)
+            if body is not None:
+                if CSRF_PLACEHOLDER in body:
+                    body = body.replace(CSRF_PLACEHOLDER, generate_csrf())
+                response = make_response(body)
+                response.headers['X-Page-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(**view_args))
+            # Страница с flash-сообщением (например, об ошибке БД) в кэш не попадает
+            if response.status_code == 200 and is_cacheable_request() and not get_flashed_messages():
+                body = response.get_data(as_text=True)
+                token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+                if token:
+                    body = body.replace(token, CSRF_PLACEHOLDER)
+                cache.set(key, body)
+                response.headers['X-Page-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('PAGE_CACHE_BACKEND', 'memory')
+    app.config.setdefault('PAGE_CACHE_TTL', 60)
+    app.config.setdefault('PAGE_CACHE_MAX_ENTRIES', 512)
+    app.config.setdefault('PAGE_CACHE_DIR', os.path.join(app.instance_path, 'page_cache'))
+    app.extensions['page_cache'] = create_backend(app)
@@ -0,0 +1,231 @@
+import os
+import sqlite3
+import time
+import click
+from app import app
+from migrations import LATEST_VERSION, check_query_plans, get_version, migrate
+from models import Post, User, get_db_connection, reconcile_comment_counts, render_stored_content
+import assets
+import auth
+import maintenance
+import provisioning
+import snapshots
+import templating
+import uploads
+
+
+@app.cli.command('provision')
+@click.option('--force', is_flag=True, help='Run every step even if the marker is current.')
+def provision_command(force):
+    """Run one-time provisioning: upload permissions, schema migrations, admin account, rendered bodies."""
+    if force:
+        try:
+            os.unlink(provisioning.marker_path(app))
+        except FileNotFoundError:
+            pass
+    timings = provisioning.provision(app)
+    if not timings:
+        click.echo('Already provisioned.')
+    for step, seconds in timings:
+        click.echo(f'  {step}: {seconds * 1000:.1f} ms')
+
+
+@app.cli.command('set-admin')
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='Take admin rights away instead of granting them.')
+def set_admin_command(username, revoke):
+    """Grant (or revoke) admin rights and drop the cached copies of the user."""
+    user_id = User.set_admin(username, not revoke)
+    if user_id is None:
+        raise click.ClickException(f'No user named {username!r}.')
+    auth.invalidate_user(user_id)
+    click.echo(f'{username}: admin rights {"revoked" if revoke else "granted"}.')
+
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the shared bytecode cache (run at build or deploy time)."""
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE is disabled.')
+    app.jinja_env.bytecode_cache.clear()
+    app.jinja_env.cache.clear()
+    count, seconds = templating.compile_all(app)
+    click.echo(f'Compiled {count} templates into {app.config["TEMPLATE_CACHE_DIR"]} in {seconds * 1000:.1f} ms.')
+
+
+@app.cli.command('build-assets')
+@click.option('--offline', is_flag=True, help='Fail instead of downloading libraries missing from static/vendor.')
+@click.option('--clean', is_flag=True, help='Delete builds not in the new manifest (pages cached before the '
+                                             'deploy still reference them).')
+@click.option('--update-lock', is_flag=True, help='Pin the sha384 of vendored files that have no pinned hash yet '
+                                                   '(checked against a second CDN; review and commit static/vendor.lock.json).')
+def build_assets_command(offline, clean, update_lock):
+    """Vendor third-party libraries and build the fingerprinted, precompressed CSS/JS bundles."""
+    try:
+        fetched = assets.vendor(app, offline=offline, update_lock=update_lock)
+        manifest = assets.build(app, offline=True, clean=clean)
+    except (assets.AssetError, OSError) as e:
+        raise click.ClickException(str(e))
+    for name in fetched:
+        click.echo(f'  vendored {name}')
+    folder = app.config['ASSETS_DIR']
+    for name in assets.BUNDLES:
+        path = os.path.join(folder, manifest[name])
+        sizes = [os.path.getsize(path + suffix) for suffix in ('', '.gz', '.br') if os.path.exists(path + suffix)]
+        click.echo(f'  {manifest[name]}: {" / ".join(f"{size:,} B" for size in sizes)}')
+    click.echo(f'{len(manifest)} files in {folder}; restart the workers to pick up the new manifest.')
+
+
+@app.cli.command('maintenance')
+@click.argument('jobs', nargs=-1, type=click.Choice(list(maintenance.JOBS)))
+@click.option('--force', is_flag=True, help='Run the jobs even if their interval has not passed.')
+@click.option('--status', is_flag=True, help='Only show the last run of every job.')
+def maintenance_command(jobs, force, status):
+    """Run maintenance jobs (by default every scheduled job that is due) and report their durations."""
+    if status:
+        for job in maintenance.JOBS:
+            state = maintenance.last_run(app, job)
+            if state is None:
+                click.echo(f'  {job:<12} never run')
+                continue
+            started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['started_at']))
+            click.echo(f'  {job:<12} {started} {state["duration"] * 1000:9.1f} ms '
+                       f'{"ok" if state["ok"] else "FAILED"}: {state["result"]}')
+        return
+    failed = False
+    for job in jobs or [job for job, (_, interval) in maintenance.JOBS.items() if interval]:
+        state = maintenance.run_job(app, job, force=force or bool(jobs))
+        if state is None:
+            click.echo(f'  {job:<12} skipped (not due or running elsewhere)')
+            continue
+        failed |= not state['ok']
+        click.echo(f'  {job:<12} {state["duration"] * 1000:9.1f} ms {"ok" if state["ok"] else "FAILED"}: '
+                   f'{state["result"]}')
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command('snapshot')
+@click.option('--to', 'target', type=click.Path(dir_okay=False), help='Write a one-off backup to this path instead.')
+@click.option('--list', 'show', is_flag=True, help='List the published snapshots.')
+def snapshot_command(target, show):
+    """Back up the live database without stopping the app, publishing it as the current snapshot."""
+    if show:
+        for path in snapshots.list_snapshots(app):
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(path)))
+            click.echo(f'  {os.path.basename(path)}  {stamp}  {os.path.getsize(path):,} B')
+        return
+    started = time.perf_counter()
+    try:
+        if target:
+            pages = snapshots.backup(app.config['DATABASE'], target, app.config['SNAPSHOT_PAGES_PER_STEP'],
+                                     app.config['SNAPSHOT_STEP_SLEEP'])
+            result = f'{target}: {pages} pages, {os.path.getsize(target):,} B'
+        else:
+            state = maintenance.run_job(app, 'snapshot', force=True)
+            if state is None:
+                raise click.ClickException('Another process is taking a snapshot right now.')
+            if not state['ok']:
+                raise click.ClickException(state['result'])
+            result = state['result']
+    except (snapshots.SnapshotError, sqlite3.Error, OSError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{result} in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+
+@app.cli.command('restore')
+@click.argument('snapshot')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore_command(snapshot, yes):
+    """Replace the live database with SNAPSHOT (a path or a file name from SNAPSHOT_DIR, e.g. current.db)."""
+    path = snapshots.resolve_snapshot(app, snapshot)
+    if not os.path.isfile(path):
+        raise click.ClickException(f'No such snapshot: {snapshot}')
+    if not yes:
+        click.confirm(f'Replace {app.config["DATABASE"]} with {path}? Writes made since it was taken are lost',
+                      abort=True)
+    started = time.perf_counter()
+    try:
+        safety = snapshots.restore(app, path)
+    except (snapshots.SnapshotError, sqlite3.Error, OSError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Restored {os.path.basename(path)} in {(time.perf_counter() - started) * 1000:.1f} ms; '
+               f'the previous database was saved to {safety}.')
+    # Кэши страниц, пользователей и счетчиков в воркерах помнят старые данные
+    click.echo('Restart the workers so their in-memory caches are dropped.')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the posts full-text search index from scratch."""
+    count = Post.rebuild_search_index()
+    click.echo(f'Search index rebuilt for {count} posts.')
+
+
+@app.cli.command('migrate')
+@click.option('--target', type=int, default=LATEST_VERSION, help='Schema version to migrate to.')
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    conn = get_db_connection()
+    try:
+        click.echo(f'Schema version: {get_version(conn)}')
+        for version, description in migrate(conn, target):
+            click.echo(f'  applied {version}: {description}')
+        click.echo(f'Schema version: {get_version(conn)} (latest {LATEST_VERSION})')
+    finally:
+        conn.close()
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query no longer uses an index (EXPLAIN QUERY PLAN)."""
+    conn = get_db_connection()
+    try:
+        problems = check_query_plans(conn)
+    finally:
+        conn.close()
+    for name, plan in problems.items():
+        click.echo(f'{name}:', err=True)
+        for line in plan:
+            click.echo(f'    {line}', err=True)
+    if problems:
+        raise click.ClickException(f'{len(problems)} hot queries are not using an index.')
+    click.echo('All hot queries use an index.')
+
+
+@app.cli.command('reconcile-comment-counts')
+def reconcile_comment_counts_command():
+    """Rebuild posts.comment_count and posts.last_comment_at from the comments table."""
+    fixed = reconcile_comment_counts()
+    click.echo(f'Comment counters corrected on {fixed} posts.')
+
+
+@app.cli.command('render-content')
+def render_content_command():
+    """Render the stored HTML body of posts and comments saved without one."""
+    rendered = render_stored_content()
+    click.echo(f'Rendered {rendered} posts and comments.')
+
+
+@app.cli.command('generate-image-variants')
+@click.option('--force', is_flag=True, help='Rebuild variants that already exist.')
+def generate_image_variants_command(force):
+    """Build resized and WebP variants for uploaded images that lack them."""
+    if uploads.pillow() is None:
+        raise click.ClickException('Pillow is not installed.')
+    folder = uploads.upload_folder()
+    built = 0
+    for name in sorted(os.listdir(folder)):
+        stem, ext = os.path.splitext(name)
+        if name.startswith('.') or ext.lstrip('.') not in uploads.SAVE_FORMATS:
+            continue
+        if any(stem.endswith(f'-{variant}') for variant in uploads.VARIANTS):
+            continue
+        if not force and os.path.exists(os.path.join(folder, uploads.variant_name(name, 'thumb'))):
+            continue
+        try:
+            uploads.generate_variants(folder, name)
+            built += 1
+        except OSError as e:
+            click.echo(f'{name}: {e}', err=True)
+    click.echo(f'Variants built for {built} images.')
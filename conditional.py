@@ -0,0 +1,95 @@
+"""Conditional GET support (ETag / Last-Modified) for server-rendered pages.
+
+Validators are derived from the ``content_versions`` counters that the
+database triggers bump on every post and comment change, so a matching
+``If-None-Match`` is answered with 304 before the view queries or renders
+anything.
+"""
+import functools
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from flask import current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+from auth import current_user
+from models import ContentVersion
+
+
+def templates_fingerprint(app):
+    """Fingerprint the template files so a deploy with new markup changes every ETag."""
+    digest = hashlib.sha1()
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()[:12]
+
+
+def _viewer_fingerprint(private):
+    """Part of the ETag that depends on who is looking at the page.
+
+    Pages for signed-in users and pages with forms embed a session-bound CSRF
+    token, which also expires; both the token seed and a time bucket go in.
+    """
+    user = current_user()
+    if not private and user is None:
+        return ''
+    csrf_seed = session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'), '')
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 0
+    bucket = int(time.time() // (time_limit // 2)) if time_limit else 0
+    viewer = f'{user.id}:{user.username}:{user.is_admin}' if user else ''
+    return f'{viewer}:{csrf_seed}:{bucket}'
+
+
+def conditional_page(*key_templates, private=False):
+    """Answer conditional GETs for a page built from the given content version keys.
+
+    ``key_templates`` are formatted with the view arguments, e.g.
+    ``conditional_page('post:{post_id}', private=True)``. ``private`` marks
+    pages that always embed a per-session CSRF token.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            # Flash-сообщения одноразовые: такие ответы не кэшируем
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(**view_args)
+
+            keys = [key.format(**view_args) for key in key_templates]
+            versions = ContentVersion.get_many(keys)
+            viewer = _viewer_fingerprint(private)
+            shared = not viewer
+            raw = '|'.join([current_app.config['ETAG_SALT'], request.full_path, viewer]
+                           + [f'{key}={versions.get(key, (0, None))[0]}' for key in keys])
+            etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+            last_modified = None
+            stamps = [stamp for _, stamp in versions.values() if stamp]
+            if shared and stamps:
+                last_modified = datetime.strptime(max(stamps), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**view_args))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            if shared:
+                response.cache_control.public = True
+            else:
+                response.cache_control.private = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('ETAG_SALT', templates_fingerprint(app))
+    app.config.setdefault('UPLOAD_MAX_AGE', 365 * 24 * 3600)
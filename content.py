@@ -0,0 +1,102 @@
+"""Validation and sanitizing of user-submitted text, done once at write time.
+
+Posts and comments are cleaned with a preconfigured ``bleach.Cleaner`` when
+they are saved, and the rendered HTML body and the plain-text excerpt are
+stored next to the source, so pages only output stored strings. bleach
+cleaners keep parser state and are not thread-safe, so each thread builds
+its own pair on first use; bleach itself is imported lazily to keep worker
+boot fast.
+"""
+import html
+import re
+import threading
+from collections import namedtuple
+
+ALLOWED_TAGS = frozenset({'p', 'br', 'strong', 'em'})
+
+# Шаблоны компилируются один раз при импорте
+USERNAME_PATTERN = re.compile(r'^[\w]+$')
+EMAIL_PATTERN = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+AUTHOR_NAME_PATTERN = re.compile(r'^[\w\s]+$')
+
+SQL_TOKENS = re.compile(r';|--|/\*|\*/')
+MARKUP_AND_SQL_TOKENS = re.compile(r'''[;<>"'&]|--|/\*|\*/''')
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_BLOCK_START = re.compile(r'^\s*<p>', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+_TAG = re.compile(r'<[^>]*>')
+
+Body = namedtuple('Body', 'source html excerpt text')
+
+_local = threading.local()
+
+
+def validate_input(text, max_length, pattern=None, forbidden=MARKUP_AND_SQL_TOKENS):
+    """Check that ``text`` is non-blank, fits ``max_length`` and matches the compiled ``pattern``.
+
+    ``forbidden`` rejects characters that have no business in identifiers;
+    free text that goes through the cleaner passes ``forbidden=None``.
+    """
+    if not text or not text.strip() or len(text) > max_length:
+        return False
+    if pattern is not None and not pattern.match(text):
+        return False
+    if forbidden is not None and forbidden.search(text):
+        return False
+    return True
+
+
+def _cleaners():
+    cleaners = getattr(_local, 'cleaners', None)
+    if cleaners is None:
+        from bleach.sanitizer import Cleaner
+        cleaners = _local.cleaners = (
+            Cleaner(tags=ALLOWED_TAGS, attributes={}, protocols=(), strip=True, strip_comments=True),
+            Cleaner(tags=(), attributes={}, protocols=(), strip=True, strip_comments=True),
+        )
+    return cleaners
+
+
+def clean_html(text):
+    """Keep only the allowed tags, without attributes; everything else is escaped."""
+    return _cleaners()[0].clean(text)
+
+
+def clean_text(text):
+    """Strip all markup and return plain text, to be escaped by the template."""
+    return html.unescape(_cleaners()[1].clean(text)).strip()
+
+
+def render_html(cleaned):
+    """Turn blank-line separated paragraphs and line breaks of cleaned text into HTML."""
+    if _BLOCK_START.match(cleaned):
+        return cleaned
+    paragraphs = [part.strip() for part in _PARAGRAPH_BREAK.split(cleaned.replace('\r\n', '\n'))]
+    return '\n'.join('<p>' + part.replace('\n', '<br>\n') + '</p>' for part in paragraphs if part)
+
+
+def plain_text(cleaned):
+    """Cleaned markup as plain text: tags dropped, entities decoded, whitespace collapsed."""
+    # В очищенном тексте каждый «<» — начало разрешенного тега, остальное экранировано,
+    # поэтому второй проход bleach не нужен
+    return html.unescape(_WHITESPACE.sub(' ', _TAG.sub(' ', cleaned))).strip()
+
+
+def make_excerpt(text, length):
+    """Excerpt of plain ``text`` of at most ``length`` characters, cut at a word boundary."""
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(' ', 1)[0] or text[:length]
+    return cut.rstrip(' .,;:') + '…'
+
+
+def prepare_body(text, excerpt_length=None):
+    """Clean a post or comment body and render it; ``excerpt`` is None without a length.
+
+    ``text`` is the plain text of the body, unescaped, for the search index.
+    """
+    source = clean_html(text).strip()
+    plain = plain_text(source)
+    excerpt = make_excerpt(plain, excerpt_length) if excerpt_length else None
+    return Body(source, render_html(source), excerpt, plain)
@@ -0,0 +1,176 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from flask import g, current_app
+
+DATABASE = os.environ.get('DATABASE_PATH', 'blog.db')
+
+# Применяются к каждому соединению; journal_mode сохраняется в самом файле БД
+STORAGE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'foreign_keys': 'ON',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -16000,  # в КиБ, около 16 МБ на соединение
+    'temp_store': 'MEMORY',
+}
+
+
+# Задаются один раз, при создании файла: auto_vacuum действует, только если выставлен до перехода
+# в WAL и до первой таблицы; существующей базе нужен flask maintenance vacuum-full
+NEW_DATABASE_PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+}
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+def connect(database=DATABASE, timeout=10, pragmas=None, readonly=False, factory=sqlite3.Connection,
+            immutable=False):
+    """Open a new SQLite connection configured the way the application expects.
+
+    Read-only connections are opened through a ``mode=ro`` URI and skip
+    pragmas that would need to write to the database file. ``immutable``
+    (read-only files that nothing ever changes, such as snapshots) also
+    skips all file locking.
+    """
+    if readonly:
+        conn = sqlite3.connect(f'file:{os.path.abspath(database)}?mode=ro{"&immutable=1" if immutable else ""}',
+                               timeout=timeout, check_same_thread=False, uri=True, factory=factory)
+    else:
+        is_new = not os.path.exists(database) or os.path.getsize(database) == 0
+        conn = sqlite3.connect(database, timeout=timeout, check_same_thread=False, factory=factory)
+        if is_new:
+            for name, value in NEW_DATABASE_PRAGMAS.items():
+                conn.execute(f'PRAGMA {name} = {value}')
+    conn.row_factory = sqlite3.Row
+    for name, value in (STORAGE_PRAGMAS if pragmas is None else pragmas).items():
+        if readonly and name == 'journal_mode':
+            continue
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections shared by the threads of one worker."""
+
+    def __init__(self, database=DATABASE, size=8, timeout=10, health_check_interval=30,
+                 pragmas=None, readonly=False, factory=sqlite3.Connection, immutable=False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.pragmas = pragmas
+        self.readonly = readonly
+        self.immutable = immutable
+        self.factory = factory
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+        self._pid = os.getpid()
+
+    def _connect(self):
+        return connect(self.database, timeout=self.timeout, pragmas=self.pragmas, readonly=self.readonly,
+                       factory=self.factory, immutable=self.immutable)
+
+    def _is_healthy(self, conn, idle_since):
+        """Ping connections that sat idle longer than the health check interval."""
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _reset_after_fork(self):
+        # Соединения SQLite нельзя переиспользовать после fork() (gunicorn preload)
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._pid = os.getpid()
+
+    def acquire(self):
+        """Check out a connection, opening a new one if no idle connection is available."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No free database connection after {self.timeout}s')
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_healthy(conn, idle_since):
+                    return conn
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any unfinished transaction."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait((conn, time.monotonic()))
+        except (sqlite3.Error, queue.Full):
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Close every idle connection held by the pool."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+def get_db():
+    """Return the connection bound to the current app context, checking one out on first use."""
+    if 'db' not in g:
+        g.db = current_app.extensions['db_pool'].acquire()
+    return g.db
+
+
+def get_read_db():
+    """Return the read-only connection bound to the current app context.
+
+    Reads on this connection never take the write lock, so in WAL mode they
+    proceed while another connection is committing.
+    """
+    if 'read_db' not in g:
+        g.read_db = current_app.extensions['db_read_pool'].acquire()
+    return g.read_db
+
+
+def close_db(exc=None):
+    for key, pool in (('db', 'db_pool'), ('read_db', 'db_read_pool')):
+        conn = g.pop(key, None)
+        if conn is not None:
+            current_app.extensions[pool].release(conn)
+
+
+def init_app(app):
+    """Create the read-write and read-only pools and release connections on teardown."""
+    app.config.setdefault('DATABASE', DATABASE)
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10)
+    app.config.setdefault('DB_HEALTH_CHECK_INTERVAL', 30)
+    app.config.setdefault('SQLITE_PRAGMAS', STORAGE_PRAGMAS)
+    for key, readonly in (('db_pool', False), ('db_read_pool', True)):
+        app.extensions[key] = ConnectionPool(
+            app.config['DATABASE'],
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            health_check_interval=app.config['DB_HEALTH_CHECK_INTERVAL'],
+            pragmas=app.config['SQLITE_PRAGMAS'],
+            readonly=readonly,
+        )
+    app.teardown_appcontext(close_db)
@@ -1,4 +1,5 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, TextAreaField, SubmitField, EmailField
 from wtforms.validators import DataRequired, Length, Email, Regexp
 
@@ -21,4 +22,5 @@ class CommentForm(FlaskForm):
 class PostForm(FlaskForm):
     title = StringField('Заголовок', validators=[DataRequired(), Length(min=1, max=200)])
     content = TextAreaField('Содержание', validators=[DataRequired(), Length(min=1, max=10000)])
+    image = FileField('Изображение', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif'], 'Только PNG, JPEG или GIF!')])
     submit = SubmitField('Создать пост')
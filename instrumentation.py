@@ -0,0 +1,388 @@
+"""Per-request latency, SQL and template timing, exported in Prometheus text format.
+
+Pool connections are opened with ``InstrumentedConnection``, which times
+every statement (execute plus fetch) and counts it against the current
+request. Template render time comes from Flask's template signals. The
+numbers are kept per worker process and served at ``/metrics``; a request
+that runs the same statement many times (an N+1 loop) is logged as soon as
+it finishes. An opt-in sampling profiler dumps the profile of slow requests.
+
+``/metrics`` answers only addresses in ``METRICS_ALLOWED_IPS`` (loopback by
+default). Behind a reverse proxy on the same host every request comes from
+loopback, so either set ``TRUSTED_PROXIES`` (the real client address is then
+checked), set ``METRICS_TOKEN`` (scrapers send ``Authorization: Bearer
+<token>``), or keep ``/metrics`` out of the proxied locations.
+"""
+import hmac
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request, template_rendered, before_render_template
+import maintenance
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label tuple."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted(self._series.items())
+        for label_values, (counts, total, count) in items:
+            labels = _format_labels(self.labels, label_values)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{{{_format_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+
+def _format_labels(names, values):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class Metrics:
+    def __init__(self):
+        self.request_latency = Histogram(
+            'blog_request_duration_seconds', 'Time spent handling a request.',
+            ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+        self.request_queries = Histogram(
+            'blog_request_sql_queries', 'SQL statements executed per request.',
+            ('endpoint',), QUERY_COUNT_BUCKETS)
+        self.request_sql_time = Histogram(
+            'blog_request_sql_duration_seconds', 'Time spent in SQLite per request.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.template_time = Histogram(
+            'blog_template_render_seconds', 'Time spent rendering a template.',
+            ('template',), LATENCY_BUCKETS)
+        self.page_cache = CounterMetric(
+            'blog_page_cache_requests_total', 'Page cache lookups by result.', ('result',))
+        self.repeated_statements = CounterMetric(
+            'blog_repeated_statement_requests_total',
+            'Requests that ran one statement at least SQL_REPEAT_WARN times.', ('endpoint',))
+
+    def render(self, extra=()):
+        lines = []
+        for metric in (self.request_latency, self.request_queries, self.request_sql_time,
+                       self.template_time, self.page_cache, self.repeated_statements):
+            lines += metric.render()
+        lines += extra
+        return '\n'.join(lines) + '\n'
+
+
+def record_query(sql, seconds, count=1):
+    """Charge a statement (or fetch time, with ``count=0``) to the current request."""
+    if not has_request_context():
+        return
+    stats = g.get('_sql_stats')
+    if stats is None:
+        return
+    stats[0] += count
+    stats[1] += seconds
+    if count:
+        g._sql_statements[sql] += 1
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_query(None, time.perf_counter() - started, count=0)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            record_query(None, time.perf_counter() - started, count=0)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_query(None, time.perf_counter() - started, count=0)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose ``execute`` shortcuts go through a timing cursor."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute на C не вызывает переопределенный cursor(), поэтому обертки явные
+    def execute(self, sql, parameters=()):
+        return self.cursor(InstrumentedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(InstrumentedCursor).executemany(sql, seq_of_parameters)
+
+
+class SamplingProfiler:
+    """Profile a random sample of requests and keep the profiles of slow ones.
+
+    Only one request per process is profiled at a time: cProfile cannot run
+    two profilers at once.
+    """
+
+    def __init__(self, sample_rate, slow_threshold, directory, backend='cprofile'):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.directory = directory
+        self.backend = backend
+        self._busy = threading.Lock()
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if self.backend == 'pyinstrument':
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode='disabled')
+                profiler.start()
+            else:
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            return profiler
+        except Exception:
+            self._busy.release()
+            raise
+
+    def stop(self, profiler, duration, endpoint):
+        try:
+            if self.backend == 'pyinstrument':
+                profiler.stop()
+            else:
+                profiler.disable()
+            if duration < self.slow_threshold:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            stem = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{int(duration * 1000)}ms-{os.getpid()}'
+            if self.backend == 'pyinstrument':
+                path = os.path.join(self.directory, stem + '.html')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+            else:
+                path = os.path.join(self.directory, stem + '.prof')
+                profiler.dump_stats(path)
+            return path
+        finally:
+            self._busy.release()
+
+
+def _metrics():
+    return current_app.extensions['metrics']
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _before_request():
+    g._request_started = time.perf_counter()
+    g._sql_stats = [0, 0.0]
+    g._sql_statements = Counter()
+    g._template_time = 0.0
+    profiler = current_app.extensions.get('profiler')
+    if profiler is not None:
+        g._profile = profiler.start()
+
+
+def _after_request(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    endpoint = _endpoint()
+    queries, sql_time = g._sql_stats
+    metrics = _metrics()
+    metrics.request_latency.observe(duration, endpoint, request.method, response.status_code)
+    metrics.request_queries.observe(queries, endpoint)
+    metrics.request_sql_time.observe(sql_time, endpoint)
+    if 'X-Page-Cache' in response.headers:
+        metrics.page_cache.inc(response.headers['X-Page-Cache'].lower())
+
+    # Один и тот же запрос много раз за обработку — признак N+1
+    if g._sql_statements:
+        sql, repeats = g._sql_statements.most_common(1)[0]
+        if repeats >= current_app.config['SQL_REPEAT_WARN']:
+            metrics.repeated_statements.inc(endpoint)
+            logging.warning(f'{endpoint}: statement ran {repeats} times in one request: {" ".join(sql.split())[:200]}')
+    if queries >= current_app.config['SQL_QUERY_WARN']:
+        logging.warning(f'{endpoint}: {queries} SQL statements in one request ({sql_time * 1000:.1f} ms)')
+
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, '
+            f'db;dur={sql_time * 1000:.1f};desc="{queries} queries", '
+            f'tpl;dur={g._template_time * 1000:.1f}')
+
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        path = current_app.extensions['profiler'].stop(profile, duration, endpoint)
+        if path:
+            logging.warning(f'Slow request {request.method} {request.path} ({duration * 1000:.0f} ms), profile: {path}')
+    return response
+
+
+def _teardown_request(exc=None):
+    # Если after_request не дошел до профилировщика (исключение), освобождаем его здесь
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        current_app.extensions['profiler'].stop(profile, 0, _endpoint())
+
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault('_template_starts', []).append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    starts = g.get('_template_starts') if has_request_context() else None
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    # Вложенные render_template не учитываются дважды в общем времени запроса
+    if not starts:
+        g._template_time = g.get('_template_time', 0.0) + duration
+    current_app.extensions['metrics'].template_time.observe(duration, template.name or 'string')
+
+
+def rate_limit_lines():
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None:
+        return []
+    lines = ['# HELP blog_rate_limit_requests_total Rate-limited requests by scope and result.',
+             '# TYPE blog_rate_limit_requests_total counter']
+    for scope, (allowed, rejected) in sorted(limiter.metrics().items()):
+        lines.append(f'blog_rate_limit_requests_total{{scope="{scope}",result="allowed"}} {allowed}')
+        lines.append(f'blog_rate_limit_requests_total{{scope="{scope}",result="rejected"}} {rejected}')
+    return lines
+
+
+def log_lines():
+    handler = current_app.extensions.get('log_handler')
+    if handler is None:
+        return []
+    return ['# HELP blog_log_records_dropped_total Log records dropped because the log queue was full.',
+            '# TYPE blog_log_records_dropped_total counter',
+            f'blog_log_records_dropped_total {handler.dropped}']
+
+
+def metrics_allowed():
+    if request.remote_addr not in current_app.config['METRICS_ALLOWED_IPS']:
+        return False
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return True
+    scheme, _, presented = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(presented.encode(), token.encode())
+
+
+def metrics_view():
+    if not metrics_allowed():
+        return current_app.response_class('Forbidden', status=403, mimetype='text/plain')
+    body = _metrics().render(extra=rate_limit_lines() + log_lines() + maintenance.metric_lines(current_app))
+    response = current_app.response_class(body, mimetype='text/plain; version=0.0.4')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    app.config.setdefault('METRICS_TOKEN', None)  # если задан, нужен заголовок Authorization: Bearer
+    app.config.setdefault('SERVER_TIMING', False)
+    app.config.setdefault('SQL_QUERY_WARN', 20)
+    app.config.setdefault('SQL_REPEAT_WARN', 5)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_SLOW_THRESHOLD', 0.5)
+    app.config.setdefault('PROFILER', 'cprofile')
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.extensions['metrics'] = Metrics()
+    for key in ('db_pool', 'db_read_pool'):
+        pool = app.extensions.get(key)
+        if pool is not None:
+            pool.factory = InstrumentedConnection
+    if app.config['PROFILE_SAMPLE_RATE'] > 0:
+        app.extensions['profiler'] = SamplingProfiler(
+            app.config['PROFILE_SAMPLE_RATE'], app.config['PROFILE_SLOW_THRESHOLD'],
+            app.config['PROFILE_DIR'], app.config['PROFILER'])
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
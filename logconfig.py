@@ -0,0 +1,185 @@
+"""Non-blocking, structured logging.
+
+Request threads only put records on a bounded in-memory queue; a
+``QueueListener`` thread formats them as JSON lines and writes them. When
+the queue is full records are dropped and counted instead of blocking, and
+an error that repeats from the same call site is let through a few times
+per window and then only counted, so a burst of failures during an incident
+costs a queue append per request rather than file I/O.
+
+With ``LOG_TARGET = 'file'`` every worker writes its own
+``<LOG_DIR>/app-<pid>.jsonl`` (rotation is safe because no file is shared
+between processes); with ``'stderr'`` the lines go to the process
+supervisor (gunicorn, systemd, docker), which acts as the single collector.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import has_request_context, request, session
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the request fields captured at emit time."""
+
+    FIELDS = ('method', 'path', 'endpoint', 'remote_addr', 'user_id', 'suppressed')
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'where': f'{record.module}:{record.lineno}',
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach request fields on the calling thread, before the record is queued."""
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+            record.endpoint = request.endpoint
+            record.remote_addr = request.remote_addr
+            record.user_id = session.get('user_id')
+        return True
+
+
+class RepeatSampler(logging.Filter):
+    """Let ``burst`` records per call site through every ``window`` seconds, count the rest.
+
+    The first record after a suppressed stretch carries ``suppressed``, the
+    number of records dropped since the previous one.
+    """
+
+    def __init__(self, burst=10, window=60, min_level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.min_level = min_level
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.min_level or self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno, record.levelno)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._sites.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, passed = now, 0
+            if passed >= self.burst:
+                self._sites[key] = (started, passed, suppressed + 1)
+                return False
+            self._sites[key] = (started, passed + 1, 0)
+            if len(self._sites) > 10000:
+                self._sites.clear()
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full and restarts its listener after fork."""
+
+    def __init__(self, log_queue, make_listener):
+        super().__init__(log_queue)
+        self.make_listener = make_listener
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Поток-слушатель не переживает fork(): в каждом воркере запускаем свой
+            self._listener = self.make_listener(self.queue)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+    def prepare(self, record):
+        # Трассировку форматируем здесь: в очередь уходит запись без ссылок на кадры стека
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _file_handler(app):
+    directory = app.config['LOG_DIR']
+    os.makedirs(directory, exist_ok=True)
+    return RotatingFileHandler(os.path.join(directory, f'app-{os.getpid()}.jsonl'),
+                               maxBytes=app.config['LOG_MAX_BYTES'], backupCount=app.config['LOG_BACKUP_COUNT'],
+                               encoding='utf-8')
+
+
+def init_app(app):
+    app.config.setdefault('LOG_LEVEL', 'WARNING')
+    app.config.setdefault('LOG_TARGET', 'file')
+    app.config.setdefault('LOG_DIR', os.path.join(app.instance_path, 'logs'))
+    app.config.setdefault('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('LOG_BACKUP_COUNT', 5)
+    app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+    app.config.setdefault('LOG_SAMPLE_BURST', 10)
+    app.config.setdefault('LOG_SAMPLE_WINDOW', 60)
+
+    def make_listener(log_queue):
+        if app.config['LOG_TARGET'] == 'stderr':
+            handler = logging.StreamHandler(sys.stderr)
+        else:
+            handler = _file_handler(app)
+        handler.setFormatter(JSONFormatter())
+        return QueueListener(log_queue, handler)
+
+    handler = NonBlockingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']), make_listener)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(RepeatSampler(app.config['LOG_SAMPLE_BURST'], app.config['LOG_SAMPLE_WINDOW']))
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(app.config['LOG_LEVEL'])
+    handler.start()
+    atexit.register(handler.stop)
+    app.extensions['log_handler'] = handler
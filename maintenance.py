@@ -0,0 +1,330 @@
+"""Periodic maintenance jobs for the database, uploads, logs, snapshots and rate-limit buckets.
+
+Every job has an interval; a scheduler thread in each worker wakes up every
+``MAINTENANCE_TICK`` seconds and runs the jobs that are due. A job runs under
+a non-blocking ``flock`` on ``<MAINTENANCE_DIR>/<job>.lock`` and records its
+last run in ``<job>.json``, so with several gunicorn workers exactly one of
+them runs it per interval while the others skip it. ``flask maintenance``
+runs the same jobs from cron or by hand, and ``/metrics`` reports their
+durations.
+
+Incremental vacuum only works once ``auto_vacuum`` is ``INCREMENTAL``: new
+databases are created that way (see ``db.NEW_DATABASE_PRAGMAS``), existing ones
+need one ``flask maintenance vacuum-full``.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from db import connect
+import ratelimit
+import snapshots
+import uploads
+
+UPLOAD_NAME = re.compile(r'^([0-9a-f]{64})(?:-[a-z]+)?\.[a-z]+$')
+UPLOAD_TEMP_PREFIXES = ('.upload-', '.variant-')
+LOG_NAME = re.compile(r'^app-(\d+)\.jsonl(?:\.\d+)?$')
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def database_connection(app):
+    return connect(app.config['DATABASE'], pragmas=app.config['SQLITE_PRAGMAS'])
+
+
+def checkpoint_wal(app):
+    """Copy the WAL back into the database; truncate it only when it has grown past a threshold.
+
+    A PASSIVE checkpoint never waits: it copies what no reader still needs.
+    TRUNCATE holds the write lock while it waits for readers (a snapshot
+    backup, a streamed export), so it gets a short busy timeout of its own.
+    """
+    wal_path = app.config['DATABASE'] + '-wal'
+    size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+    mode = 'TRUNCATE' if size > app.config['MAINTENANCE_WAL_TRUNCATE_SIZE'] else 'PASSIVE'
+    conn = database_connection(app)
+    try:
+        if mode == 'TRUNCATE':
+            conn.execute(f'PRAGMA busy_timeout = {int(app.config["MAINTENANCE_TRUNCATE_TIMEOUT"] * 1000)}')
+        busy, frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    finally:
+        conn.close()
+    # busy=1: читатель держал старый снимок, обрезать WAL не удалось; догоним в следующий раз
+    return f'{mode}: {checkpointed}/{frames} frames, WAL was {size:,} B' + (', busy' if busy else '')
+
+
+def analyze(app):
+    """Refresh the planner statistics (sqlite_stat1) with a bounded per-index sample."""
+    conn = database_connection(app)
+    try:
+        conn.execute(f'PRAGMA analysis_limit = {int(app.config["MAINTENANCE_ANALYSIS_LIMIT"])}')
+        conn.execute('ANALYZE')
+        conn.commit()
+        conn.execute('PRAGMA optimize')
+        tables = conn.execute('SELECT count(DISTINCT tbl) FROM sqlite_stat1').fetchone()[0]
+    finally:
+        conn.close()
+    return f'statistics for {tables} tables'
+
+
+def incremental_vacuum(app):
+    """Give free pages back to the filesystem in short steps, committing between them."""
+    conn = database_connection(app)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            return f'skipped: auto_vacuum is not incremental ({free} free pages), run "flask maintenance vacuum-full"'
+        step = int(app.config['MAINTENANCE_VACUUM_STEP'])
+        released = 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        while free:
+            # Каждый шаг — своя короткая транзакция, чтобы писатели не ждали весь проход.
+            # executescript, а не execute: курсор sqlite3 делает один step, и прагма освободила бы одну страницу
+            conn.executescript(f'BEGIN IMMEDIATE; PRAGMA incremental_vacuum({min(step, free)}); COMMIT;')
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            released, free = released + free - remaining, remaining
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        conn.close()
+    return f'{released} pages ({released * page_size:,} B) released'
+
+
+def full_vacuum(app):
+    """Rebuild the whole database file and switch it to incremental auto-vacuum.
+
+    Holds the write lock for the duration, so it is never scheduled.
+    """
+    path = app.config['DATABASE']
+    before = os.path.getsize(path)
+    conn = database_connection(app)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    finally:
+        conn.close()
+    return f'{before:,} B -> {os.path.getsize(path):,} B'
+
+
+def remove_orphan_uploads(app):
+    """Delete uploads (originals and variants) that no post refers to any more.
+
+    Files younger than ``MAINTENANCE_UPLOAD_GRACE`` are kept: an upload is
+    stored before its post is inserted, and a re-upload of an existing file
+    only refreshes its mtime.
+    """
+    folder = uploads.upload_folder()
+    conn = database_connection(app)
+    try:
+        referenced = {os.path.splitext(name)[0] for (name,) in
+                      conn.execute('SELECT DISTINCT image_path FROM posts WHERE image_path IS NOT NULL')}
+    finally:
+        conn.close()
+    cutoff = time.time() - app.config['MAINTENANCE_UPLOAD_GRACE']
+    removed = freed = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            match = UPLOAD_NAME.match(entry.name)
+            if match:
+                if match.group(1) in referenced:
+                    continue
+            elif not entry.name.startswith(UPLOAD_TEMP_PREFIXES):
+                continue
+            # stat заново прямо перед удалением: файл могли только что загрузить повторно
+            try:
+                stat = os.stat(entry.path)
+                if stat.st_mtime >= cutoff:
+                    continue
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += stat.st_size
+    return f'{removed} files ({freed:,} B) removed, {len(referenced)} images referenced'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_old_logs(app):
+    """Delete the log files of workers that exited more than ``MAINTENANCE_LOG_RETENTION`` seconds ago.
+
+    Every worker writes ``app-<pid>.jsonl`` and rotates it itself, so files
+    only pile up for pids that are gone; live workers' files are left alone.
+    """
+    directory = app.config['LOG_DIR']
+    if not os.path.isdir(directory):
+        return 'no log directory'
+    cutoff = time.time() - app.config['MAINTENANCE_LOG_RETENTION']
+    removed = freed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = LOG_NAME.match(entry.name)
+            if not match or _pid_alive(int(match.group(1))):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+                freed += stat.st_size
+    return f'{removed} files ({freed:,} B) removed'
+
+
+# Порядок важен: вакуум пишет в WAL, поэтому checkpoint идет после него
+JOBS = {
+    'vacuum': (incremental_vacuum, 'MAINTENANCE_VACUUM_INTERVAL'),
+    'checkpoint': (checkpoint_wal, 'MAINTENANCE_CHECKPOINT_INTERVAL'),
+    'analyze': (analyze, 'MAINTENANCE_ANALYZE_INTERVAL'),
+    'uploads': (remove_orphan_uploads, 'MAINTENANCE_UPLOADS_INTERVAL'),
+    'logs': (remove_old_logs, 'MAINTENANCE_LOGS_INTERVAL'),
+    'snapshot': (snapshots.publish_snapshot, 'SNAPSHOT_INTERVAL'),
+    'ratelimit': (ratelimit.purge_buckets, 'RATE_LIMIT_PURGE_INTERVAL'),
+    'vacuum-full': (full_vacuum, None),  # только вручную
+}
+
+
+def state_path(app, job):
+    return os.path.join(app.config['MAINTENANCE_DIR'], f'{job}.json')
+
+
+def last_run(app, job):
+    """The recorded result of the last run of ``job``, or None."""
+    try:
+        with open(state_path(app, job), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_due(app, job):
+    interval_key = JOBS[job][1]
+    if interval_key is None or not app.config[interval_key]:
+        return False
+    state = last_run(app, job)
+    return state is None or time.time() - state['started_at'] >= app.config[interval_key]
+
+
+def _write_state(app, job, state):
+    path = state_path(app, job)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def run_job(app, job, force=False):
+    """Run ``job`` if it is due (or ``force``) and no other process is running it.
+
+    Returns the recorded state, or None when the job was skipped.
+    """
+    function = JOBS[job][0]
+    os.makedirs(app.config['MAINTENANCE_DIR'], exist_ok=True)
+    with open(os.path.join(app.config['MAINTENANCE_DIR'], f'{job}.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            # Повторная проверка под блокировкой: другой воркер мог только что закончить
+            if not force and not is_due(app, job):
+                return None
+            started_at, started = time.time(), time.perf_counter()
+            try:
+                with app.app_context():
+                    result, ok = function(app), True
+            except (sqlite3.Error, OSError, snapshots.SnapshotError) as e:
+                result, ok = f'{type(e).__name__}: {e}', False
+            state = {'job': job, 'started_at': started_at, 'duration': time.perf_counter() - started,
+                     'ok': ok, 'result': result}
+            _write_state(app, job, state)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    if ok:
+        logging.info(f'Maintenance {job}: {result} in {state["duration"] * 1000:.1f} ms')
+    else:
+        logging.error(f'Maintenance {job} failed after {state["duration"] * 1000:.1f} ms: {result}')
+    return state
+
+
+def run_due(app):
+    """Run every scheduled job that is due; return the states of those that ran."""
+    return [state for state in (run_job(app, job) for job in JOBS if is_due(app, job)) if state]
+
+
+class MaintenanceScheduler:
+    """Background thread running due jobs every ``tick`` seconds, started lazily in each worker."""
+
+    def __init__(self, app, tick=60):
+        self.app = app
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        # Поток не переживает fork(): запускаем его в воркере на первом запросе, а не в мастере
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='maintenance', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                run_due(self.app)
+            except Exception as e:
+                logging.error(f'Maintenance scheduler error: {e}', exc_info=True)
+
+
+def metric_lines(app):
+    lines = ['# HELP blog_maintenance_last_duration_seconds Duration of the last run of a maintenance job.',
+             '# TYPE blog_maintenance_last_duration_seconds gauge']
+    runs = []
+    for job in JOBS:
+        state = last_run(app, job)
+        if state is not None:
+            lines.append(f'blog_maintenance_last_duration_seconds{{job="{job}"}} {state["duration"]:.6f}')
+            runs.append(f'blog_maintenance_last_run_timestamp_seconds{{job="{job}",ok="{int(state["ok"])}"}} '
+                        f'{state["started_at"]:.0f}')
+    return lines + ['# HELP blog_maintenance_last_run_timestamp_seconds Start time of the last run of a maintenance job.',
+                    '# TYPE blog_maintenance_last_run_timestamp_seconds gauge'] + runs
+
+
+def init_app(app):
+    app.config.setdefault('MAINTENANCE_SCHEDULER', True)
+    app.config.setdefault('MAINTENANCE_TICK', 60)
+    app.config.setdefault('MAINTENANCE_DIR', os.path.join(app.instance_path, 'maintenance'))
+    # Интервалы в секундах; 0 отключает задачу в планировщике
+    app.config.setdefault('MAINTENANCE_VACUUM_INTERVAL', 24 * 3600)
+    app.config.setdefault('MAINTENANCE_CHECKPOINT_INTERVAL', 15 * 60)
+    app.config.setdefault('MAINTENANCE_ANALYZE_INTERVAL', 24 * 3600)
+    app.config.setdefault('MAINTENANCE_UPLOADS_INTERVAL', 24 * 3600)
+    app.config.setdefault('MAINTENANCE_LOGS_INTERVAL', 24 * 3600)
+    app.config.setdefault('MAINTENANCE_VACUUM_STEP', 1000)  # страниц за транзакцию
+    app.config.setdefault('MAINTENANCE_WAL_TRUNCATE_SIZE', 64 * 1024 * 1024)  # больше — checkpoint(TRUNCATE)
+    app.config.setdefault('MAINTENANCE_TRUNCATE_TIMEOUT', 0.2)  # секунды ожидания читателей при TRUNCATE
+    app.config.setdefault('MAINTENANCE_ANALYSIS_LIMIT', 1000)
+    app.config.setdefault('MAINTENANCE_UPLOAD_GRACE', 24 * 3600)
+    app.config.setdefault('MAINTENANCE_LOG_RETENTION', 14 * 24 * 3600)
+    if app.config['MAINTENANCE_SCHEDULER']:
+        scheduler = MaintenanceScheduler(app, app.config['MAINTENANCE_TICK'])
+        app.extensions['maintenance'] = scheduler
+        app.before_request(scheduler.ensure_started)
@@ -0,0 +1,298 @@
+"""Versioned schema migrations tracked through ``PRAGMA user_version``.
+
+Each migration runs in its own ``BEGIN IMMEDIATE`` transaction, so several
+gunicorn workers starting at once apply it exactly once. Add new schema
+changes by appending to MIGRATIONS; never edit a migration that has shipped.
+"""
+import sqlite3
+
+# Индексируется content_text — очищенный текст без тегов и HTML-сущностей; иначе «amp»
+# находил бы каждый пост с «&», а сниппеты экранировались бы дважды
+SEARCH_SCHEMA = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        title, content_text,
+        content='posts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts (rowid, title, content_text) VALUES (new.id, new.title, new.content_text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, content_text)
+            VALUES ('delete', old.id, old.title, old.content_text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF title, content_text ON posts BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, content_text)
+            VALUES ('delete', old.id, old.title, old.content_text);
+        INSERT INTO posts_fts (rowid, title, content_text) VALUES (new.id, new.title, new.content_text);
+    END;
+
+    INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+'''
+
+MIGRATIONS = [
+    (1, 'base schema', '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL CHECK(length(username) >= 4 AND length(username) <= 50),
+            email TEXT UNIQUE NOT NULL CHECK(email LIKE '%_@_%._%'),
+            password_hash TEXT NOT NULL CHECK(length(password_hash) >= 8),
+            is_admin INTEGER DEFAULT 0 CHECK(is_admin IN (0, 1)),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL CHECK(length(title) >= 1 AND length(title) <= 200),
+            content TEXT NOT NULL CHECK(length(content) >= 1),
+            author_id INTEGER NOT NULL,
+            image_path TEXT CHECK(length(image_path) <= 255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (author_id) REFERENCES users (id) ON DELETE CASCADE
+        );
+
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            post_id INTEGER NOT NULL,
+            author_name TEXT NOT NULL CHECK(length(author_name) >= 1 AND length(author_name) <= 50),
+            content TEXT NOT NULL CHECK(length(content) >= 1 AND length(content) <= 1000),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+        );
+    '''),
+    (2, 'keyset index for the home feed', '''
+        CREATE INDEX IF NOT EXISTS idx_posts_created_at_id ON posts (created_at, id);
+    '''),
+    (3, 'full-text search over posts', '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+            title, content,
+            content='posts', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF title, content ON posts BEGIN
+            INSERT INTO posts_fts (posts_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+            INSERT INTO posts_fts (rowid, title, content) VALUES (new.id, new.title, new.content);
+        END;
+
+        INSERT INTO posts_fts (posts_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+        INSERT INTO posts_fts (posts_fts) VALUES ('rebuild');
+    '''),
+    (4, 'secondary indexes for comments, authors and admin listings', '''
+        CREATE INDEX IF NOT EXISTS idx_posts_author_id ON posts (author_id);
+        CREATE INDEX IF NOT EXISTS idx_comments_post_id_created_at ON comments (post_id, created_at);
+        CREATE INDEX IF NOT EXISTS idx_comments_created_at ON comments (created_at);
+        CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+    '''),
+    (5, 'content versions for conditional GET', '''
+        CREATE TABLE IF NOT EXISTS content_versions (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS content_versions_post_ai AFTER INSERT ON posts BEGIN
+            INSERT INTO content_versions (key, version) VALUES ('feed', 1)
+                ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS content_versions_post_au AFTER UPDATE ON posts BEGIN
+            INSERT INTO content_versions (key, version) VALUES ('feed', 1), ('post:' || new.id, 1)
+                ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS content_versions_post_ad AFTER DELETE ON posts BEGIN
+            INSERT INTO content_versions (key, version) VALUES ('feed', 1), ('post:' || old.id, 1)
+                ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS content_versions_comment_ai AFTER INSERT ON comments BEGIN
+            INSERT INTO content_versions (key, version) VALUES ('post:' || new.post_id, 1)
+                ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS content_versions_comment_ad AFTER DELETE ON comments BEGIN
+            INSERT INTO content_versions (key, version) VALUES ('post:' || old.post_id, 1)
+                ON CONFLICT (key) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END;
+    '''),
+    (6, 'denormalized comment counters on posts', '''
+        ALTER TABLE posts ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE posts ADD COLUMN last_comment_at TIMESTAMP;
+
+        UPDATE posts SET
+            comment_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = posts.id),
+            last_comment_at = (SELECT MAX(created_at) FROM comments c WHERE c.post_id = posts.id);
+
+        CREATE TRIGGER IF NOT EXISTS posts_comment_count_ai AFTER INSERT ON comments BEGIN
+            UPDATE posts SET comment_count = comment_count + 1, last_comment_at = new.created_at
+            WHERE id = new.post_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS posts_comment_count_ad AFTER DELETE ON comments BEGIN
+            UPDATE posts SET
+                comment_count = comment_count - 1,
+                last_comment_at = (SELECT MAX(created_at) FROM comments WHERE post_id = old.post_id)
+            WHERE id = old.post_id;
+        END;
+    '''),
+    # content_html заполняется командой render-content (шаг provision): bleach есть только в Python
+    (7, 'rendered HTML bodies and plain-text excerpts', '''
+        ALTER TABLE posts ADD COLUMN content_html TEXT;
+        ALTER TABLE posts ADD COLUMN excerpt TEXT NOT NULL DEFAULT '';
+        ALTER TABLE comments ADD COLUMN content_html TEXT;
+
+        UPDATE posts SET excerpt = substr(content, 1, 200);
+    '''),
+    # content_text тоже заполняет render-content; до этого старые посты находятся только по заголовку
+    (8, 'full-text search over plain text instead of escaped HTML', '''
+        ALTER TABLE posts ADD COLUMN content_text TEXT;
+
+        DROP TRIGGER IF EXISTS posts_fts_ai;
+        DROP TRIGGER IF EXISTS posts_fts_ad;
+        DROP TRIGGER IF EXISTS posts_fts_au;
+        DROP TABLE IF EXISTS posts_fts;
+    ''' + SEARCH_SCHEMA + '''
+        INSERT INTO posts_fts (posts_fts) VALUES ('rebuild');
+    '''),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def split_statements(script):
+    """Split an SQL script into complete statements, keeping trigger bodies intact."""
+    statements, buffer = [], ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    if buffer.strip():
+        statements.append(buffer.strip())
+    return statements
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Apply pending migrations up to ``target`` and return the versions applied."""
+    if get_version(conn) >= target:
+        return []
+    applied = []
+    for version, description, script in MIGRATIONS:
+        if version > target:
+            break
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Другой воркер мог применить миграцию, пока мы ждали блокировку
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in split_statements(script):
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        applied.append((version, description))
+    return applied
+
+
+def hot_queries():
+    """Return ``{name: (sql, params)}`` for the hot-path queries, built the way the models build them.
+
+    The SELECT lists come from the read models' ``COLUMNS``, so the plans
+    checked are those of the queries the pages run, not of a copy.
+    """
+    # Локальный импорт: models сам импортирует этот модуль
+    from models import ADMIN_PANELS, User
+    from readmodels import CommentView, FeedCard, PostDetail, SearchHit, SessionUser
+
+    cursor = ('2025-01-01 00:00:00', 100)
+    feed = f'''
+        SELECT {FeedCard.COLUMNS}
+        FROM posts p
+        JOIN users u ON p.author_id = u.id
+        {{where}}
+        ORDER BY p.created_at {{order}}, p.id {{order}}
+        LIMIT ?
+    '''
+    queries = {
+        'feed first page': (feed.format(where='', order='DESC'), (21,)),
+        'feed older page': (feed.format(where='WHERE (p.created_at, p.id) < (?, ?)', order='DESC'), (*cursor, 21)),
+        'feed newer page': (feed.format(where='WHERE (p.created_at, p.id) > (?, ?)', order='ASC'), (*cursor, 21)),
+        'post by id': (f'''
+            SELECT {PostDetail.COLUMNS}
+            FROM posts p
+            JOIN users u ON p.author_id = u.id
+            WHERE p.id = ?
+        ''', (1,)),
+        'export batch': (f'''
+            SELECT {PostDetail.COLUMNS}
+            FROM posts p
+            JOIN users u ON p.author_id = u.id
+            WHERE p.id > ?
+            ORDER BY p.id
+            LIMIT ?
+        ''', (0, 500)),
+        'comments of a post': (f'''
+            SELECT {CommentView.COLUMNS} FROM comments
+            WHERE post_id = ? AND (created_at, id) > (?, ?)
+            ORDER BY created_at ASC, id ASC
+            LIMIT ?
+        ''', (1, *cursor, 51)),
+        'posts of an author': ('SELECT id FROM posts WHERE author_id = ?', (1,)),
+        'session user': (f'SELECT {SessionUser.COLUMNS} FROM users WHERE id = ?', (1,)),
+        'user by username': (f'SELECT {User.COLUMNS} FROM users WHERE username = ?', ('admin',)),
+        'search': (f'''
+            SELECT {SearchHit.COLUMNS}
+            FROM posts_fts
+            JOIN posts p ON p.id = posts_fts.rowid
+            JOIN users u ON p.author_id = u.id
+            WHERE posts_fts MATCH ?
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        ''', ('[', ']', '"blog"*', 11, 0)),
+        'admin bulk delete comments': ('''
+            DELETE FROM comments WHERE id IN (SELECT value FROM json_each(?))
+        ''', ('[1, 2, 3]',)),
+    }
+    for panel, model in ADMIN_PANELS.items():
+        queries[f'admin {panel}'] = (f'''
+            SELECT {model.COLUMNS} FROM {panel}
+            WHERE (created_at, id) < (?, ?)
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (*cursor, 21))
+    return queries
+
+
+def explain(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def check_query_plans(conn):
+    """Return ``{name: plan}`` for every hot query that scans a table or sorts in a temp b-tree."""
+    problems = {}
+    for name, (sql, params) in hot_queries().items():
+        plan = explain(conn, sql, params)
+        if any((line.startswith('SCAN') and 'INDEX' not in line) or 'TEMP B-TREE' in line
+               for line in plan):
+            problems[name] = plan
+    return problems
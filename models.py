@@ -4,107 +4,115 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import secrets
 import re
+import base64
+import json
+from flask import current_app, has_app_context
+from db import DATABASE, connect, get_db, get_read_db
+from snapshots import get_snapshot_db
+from migrations import SEARCH_SCHEMA, migrate
+from cache import LRUCache, invalidate
+from readmodels import (AdminCommentRow, AdminPostRow, AdminUserRow, CommentView, FeedCard, PostDetail,
+                        SearchHit, fetch)
+from passwords import hash_password
+from writequeue import execute_write
+from content import (AUTHOR_NAME_PATTERN, EMAIL_PATTERN, USERNAME_PATTERN, clean_text, prepare_body,
+                     validate_input)
 
-DATABASE = 'blog.db'
+SEARCH_TERM = re.compile(r'\w+')
 
-def secure_database_file():
+# Маркеры подсветки в snippet(); заменяются на <mark> после экранирования
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+def configured_database():
+    """The DATABASE of the current app; the default path outside an app context."""
+    return current_app.config['DATABASE'] if has_app_context() else DATABASE
+
+def secure_database_file(database=None):
     """Set secure permissions for the database file."""
     try:
-        os.chmod(DATABASE, 0o600)
+        os.chmod(database or configured_database(), 0o600)
     except OSError as e:
         print(f"Failed to set database permissions: {e}")
 
-def get_db_connection():
-    """Establish a secure database connection with error handling."""
+def get_db_connection(database=None):
+    """Establish a standalone database connection outside of the request pool."""
     try:
-        conn = sqlite3.connect(DATABASE, timeout=10)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return connect(database or configured_database())
     except sqlite3.Error as e:
         raise Exception(f"Database connection failed: {e}")
 
-def init_db():
-    """Initialize the database with secure schema and stronger default credentials."""
-    conn = get_db_connection()
-    
-    # Enable foreign key constraints for referential integrity
-    conn.execute('PRAGMA foreign_keys = ON')
-    
-    # Create users table with stronger constraints
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL CHECK(length(username) >= 4 AND length(username) <= 50),
-            email TEXT UNIQUE NOT NULL CHECK(email LIKE '%_@_%._%'),
-            password_hash TEXT NOT NULL CHECK(length(password_hash) >= 8),
-            is_admin INTEGER DEFAULT 0 CHECK(is_admin IN (0, 1)),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Create posts table with additional constraints
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL CHECK(length(title) >= 1 AND length(title) <= 200),
-            content TEXT NOT NULL CHECK(length(content) >= 1),
-            author_id INTEGER NOT NULL,
-            image_path TEXT CHECK(length(image_path) <= 255),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (author_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-
-    # Create comments table with constraints
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER NOT NULL,
-            author_name TEXT NOT NULL CHECK(length(author_name) >= 1 AND length(author_name) <= 50),
-            content TEXT NOT NULL CHECK(length(content) >= 1 AND length(content) <= 1000),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
-        )
-    ''')
+def credentials_path(database):
+    """Where the generated admin password is written: next to the database file."""
+    return os.path.join(os.path.dirname(os.path.abspath(database)), 'admin_credentials.txt')
+
+def seed_admin(conn, credentials_file):
+    """Create the admin account unless it exists; return whether it was created."""
+    # Хэш PBKDF2 дорогой, поэтому сначала проверяем, есть ли уже администратор
+    if conn.execute('SELECT 1 FROM users WHERE username = ?', ('admin',)).fetchone():
+        return False
 
     # Generate secure credentials
+    admin_password = secrets.token_urlsafe(16)
+    admin_password_hash = generate_password_hash(admin_password, method='pbkdf2:sha256', salt_length=16)
     try:
-        admin_password = secrets.token_urlsafe(16)
-        admin_password_hash = generate_password_hash(admin_password, method='pbkdf2:sha256', salt_length=16)
         conn.execute('''
             INSERT  INTO users (username, email, password_hash, is_admin)
             VALUES (?, ?, ?, ?)
         ''', ('admin', 'admin@blog.ru', admin_password_hash, 1))
-
-        # Save admin credentials securely
-        try:
-            with open('admin_credentials.txt', 'w', encoding='utf-8') as f:
-                os.chmod('admin_credentials.txt', 0o600)
-                f.write(f"Admin username: admin\nAdmin password: {admin_password}\n")
-        except OSError as e:
-            print(f"Failed to save admin credentials: {e}")
-
         conn.commit()
     except sqlite3.IntegrityError as e:
         print(f"Initialization skipped due to existing data: {e}")
+        return False
+
+    # Save admin credentials securely
+    try:
+        with open(credentials_file, 'w', encoding='utf-8') as f:
+            os.chmod(credentials_file, 0o600)
+            f.write(f"Admin username: admin\nAdmin password: {admin_password}\n")
+    except OSError as e:
+        print(f"Failed to save admin credentials: {e}")
+    return True
+
+def init_db():
+    """Bring the schema up to date and seed the admin account if it is missing."""
+    conn = get_db_connection()
+    try:
+        # Enable foreign key constraints for referential integrity
+        conn.execute('PRAGMA foreign_keys = ON')
+        migrate(conn)
+        seed_admin(conn, credentials_path(configured_database()))
     except sqlite3.Error as e:
         print(f"Database error during initialization: {e}")
     finally:
         conn.close()
         secure_database_file()
 
-def validate_input(input_str, max_length, pattern=None):
-    """Validate input to prevent injection and ensure reasonable length."""
-    if not input_str or len(input_str.strip()) == 0 or len(input_str) > max_length:
-        return False
-    if pattern and not re.match(pattern, input_str):
-        return False
-    dangerous_chars = [';', '--', '/*', '*/', '<', '>', '"', "'", '&']
-    if any(char in input_str for char in dangerous_chars):
-        return False
-    return True
+def encode_cursor(row):
+    """Encode the (created_at, id) keyset position of a read model as an opaque token."""
+    raw = f"{row.created_at}|{row.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a keyset cursor, returning None for anything malformed."""
+    if not cursor or len(cursor) > 100:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return created_at, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# Короткий кэш несуществующих логинов: перебор по случайным именам не доходит до БД
+UNKNOWN_USERNAME_TTL = 10
+_unknown_usernames = LRUCache(max_entries=4096, default_ttl=UNKNOWN_USERNAME_TTL)
 
 class User:
+    """An account as loaded for authentication; listings use the read models instead."""
+
+    __slots__ = ('id', 'username', 'email', 'password_hash', 'is_admin')
+    COLUMNS = 'id, username, email, password_hash, is_admin'
+
     def __init__(self, id, username, email, password_hash, is_admin=0):
         self.id = id
         self.username = username
@@ -118,28 +126,25 @@ class User:
         if not isinstance(user_id, int) or user_id < 1:
             return None
         try:
-            conn = get_db_connection()
-            user_data = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-            conn.close()
-            if user_data:
-                return User(user_data['id'], user_data['username'], user_data['email'],
-                           user_data['password_hash'], user_data['is_admin'])
-            return None
+            conn = get_db()
+            row = conn.execute(f'SELECT {User.COLUMNS} FROM users WHERE id = ?', (user_id,)).fetchone()
+            return User(*row) if row else None
         except sqlite3.Error:
             return None
 
     @staticmethod
     def get_by_username(username):
         """Retrieve a user by username with input validation."""
-        if not validate_input(username, 50, r'^[\w]+$'):
+        if not validate_input(username, 50, USERNAME_PATTERN):
+            return None
+        if _unknown_usernames.get(username):
             return None
         try:
-            conn = get_db_connection()
-            user_data = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-            conn.close()
-            if user_data:
-                return User(user_data['id'], user_data['username'], user_data['email'],
-                           user_data['password_hash'], user_data['is_admin'])
+            conn = get_db()
+            row = conn.execute(f'SELECT {User.COLUMNS} FROM users WHERE username = ?', (username,)).fetchone()
+            if row:
+                return User(*row)
+            _unknown_usernames.set(username, True)
             return None
         except sqlite3.Error:
             return None
@@ -147,13 +152,13 @@ class User:
     @staticmethod
     def create(username, email, password):
         """Create a new user with secure password hashing and input validation."""
-        if not validate_input(username, 50, r'^[\w]+$') or not validate_input(email, 100, r'^[\w\.-]+@[\w\.-]+\.\w+$'):
+        if not validate_input(username, 50, USERNAME_PATTERN) or not validate_input(email, 100, EMAIL_PATTERN):
             return None
         if len(password) < 8:
             return None
         try:
-            password_hash = generate_password_hash(password, method='pbkdf2:sha256', salt_length=16)
-            conn = get_db_connection()
+            password_hash = hash_password(password)
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO users (username, email, password_hash, is_admin)
@@ -161,110 +166,401 @@ class User:
             ''', (username, email, password_hash, 0))
             conn.commit()
             user_id = cursor.lastrowid
-            conn.close()
+            _unknown_usernames.delete(username)
             return User(user_id, username, email, password_hash, 0)
         except sqlite3.IntegrityError:
             return None
         except sqlite3.Error:
             return None
 
+    @staticmethod
+    def update_password_hash(user_id, password_hash):
+        """Replace a user's stored password hash, e.g. after the hash parameters changed."""
+        try:
+            conn = get_db()
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+            conn.commit()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def set_admin(username, is_admin):
+        """Grant or revoke admin rights; return the user id, or None if there is no such user."""
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+            if row:
+                conn.execute('UPDATE users SET is_admin = ? WHERE id = ?', (int(bool(is_admin)), row['id']))
+                conn.commit()
+            return row['id'] if row else None
+        finally:
+            conn.close()
+
+# Число постов на главной допускает отставание на TTL: COUNT(*) — полный проход по таблице
+POST_COUNT_TTL = 30
+_post_count = LRUCache(max_entries=1, default_ttl=POST_COUNT_TTL)
+
 class Post:
-    def __init__(self, id, title, content, author_id, image_path=None, created_at=None):
-        self.id = id
-        self.title = title
-        self.content = content
-        self.author_id = author_id
-        self.image_path = image_path
-        self.created_at = created_at
+    FEED_PAGE_SIZE = 20
+    EXCERPT_LENGTH = 200
 
     @staticmethod
-    def get_all():
-        """Retrieve all posts with error handling."""
+    def get_feed(before=None, after=None, limit=FEED_PAGE_SIZE):
+        """Retrieve one page of the feed, newest first, using keyset pagination.
+
+        Returns ``(cards, next_cursor, prev_cursor)`` with FeedCard rows;
+        ``before`` pages towards older posts and ``after`` towards newer ones.
+        Only the stored excerpt of the content is selected.
+        """
+        before, after = decode_cursor(before), decode_cursor(after)
+        where, params, order = '', [], 'DESC'
+        if after:
+            where, params, order = 'WHERE (p.created_at, p.id) > (?, ?)', list(after), 'ASC'
+        elif before:
+            where, params = 'WHERE (p.created_at, p.id) < (?, ?)', list(before)
         try:
-            conn = get_db_connection()
-            posts = conn.execute('''
-                SELECT p.*, u.username
+            conn = get_read_db()
+            posts = fetch(conn, FeedCard, f'''
+                SELECT {FeedCard.COLUMNS}
                 FROM posts p
                 JOIN users u ON p.author_id = u.id
-                ORDER BY p.created_at DESC
-            ''').fetchall()
-            conn.close()
-            return posts
+                {where}
+                ORDER BY p.created_at {order}, p.id {order}
+                LIMIT ?
+            ''', [*params, limit + 1]).fetchall()
         except sqlite3.Error:
-            return []
+            return [], None, None
+
+        has_more = len(posts) > limit
+        posts = posts[:limit]
+        if after:
+            posts.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = before is not None, has_more
+        next_cursor = encode_cursor(posts[-1]) if posts and has_older else None
+        prev_cursor = encode_cursor(posts[0]) if posts and has_newer else None
+        return posts, next_cursor, prev_cursor
+
+    @staticmethod
+    def count():
+        """Return the total number of posts, cached for POST_COUNT_TTL seconds."""
+        count = _post_count.get('posts')
+        if count is not None:
+            return count
+        try:
+            conn = get_read_db()
+            count = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+        except sqlite3.Error:
+            return 0
+        _post_count.set('posts', count)
+        return count
+
+    @staticmethod
+    def forget_count():
+        """Drop the cached count; every write that adds or removes posts calls this."""
+        _post_count.delete('posts')
+
+    SEARCH_PAGE_SIZE = 10
+    # OFFSET заставляет FTS5 ранжировать и пропустить все совпадения до страницы: глубже не листаем
+    SEARCH_MAX_RESULTS = 500
+
+    @staticmethod
+    def search_pages(per_page=SEARCH_PAGE_SIZE):
+        """The number of pages of ``per_page`` hits within SEARCH_MAX_RESULTS."""
+        return Post.SEARCH_MAX_RESULTS // per_page
+
+    @staticmethod
+    def build_search_query(query):
+        """Turn free text into an FTS5 MATCH expression of quoted prefix terms."""
+        terms = SEARCH_TERM.findall(query)[:10]
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    @staticmethod
+    def search(query, page=1, per_page=SEARCH_PAGE_SIZE):
+        """Full-text search over posts ranked by bm25 (the FTS ``rank``), returning ``(posts, has_next)``.
+
+        Rows are SearchHit instances whose ``snippet`` has its matches wrapped
+        in SNIPPET_START/SNIPPET_END markers. Only the first
+        ``search_pages(per_page)`` pages are served.
+        """
+        match = Post.build_search_query(query)
+        last_page = Post.search_pages(per_page)
+        if not match or not isinstance(page, int) or not 1 <= page <= last_page:
+            return [], False
+        try:
+            conn = get_snapshot_db('search')
+            posts = fetch(conn, SearchHit, f'''
+                SELECT {SearchHit.COLUMNS}
+                FROM posts_fts
+                JOIN posts p ON p.id = posts_fts.rowid
+                JOIN users u ON p.author_id = u.id
+                WHERE posts_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            ''', (SNIPPET_START, SNIPPET_END, match, per_page + 1, (page - 1) * per_page)).fetchall()
+            return posts[:per_page], len(posts) > per_page and page < last_page
+        except sqlite3.Error:
+            return [], False
+
+    @staticmethod
+    def rebuild_search_index():
+        """Repopulate the full-text index from the posts table."""
+        conn = get_db_connection()
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+            conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('rebuild')")
+            conn.commit()
+            return conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
+        finally:
+            conn.close()
 
     @staticmethod
     def get_by_id(post_id):
-        """Retrieve a post by ID with input validation."""
+        """Retrieve a post by ID as a PostDetail, with input validation."""
         if not isinstance(post_id, int) or post_id < 1:
             return None
         try:
-            conn = get_db_connection()
-            post = conn.execute('''
-                SELECT p.*, u.username
+            conn = get_read_db()
+            post = fetch(conn, PostDetail, f'''
+                SELECT {PostDetail.COLUMNS}
                 FROM posts p
                 JOIN users u ON p.author_id = u.id
                 WHERE p.id = ?
             ''', (post_id,)).fetchone()
-            conn.close()
             return post
         except sqlite3.Error:
             return None
 
     @staticmethod
     def create(title, content, author_id, image_path=None):
-        """Create a new post with input validation."""
-        if not validate_input(title, 200) or not validate_input(content, 10000) or not isinstance(author_id, int):
+        """Create a new post, storing its sanitized source, rendered HTML, excerpt and plain text."""
+        title = clean_text(title or '')
+        body = prepare_body(content or '', Post.EXCERPT_LENGTH)
+        if not validate_input(title, 200, forbidden=None) or not validate_input(body.source, 10000, forbidden=None):
             return None
-        if image_path and not validate_input(image_path, 255):
+        if not isinstance(author_id, int) or image_path and not validate_input(image_path, 255):
             return None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO posts (title, content, author_id, image_path)
-                VALUES (?, ?, ?, ?)
-            ''', (title, content, author_id, image_path))
-            conn.commit()
-            post_id = cursor.lastrowid
-            conn.close()
+            post_id = execute_write('''
+                INSERT INTO posts (title, content, content_html, excerpt, content_text, author_id, image_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (title, body.source, body.html, body.excerpt, body.text, author_id, image_path))
+            Post.forget_count()
+            invalidate('feed')
             return post_id
         except sqlite3.Error:
             return None
 
 class Comment:
+    PAGE_SIZE = 50
+
     @staticmethod
-    def get_by_post_id(post_id):
-        """Retrieve comments by post ID with input validation."""
+    def get_page(post_id, after=None, limit=PAGE_SIZE):
+        """Retrieve one page of a post's comments (CommentView rows), oldest first, returning ``(comments, next_cursor)``."""
         if not isinstance(post_id, int) or post_id < 1:
-            return []
+            return [], None
+        where, params = '', []
+        after = decode_cursor(after)
+        if after:
+            where, params = 'AND (created_at, id) > (?, ?)', list(after)
         try:
-            conn = get_db_connection()
-            comments = conn.execute('''
-                SELECT * FROM comments
-                WHERE post_id = ?
-                ORDER BY created_at ASC
-            ''', (post_id,)).fetchall()
-            conn.close()
-            return comments
+            conn = get_read_db()
+            comments = fetch(conn, CommentView, f'''
+                SELECT {CommentView.COLUMNS} FROM comments
+                WHERE post_id = ? {where}
+                ORDER BY created_at ASC, id ASC
+                LIMIT ?
+            ''', [post_id, *params, limit + 1]).fetchall()
         except sqlite3.Error:
-            return []
+            return [], None
+        next_cursor = encode_cursor(comments[limit - 1]) if len(comments) > limit else None
+        return comments[:limit], next_cursor
 
     @staticmethod
     def create(post_id, author_name, content):
-        """Create a new comment with input validation."""
-        if not isinstance(post_id, int) or not validate_input(author_name, 50, r'^[\w\s]+$') or not validate_input(content, 1000):
+        """Create a new comment, storing its sanitized source and rendered HTML."""
+        body = prepare_body(content or '')
+        if not isinstance(post_id, int) or not validate_input(author_name, 50, AUTHOR_NAME_PATTERN):
+            return None
+        if not validate_input(body.source, 1000, forbidden=None):
             return None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO comments (post_id, author_name, content)
-                VALUES (?, ?, ?)
-            ''', (post_id, author_name, content))
-            conn.commit()
-            comment_id = cursor.lastrowid
-            conn.close()
+            comment_id = execute_write('''
+                INSERT INTO comments (post_id, author_name, content, content_html)
+                VALUES (?, ?, ?, ?)
+            ''', (post_id, author_name, body.source, body.html))
+            invalidate('feed', f'post:{post_id}')
             return comment_id
         except sqlite3.Error:
             return None
+
+def reconcile_comment_counts():
+    """Recompute the denormalized comment counters of every post in one statement."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute('''
+            UPDATE posts SET
+                comment_count = (SELECT COUNT(*) FROM comments c WHERE c.post_id = posts.id),
+                last_comment_at = (SELECT MAX(created_at) FROM comments c WHERE c.post_id = posts.id)
+            WHERE comment_count IS NOT (SELECT COUNT(*) FROM comments c WHERE c.post_id = posts.id)
+               OR last_comment_at IS NOT (SELECT MAX(created_at) FROM comments c WHERE c.post_id = posts.id)
+        ''')
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def render_stored_content(batch_size=500, database=None):
+    """Fill content_html (and the excerpt and plain text) of rows saved before bodies were rendered at write time."""
+    conn = get_db_connection(database)
+    rendered = 0
+    try:
+        while True:
+            posts = conn.execute('''
+                SELECT id, content FROM posts WHERE content_html IS NULL OR content_text IS NULL LIMIT ?
+            ''', (batch_size,)).fetchall()
+            comments = conn.execute('SELECT id, content FROM comments WHERE content_html IS NULL LIMIT ?',
+                                    (batch_size,)).fetchall()
+            if not posts and not comments:
+                return rendered
+            for row in posts:
+                body = prepare_body(row['content'], Post.EXCERPT_LENGTH)
+                conn.execute('UPDATE posts SET content_html = ?, excerpt = ?, content_text = ? WHERE id = ?',
+                             (body.html, body.excerpt, body.text, row['id']))
+            for row in comments:
+                conn.execute('UPDATE comments SET content_html = ? WHERE id = ?',
+                             (prepare_body(row['content']).html, row['id']))
+            conn.commit()
+            rendered += len(posts) + len(comments)
+    finally:
+        conn.close()
+
+# Панели админки: у каждой своя keyset-пагинация по (created_at, id)
+ADMIN_PANELS = {
+    'users': AdminUserRow,
+    'posts': AdminPostRow,
+    'comments': AdminCommentRow,
+}
+
+# Счетчики админки допускают отставание на TTL: COUNT(*) по большим таблицам не на каждый запрос
+ADMIN_COUNTS_TTL = 30
+_admin_counts = LRUCache(max_entries=1, default_ttl=ADMIN_COUNTS_TTL)
+
+class Admin:
+    """Listing and moderation queries behind the admin dashboard."""
+
+    PAGE_SIZE = 20
+    MAX_BULK_IDS = 10000
+
+    @staticmethod
+    def get_panel(panel, before=None, limit=PAGE_SIZE):
+        """Retrieve one page of a panel, newest first, returning ``(rows, next_cursor)``."""
+        where, params = '', []
+        before = decode_cursor(before)
+        if before:
+            where, params = 'WHERE (created_at, id) < (?, ?)', list(before)
+        try:
+            conn = get_snapshot_db('admin')
+            model = ADMIN_PANELS[panel]
+            rows = fetch(conn, model, f'''
+                SELECT {model.COLUMNS} FROM {panel}
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', [*params, limit + 1]).fetchall()
+        except sqlite3.Error:
+            return [], None
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+    @staticmethod
+    def counts():
+        """Return ``{'users': n, 'posts': n, 'comments': n}``, cached for ADMIN_COUNTS_TTL seconds."""
+        counts = _admin_counts.get('counts')
+        if counts is not None:
+            return counts
+        try:
+            conn = get_snapshot_db('admin')
+            counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                      for table in ADMIN_PANELS}
+        except sqlite3.Error:
+            return dict.fromkeys(ADMIN_PANELS, 0)
+        _admin_counts.set('counts', counts)
+        return counts
+
+    @staticmethod
+    def parse_ids(values):
+        """Turn submitted ids into a sorted list of unique positive ints, or None if any is invalid."""
+        ids = set()
+        for value in values:
+            try:
+                row_id = int(value)
+            except (TypeError, ValueError):
+                return None
+            if row_id < 1:
+                return None
+            ids.add(row_id)
+        if not ids or len(ids) > Admin.MAX_BULK_IDS:
+            return None
+        return sorted(ids)
+
+    @staticmethod
+    def _bulk_delete(affected_posts_sql, delete_sql, ids):
+        """Run ``delete_sql`` over ``ids`` in one write transaction.
+
+        Returns ``(rows deleted, ids of the affected posts)``.
+        """
+        # Весь список уходит одним параметром через json_each: нет лимита на число переменных
+        ids_json = json.dumps(ids)
+        conn = get_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            post_ids = [row[0] for row in conn.execute(affected_posts_sql, (ids_json,))]
+            deleted = conn.execute(delete_sql, (ids_json,)).rowcount
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        _admin_counts.delete('counts')
+        Post.forget_count()
+        invalidate('feed', *(f'post:{post_id}' for post_id in post_ids))
+        return deleted, post_ids
+
+    @staticmethod
+    def delete_posts(ids):
+        """Delete posts and their comments in a single transaction; return the number of posts deleted."""
+        # Комментарии удаляет ON DELETE CASCADE (foreign_keys=ON на каждом соединении)
+        deleted, _ = Admin._bulk_delete(
+            'SELECT id FROM posts WHERE id IN (SELECT value FROM json_each(?))',
+            'DELETE FROM posts WHERE id IN (SELECT value FROM json_each(?))',
+            ids)
+        return deleted
+
+    @staticmethod
+    def delete_comments(ids):
+        """Delete comments in a single transaction; return the number deleted."""
+        deleted, _ = Admin._bulk_delete(
+            'SELECT DISTINCT post_id FROM comments WHERE id IN (SELECT value FROM json_each(?))',
+            'DELETE FROM comments WHERE id IN (SELECT value FROM json_each(?))',
+            ids)
+        return deleted
+
+class ContentVersion:
+    """Version counters bumped by triggers whenever posts or comments change."""
+
+    @staticmethod
+    def get_many(keys):
+        """Return ``{key: (version, updated_at)}`` for the given keys; missing keys are omitted."""
+        if not keys:
+            return {}
+        try:
+            conn = get_read_db()
+            rows = conn.execute(
+                f'SELECT key, version, updated_at FROM content_versions WHERE key IN ({", ".join("?" * len(keys))})',
+                list(keys),
+            ).fetchall()
+            return {row['key']: (row['version'], row['updated_at']) for row in rows}
+        except sqlite3.Error:
+            return {}
@@ -0,0 +1,125 @@
+"""Password hashing off the request threads.
+
+PBKDF2 runs in a small process pool so a burst of logins cannot hold the
+GIL of a gunicorn worker. The number of in-flight hashes is bounded; once
+the bound is reached callers get HashingBusy immediately and the route
+answers 429 instead of queueing indefinitely.
+
+Pool processes are started through ``forkserver`` (``spawn`` where it is not
+available) rather than forked from the worker: a fork would copy the locks
+of the worker's other threads (log queue, write queue, connection pools) in
+whatever state they were in and could deadlock the child. The fork server
+imports the main module once and forks the pool processes from that clean,
+single-threaded state.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+SALT_LENGTH = 16
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has its maximum number of pending jobs."""
+
+
+def _mp_context():
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+class HashingExecutor:
+    """Process pool with a hard cap on queued plus running hash jobs."""
+
+    def __init__(self, workers=2, max_pending=8, timeout=10):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _get_executor(self):
+        # Пул создается лениво в каждом воркере gunicorn, а не в мастер-процессе
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, fn, *args):
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingBusy('Password hashing queue is full')
+        try:
+            future = executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HashingBusy('Password hashing timed out')
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _executor():
+    return current_app.extensions['hashing_executor']
+
+
+def hash_method():
+    return current_app.config['PASSWORD_HASH_METHOD']
+
+
+def hash_password(password):
+    """Hash a password with the configured method in the hashing pool."""
+    return _executor().run(generate_password_hash, password, hash_method(), SALT_LENGTH)
+
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash in the hashing pool."""
+    return _executor().run(check_password_hash, password_hash, password)
+
+
+def normalize_method(method):
+    """Spell out the defaults Werkzeug fills in, as it writes them into the hash.
+
+    ``'scrypt'`` becomes ``'scrypt:32768:8:1'`` and ``'pbkdf2'`` becomes
+    ``'pbkdf2:sha256:<iterations>'``; other strings are returned unchanged.
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return f'scrypt:{2 ** 15}:8:1'
+    if name == 'pbkdf2' and len(args) < 2:
+        return f'pbkdf2:{args[0] if args else "sha256"}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def needs_rehash(password_hash):
+    """Tell whether a stored hash was made with other parameters than the configured method."""
+    return normalize_method(password_hash.split('$', 1)[0]) != normalize_method(hash_method())
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    app.config.setdefault('HASH_WORKERS', min(4, os.cpu_count() or 1))
+    app.config.setdefault('HASH_MAX_PENDING', 2 * app.config['HASH_WORKERS'])
+    app.config.setdefault('HASH_TIMEOUT', 10)
+    app.extensions['hashing_executor'] = HashingExecutor(
+        workers=app.config['HASH_WORKERS'],
+        max_pending=app.config['HASH_MAX_PENDING'],
+        timeout=app.config['HASH_TIMEOUT'],
+    )
@@ -0,0 +1,135 @@
+"""One-time provisioning of the database and the upload directory.
+
+Migrating the schema, hashing a fresh admin password and fixing the
+permissions of every uploaded file used to happen each time a worker
+imported the app. That work now runs once per deployment, from
+``flask provision`` or, as a fallback, from the first process that finds the
+marker out of date; every other boot only reads the marker file and the
+schema version.
+"""
+import fcntl
+import logging
+import os
+import time
+from db import connect
+from migrations import LATEST_VERSION, get_version, migrate
+
+# Увеличить при добавлении нового шага, чтобы он выполнился на уже развернутых копиях
+PROVISION_STEPS = 2
+
+
+def provision_stamp(app):
+    return f'schema={LATEST_VERSION} steps={PROVISION_STEPS} database={os.path.abspath(app.config["DATABASE"])}'
+
+
+def marker_path(app):
+    return os.path.join(app.instance_path, 'provisioned')
+
+
+def upload_dir(app):
+    return os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+
+
+def is_provisioned(app):
+    """Cheap check done on every boot: the marker matches and the schema is current."""
+    try:
+        with open(marker_path(app), encoding='utf-8') as f:
+            if f.read().strip() != provision_stamp(app):
+                return False
+    except OSError:
+        return False
+    database = app.config['DATABASE']
+    if not os.path.exists(database):
+        return False
+    conn = connect(database, pragmas={})
+    try:
+        return get_version(conn) >= LATEST_VERSION
+    finally:
+        conn.close()
+
+
+def fix_upload_permissions(path):
+    """Create the upload directory and restrict the files already in it."""
+    os.makedirs(path, mode=0o750, exist_ok=True)
+    os.chmod(path, 0o750)
+    fixed = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                os.chmod(entry.path, 0o640)
+                fixed += 1
+    return fixed
+
+
+def provision(app):
+    """Run every provisioning step and write the marker; return ``[(step, seconds)]``.
+
+    An exclusive lock on the instance folder keeps concurrently booting
+    workers from provisioning twice: the ones that waited find the marker
+    current and return immediately.
+    """
+    from models import credentials_path, render_stored_content, secure_database_file, seed_admin
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'provision.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if is_provisioned(app):
+                return []
+            timings = []
+
+            started = time.perf_counter()
+            fixed = fix_upload_permissions(upload_dir(app))
+            timings.append((f'upload permissions ({fixed} files)', time.perf_counter() - started))
+
+            database = app.config['DATABASE']
+            conn = connect(database)
+            try:
+                started = time.perf_counter()
+                applied = migrate(conn)
+                timings.append((f'schema migrations ({len(applied)} applied)', time.perf_counter() - started))
+
+                started = time.perf_counter()
+                created = seed_admin(conn, credentials_path(database))
+                timings.append(('admin account' + (' created' if created else ' present'),
+                                time.perf_counter() - started))
+            finally:
+                conn.close()
+
+            started = time.perf_counter()
+            rendered = render_stored_content(database=database)
+            timings.append((f'rendered bodies ({rendered} rows)', time.perf_counter() - started))
+            secure_database_file(database)
+
+            tmp_path = marker_path(app) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(provision_stamp(app) + '\n')
+            os.replace(tmp_path, marker_path(app))
+            return timings
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def init_app(app):
+    app.config.setdefault('PROVISION_ON_STARTUP', True)
+    if is_provisioned(app):
+        return
+    if app.config['PROVISION_ON_STARTUP']:
+        for step, seconds in provision(app):
+            logging.info(f'Provisioning: {step} in {seconds * 1000:.1f} ms')
+        return
+
+    # Без автоподготовки проверяем маркер на первом запросе, а не при импорте:
+    # flask provision тоже импортирует app и должен успеть запуститься
+    checked = []
+
+    @app.before_request
+    def require_provisioning():
+        if checked:
+            return None
+        if not is_provisioned(app):
+            logging.error('The database is not provisioned; run "flask provision" first.')
+            # Не через abort: общий обработчик ошибок перенаправил бы на ту же главную
+            return 'Сервис не готов: база данных не подготовлена.', 503
+        checked.append(True)
+        return None
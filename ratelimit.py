@@ -0,0 +1,178 @@
+"""Token-bucket rate limiting keyed by client IP and route.
+
+A limit ``(burst, period)`` lets a client make ``burst`` requests at once
+and refills one token every ``period / burst`` seconds, so it also caps the
+sustained rate over any sliding window of ``period`` seconds. Each check is
+a single O(1) read-modify-write of one bucket. The ``memory`` store is per
+worker; the ``sqlite`` store keeps buckets in a separate database file shared
+by all gunicorn workers on the host, and the ``ratelimit`` maintenance job
+drops the buckets that have been idle long enough to be full again.
+
+Clients are told apart by ``request.remote_addr``. Behind a reverse proxy
+that is the proxy's address, so every client would share one bucket: set
+``TRUSTED_PROXIES`` to the number of proxies in front of the app so the
+address is taken from ``X-Forwarded-For`` instead (see app.py).
+"""
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from flask import current_app, request
+
+DEFAULT_LIMITS = {
+    'login': (10, 60),
+    'register': (5, 3600),
+    'add_comment': (10, 60),
+    'create_post': (5, 60),
+    'search': (30, 60),
+    'api': (120, 60),
+    'api_export': (2, 60),
+}
+
+
+def refill(tokens, updated, now, burst, rate):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryStore:
+    """Per-process buckets, bounded in size by evicting the least recently used."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate, now):
+        """Consume a token; return ``(allowed, seconds until the next token)``."""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = refill(tokens, updated, now, burst, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteStore:
+    """Buckets in a small SQLite database shared between worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def take(self, key, burst, rate, now):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = refill(*(row or (burst, now)), now, burst, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def purge(self, older_than):
+        """Drop buckets untouched since ``older_than``; they would be full again anyway. Return how many."""
+        return self._conn().execute('DELETE FROM buckets WHERE updated < ?', (older_than,)).rowcount
+
+
+class RateLimiter:
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+        self.allowed = defaultdict(int)
+        self.rejected = defaultdict(int)
+
+    def check(self, scope, client):
+        """Return ``(allowed, retry_after)`` for one request of ``client`` on ``scope``."""
+        limit = self.limits.get(scope)
+        if not limit:
+            return True, 0
+        burst, period = limit
+        try:
+            allowed, retry_after = self.store.take(f'{scope}:{client}', burst, burst / period, time.time())
+        except sqlite3.Error as e:
+            # Лимитер не должен ронять сайт: при сбое хранилища пропускаем запрос
+            logging.warning(f'Rate limiter store error: {e}')
+            return True, 0
+        if allowed:
+            self.allowed[scope] += 1
+        else:
+            self.rejected[scope] += 1
+        return allowed, retry_after
+
+    def metrics(self):
+        """Return ``{scope: (allowed, rejected)}`` counters for this worker."""
+        return {scope: (self.allowed[scope], self.rejected[scope])
+                for scope in set(self.allowed) | set(self.rejected)}
+
+
+def purge_buckets(app):
+    """Maintenance job: delete idle buckets from the sqlite store; return a summary."""
+    limiter = app.extensions['rate_limiter']
+    if not isinstance(limiter.store, SQLiteStore):
+        return 'memory store, nothing to purge'  # размер MemoryStore ограничен max_keys
+    # За самый длинный период любое ведро наполняется заново: удалять такие можно без последствий
+    longest = max((period for _, period in limiter.limits.values()), default=0)
+    return f'{limiter.store.purge(time.time() - longest)} idle buckets removed'
+
+
+def rate_limit(scope, methods=('GET', 'POST')):
+    """Apply the ``scope`` limit from RATE_LIMITS to a view, per client IP."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method in methods:
+                limiter = current_app.extensions['rate_limiter']
+                allowed, retry_after = limiter.check(scope, request.remote_addr or 'unknown')
+                if not allowed:
+                    response = current_app.response_class(
+                        'Слишком много запросов. Попробуйте позже.', status=429,
+                        mimetype='text/plain')
+                    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('RATE_LIMITS', DEFAULT_LIMITS)
+    app.config.setdefault('RATE_LIMIT_STORAGE', 'memory')
+    app.config.setdefault('RATE_LIMIT_DB', os.path.join(app.instance_path, 'ratelimit.db'))
+    app.config.setdefault('RATE_LIMIT_PURGE_INTERVAL', 3600)  # задача ratelimit в maintenance
+    if app.config['RATE_LIMIT_STORAGE'] == 'sqlite':
+        store = SQLiteStore(app.config['RATE_LIMIT_DB'])
+    else:
+        store = MemoryStore()
+    app.extensions['rate_limiter'] = RateLimiter(store, app.config['RATE_LIMITS'])
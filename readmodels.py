@@ -0,0 +1,123 @@
+"""Read models: compact, typed rows for each page that lists or shows data.
+
+Every read model is a ``__slots__`` dataclass whose fields are exactly the
+columns one use case renders, and whose ``COLUMNS`` is the matching SELECT
+list, so a query never pulls ``password_hash`` or a full post body into a
+page that does not show them. ``fetch`` builds the objects directly from the
+row tuples through a cursor-level row factory instead of going through
+``sqlite3.Row``.
+
+    cards = fetch(conn, FeedCard, f'SELECT {FeedCard.COLUMNS} FROM posts p '
+                  'JOIN users u ON p.author_id = u.id ORDER BY p.created_at DESC LIMIT ?', (20,)).fetchall()
+"""
+from dataclasses import dataclass, fields
+from typing import Optional
+
+
+def read_model(alias=None, **expressions):
+    """Turn a class into a slotted dataclass with ``COLUMNS`` and ``row_factory``.
+
+    Fields are selected as ``<alias>.<field>`` unless ``expressions`` gives
+    an SQL expression for them; the SELECT list follows the field order.
+    """
+    def decorator(cls):
+        cls = dataclass(slots=True)(cls)
+        prefix = f'{alias}.' if alias else ''
+        cls.COLUMNS = ', '.join(expressions[f.name] + f' AS {f.name}' if f.name in expressions else prefix + f.name
+                                for f in fields(cls))
+        cls.row_factory = staticmethod(lambda cursor, row: cls(*row))
+        return cls
+    return decorator
+
+
+def fetch(conn, model, sql, params=()):
+    """Execute ``sql`` and return a cursor that yields ``model`` instances."""
+    cursor = conn.cursor()
+    cursor.row_factory = model.row_factory
+    return cursor.execute(sql, params)
+
+
+@read_model('p', username='u.username')
+class FeedCard:
+    """A post on the home feed: the stored excerpt instead of the body."""
+    id: int
+    title: str
+    excerpt: str
+    image_path: Optional[str]
+    created_at: str
+    comment_count: int
+    last_comment_at: Optional[str]
+    username: str
+
+
+@read_model('p', username='u.username', snippet='snippet(posts_fts, -1, ?, ?, \'…\', 24)')
+class SearchHit:
+    """A search result; ``snippet`` carries the SNIPPET_START/SNIPPET_END markers."""
+    id: int
+    title: str
+    image_path: Optional[str]
+    created_at: str
+    comment_count: int
+    username: str
+    snippet: str
+
+
+@read_model('p', username='u.username')
+class PostDetail:
+    """A post on its own page."""
+    id: int
+    title: str
+    content: str
+    content_html: Optional[str]
+    image_path: Optional[str]
+    author_id: int
+    created_at: str
+    comment_count: int
+    username: str
+
+
+@read_model()
+class CommentView:
+    """A comment under a post."""
+    id: int
+    post_id: int
+    author_name: str
+    content: str
+    content_html: Optional[str]
+    created_at: str
+
+
+@read_model()
+class AdminUserRow:
+    id: int
+    username: str
+    email: str
+    is_admin: int
+    created_at: str
+
+
+@read_model()
+class AdminPostRow:
+    id: int
+    title: str
+    author_id: int
+    comment_count: int
+    created_at: str
+
+
+# В таблице админки видны первые 50 символов: весь комментарий не читаем
+@read_model(content='substr(content, 1, 60)')
+class AdminCommentRow:
+    id: int
+    post_id: int
+    author_name: str
+    content: str
+    created_at: str
+
+
+@read_model()
+class SessionUser:
+    """The signed-in user as seen by authorization checks and templates."""
+    id: int
+    username: str
+    is_admin: int
@@ -6,80 +6,91 @@ import logging
 from flask import render_template, request, redirect, url_for, session, flash, send_from_directory, abort, jsonify
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
+from markupsafe import Markup, escape
 from flask_wtf.csrf import CSRFProtect
 from app import app
-from models import get_db_connection, User, Post, Comment
+from db import get_db, get_read_db
+from cache import cached_page, invalidate
+from conditional import conditional_page
+from models import ADMIN_PANELS, Admin, User, Post, Comment, SNIPPET_START, SNIPPET_END
 from forms import LoginForm, RegisterForm, CommentForm, PostForm
-import bleach
+from passwords import HashingBusy, hash_password, needs_rehash, verify_password
+from ratelimit import rate_limit
+from auth import admin_required, current_user, login_required
+from content import SQL_TOKENS, clean_text, validate_input
+import uploads
 from time import *
 
-logging.basicConfig(filename='app.log', level=logging.ERROR)
-
 csrf = CSRFProtect(app)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 MAX_CONTENT_LENGTH = 5 * 1024 * 1024
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
-def allowed_file(filename):
-    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-    return ext in ALLOWED_EXTENSIONS and not re.search(pattern=r'[^\w.\-]', string=filename)
+@app.template_filter('highlight')
+def highlight(snippet):
+    """Escape a search snippet and turn its match markers into <mark> tags."""
+    escaped = str(escape(snippet or ''))
+    return Markup(escaped.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
 
-def validate_input(input_str, max_length, pattern=None):
-    if not input_str or len(input_str.strip()) == 0 or len(input_str) > max_length:
-        return False
-    if pattern and not re.match(pattern, input_str):
-        return False
-    if any(char in input_str for char in [';', '--', '/*', '*/']):
-        return False
-    return True
+def too_busy(template, form):
+    """Reject a request quickly when the password hashing pool is saturated."""
+    flash('Сервер перегружен. Попробуйте снова через несколько секунд.', 'danger')
+    response = app.make_response((render_template(template, form=form), 429))
+    response.headers['Retry-After'] = '5'
+    return response
 
 @app.route('/')
+@conditional_page('feed')
+@cached_page('feed')
 def index():
     try:
-        posts = Post.get_all()
-        return render_template('index.html', posts=posts)
+        posts, next_cursor, prev_cursor = Post.get_feed(before=request.args.get('before'),
+                                                        after=request.args.get('after'))
+        return render_template('index.html', posts=posts, next_cursor=next_cursor,
+                               prev_cursor=prev_cursor, total_posts=Post.count())
     except sqlite3.Error as e:
         logging.error(f'Index error: {e}')
         flash('Ошибка загрузки постов.', 'danger')
         return render_template('index.html', posts=[])
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limit('login', methods=('POST',))
 def login():
-    login_attempts = session.get('login_attempts', {'count': 0, 'last_attempt': 0})
-    if login_attempts['count'] >= 5 and time() - login_attempts['last_attempt'] < 300:
-        flash('Слишком много попыток входа. Попробуйте снова через 5 минут.', 'danger')
-        return render_template('login.html', form=LoginForm())
-
     form = LoginForm()
     if form.validate_on_submit():
         try:
             user = User.get_by_username(form.username.data)
-            if user and check_password_hash(user.password_hash, form.password.data):
+            if user and verify_password(user.password_hash, form.password.data):
+                if needs_rehash(user.password_hash):
+                    try:
+                        User.update_password_hash(user.id, hash_password(form.password.data))
+                    except HashingBusy:
+                        # Пароль уже проверен: не отказываем во входе, перехэшируем при следующем
+                        logging.warning(f'Password rehash skipped for user {user.id}: hashing pool busy')
                 session.clear()
                 session.permanent = True
                 session['user_id'] = user.id
-                session['username'] = user.username
-                session['is_admin'] = user.is_admin
-                session['login_attempts'] = {'count': 0, 'last_attempt': 0}
                 flash('Вход выполнен успешно!', 'success')
                 return redirect(url_for('index'))
             else:
-                login_attempts['count'] += 1
-                login_attempts['last_attempt'] = time()
-                session['login_attempts'] = login_attempts
                 flash('Неверные учетные данные!', 'danger')
         except sqlite3.Error as e:
             logging.error(f'Login error: {e}')
             flash(f'Ошибка базы данных: {e}', 'danger')
+        except HashingBusy:
+            return too_busy('login.html', form)
     return render_template('login.html', form=form)
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limit('register', methods=('POST',))
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
-        user = User.create(form.username.data, form.email.data, form.password.data)
+        try:
+            user = User.create(form.username.data, form.email.data, form.password.data)
+        except HashingBusy:
+            return too_busy('register.html', form)
         if user:
             flash('Регистрация прошла успешно! Теперь вы можете войти.', 'success')
             return redirect(url_for('login'))
@@ -94,6 +105,8 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/post/<int:post_id>')
+@conditional_page('post:{post_id}', private=True)
+@cached_page('post:{post_id}')
 def view_post(post_id):
     if not isinstance(post_id, int) or post_id < 1:
         flash('Недопустимый идентификатор поста!', 'danger')
@@ -105,14 +118,16 @@ def view_post(post_id):
             flash('Пост не найден!', 'danger')
             return redirect(url_for('index'))
 
-        comments = Comment.get_by_post_id(post_id)
-        return render_template('post.html', post=post, comments=comments, form=CommentForm())
+        comments, next_comments = Comment.get_page(post_id, after=request.args.get('comments_after'))
+        return render_template('post.html', post=post, comments=comments, next_comments=next_comments,
+                               form=CommentForm())
     except sqlite3.Error as e:
         logging.error(f'View post error: {e}')
         flash('Ошибка загрузки поста.', 'danger')
         return redirect(url_for('index'))
 
 @app.route('/post/<int:post_id>/comment', methods=['POST'])
+@rate_limit('add_comment')
 def add_comment(post_id):
     if not isinstance(post_id, int) or post_id < 1:
         flash('Недопустимый идентификатор поста!', 'danger')
@@ -120,9 +135,8 @@ def add_comment(post_id):
 
     form = CommentForm()
     if form.validate_on_submit():
-        sanitized_author_name = bleach.clean(form.author_name.data, tags=[], strip=True)
-        sanitized_content = bleach.clean(form.content.data, tags=['p', 'br', 'strong', 'em'], strip=True)
-        comment_id = Comment.create(post_id, sanitized_author_name, sanitized_content)
+        # Очистка и рендеринг HTML выполняются один раз при сохранении (content.prepare_body)
+        comment_id = Comment.create(post_id, form.author_name.data, form.content.data)
         if comment_id:
             flash('Комментарий добавлен!', 'success')
         else:
@@ -134,33 +148,25 @@ def add_comment(post_id):
     return redirect(url_for('view_post', post_id=post_id))
 
 @app.route('/create_post', methods=['GET', 'POST'])
+@login_required
+@rate_limit('create_post', methods=('POST',))
 def create_post():
-    if 'user_id' not in session:
-        flash('Необходимо войти в систему для создания постов!', 'danger')
-        return redirect(url_for('login'))
-
     form = PostForm()
     if form.validate_on_submit():
-        sanitized_title = bleach.clean(form.title.data, tags=[], strip=True)
-        sanitized_content = bleach.clean(form.content.data, tags=['p', 'br', 'strong', 'em'], strip=True)
         image_path = None
-#        if form.image.data:
-#            file = form.image.data
-#            if allowed_file(file.filename):
-#                filename = secure_filename(file.filename)
-#                unique_filename = f"{secrets.token_hex(8)}_{filename}"
-#                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-#                try:
-#                    file.save(file_path)
-#                    image_path = unique_filename
-#                except Exception as e:
-#                    flash(f'Ошибка загрузки изображения: {e}', 'danger')
-#                    return render_template('create_post.html', form=form)
-#            else:
-#                flash('Недопустимый формат изображения!', 'danger')
-#                return render_template('create_post.html', form=form)
+        if form.image.data:
+            try:
+                image_path = uploads.store_upload(form.image.data)
+            except uploads.InvalidImage:
+                flash('Недопустимый формат изображения!', 'danger')
+                return render_template('create_post.html', form=form)
+            except OSError as e:
+                logging.error(f'Upload error: {e}')
+                flash('Ошибка загрузки изображения.', 'danger')
+                return render_template('create_post.html', form=form)
+            uploads.schedule_variants(image_path)
 
-        post_id = Post.create(sanitized_title, sanitized_content, session['user_id'], image_path)
+        post_id = Post.create(form.title.data, form.content.data, current_user().id, image_path)
         if post_id:
             flash('Пост создан успешно!', 'success')
             return redirect(url_for('index'))
@@ -169,77 +175,109 @@ def create_post():
     return render_template('create_post.html', form=form)
 
 @app.route('/search')
+@rate_limit('search')
 def search():
     query = request.args.get('q', '').strip()
-    posts = []
-    if query and validate_input(query, 100):
-        sanitized_query = bleach.clean(query, tags=[], strip=True)
-        try:
-            conn = get_db_connection()
-            posts = conn.execute('''
-                SELECT p.*, u.username
-                FROM posts p
-                JOIN users u ON p.author_id = u.id
-                WHERE p.title LIKE ? OR p.content LIKE ?
-                ORDER BY p.created_at DESC
-            ''', (f'%{sanitized_query}%', f'%{sanitized_query}%')).fetchall()
-            conn.close()
-        except sqlite3.Error as e:
-            logging.error(f'Search error: {e}')
-            flash('Ошибка поиска.', 'danger')
-    return render_template('search.html', posts=posts, query=query)
+    page = request.args.get('page', 1, type=int)
+    posts, has_next = [], False
+    if query and validate_input(query, 100, forbidden=SQL_TOKENS):
+        posts, has_next = Post.search(clean_text(query), page=page)
+    return render_template('search.html', posts=posts, query=query, page=page, has_next=has_next)
+
+ADMIN_CURSORS = {panel: f'{panel}_before' for panel in ADMIN_PANELS}
 
 @app.route('/admin')
+@admin_required
 def admin():
-    if 'user_id' not in session:
-        flash('Доступ запрещен!', 'danger')
-        return redirect(url_for('login'))
-    if not session.get('is_admin'):
-        flash('Недостаточно прав доступа!', 'danger')
-        return redirect(url_for('index'))
+    # Панели листаются независимо: курсор каждой передается в своем параметре, остальные сохраняются
+    cursors = {name: request.args[name] for name in ADMIN_CURSORS.values() if request.args.get(name)}
+    panels, next_urls, first_urls = {}, {}, {}
+    for panel, name in ADMIN_CURSORS.items():
+        panels[panel], next_cursor = Admin.get_panel(panel, before=cursors.get(name))
+        others = {key: value for key, value in cursors.items() if key != name}
+        next_urls[panel] = url_for('admin', **others, **{name: next_cursor}) if next_cursor else None
+        first_urls[panel] = url_for('admin', **others) if name in cursors else None
+    return render_template('admin.html', panels=panels, next_urls=next_urls, first_urls=first_urls,
+                           counts=Admin.counts())
+
+@app.route('/admin/stats')
+@admin_required(json_response=True)
+def admin_stats():
+    return jsonify(Admin.counts())
+
+def bulk_delete(delete, noun):
+    """Shared body of the bulk moderation endpoints: ids from JSON or a form, one transaction."""
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        ids = Admin.parse_ids(payload.get('ids') or []) if isinstance(payload.get('ids'), list) else None
+    else:
+        ids = Admin.parse_ids(request.form.getlist('ids'))
+    if ids is None:
+        if request.is_json:
+            return jsonify({'message': f'Expected 1 to {Admin.MAX_BULK_IDS} positive integer ids'}), 400
+        flash('Ничего не выбрано или список слишком большой.', 'warning')
+        return redirect(url_for('admin'))
 
     try:
-        conn = get_db_connection()
-        page = request.args.get('page', 1, type=int)
-        per_page = 10
-        offset = (page - 1) * per_page
-        users = conn.execute('SELECT * FROM users ORDER BY created_at DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
-        posts = conn.execute('SELECT * FROM posts ORDER BY created_at DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
-        comments = conn.execute('SELECT * FROM comments ORDER BY created_at DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
-        conn.close()
-        return render_template('admin.html', users=users, posts=posts, comments=comments, page=page, per_page=per_page)
+        deleted = delete(ids)
     except sqlite3.Error as e:
-        logging.error(f'Admin error: {e}')
-        flash('Ошибка загрузки данных.', 'danger')
-        return redirect(url_for('index'))
+        logging.error(f'Bulk delete error: {e}')
+        if request.is_json:
+            return jsonify({'message': 'Database error'}), 500
+        flash('Ошибка удаления.', 'danger')
+        return redirect(url_for('admin'))
+
+    if request.is_json:
+        return jsonify({'message': f'{noun.capitalize()} deleted', 'requested': len(ids), 'deleted': deleted})
+    flash(f'Удалено: {deleted}.', 'success')
+    return redirect(url_for('admin'))
+
+@app.route('/admin/posts/delete', methods=['POST'])
+@admin_required
+def admin_delete_posts():
+    return bulk_delete(Admin.delete_posts, 'posts')
+
+@app.route('/admin/comments/delete', methods=['POST'])
+@admin_required
+def admin_delete_comments():
+    return bulk_delete(Admin.delete_comments, 'comments')
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    if not validate_input(filename, 255) or any(c in filename for c in ['..', '/', '\\', ':']):
+    if not validate_input(filename, 255, forbidden=SQL_TOKENS) or any(c in filename for c in ['..', '/', '\\', ':']):
         abort(403, description="Invalid filename")
     filename = secure_filename(filename)
+    variant = request.args.get('variant')
+    accept_webp = any(mimetype == 'image/webp' for mimetype, _ in request.accept_mimetypes)
+    name, final = uploads.resolve(filename, variant, accept_webp)
     try:
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        # Имена файлов производны от содержимого, поэтому содержимое по URL не меняется.
+        # conditional=True дает Range и 304; файл отдается через wsgi.file_wrapper (sendfile)
+        response = send_from_directory(uploads.upload_folder(), name, conditional=True,
+                                       max_age=app.config['UPLOAD_MAX_AGE'] if final else 60)
     except FileNotFoundError:
         abort(404)
+    response.cache_control.public = True
+    if final:
+        response.cache_control.immutable = True
+    if variant:
+        response.vary.add('Accept')
+    return response
 
 @app.route('/delete_post/<int:post_id>', methods=['POST'])
+@login_required
 def delete_post(post_id):
-    if 'user_id' not in session:
-        flash('Необходимо войти в систему!', 'danger')
-        return redirect(url_for('login'))
-
+    user = current_user()
     try:
-        conn = get_db_connection()
-        # Получаем пост как словарь (не как sqlite3.Row)
-        post = conn.execute('SELECT * FROM posts WHERE id = ?', (post_id,)).fetchone()
+        conn = get_db()
+        post = conn.execute('SELECT author_id FROM posts WHERE id = ?', (post_id,)).fetchone()
         
         if not post:
             flash('Пост не найден!', 'danger')
             return jsonify({'message': 'Post not found'}), 404
 
-        # Проверяем права доступа (используем post['author_id'] вместо post.author_id)
-        if post['author_id'] != session['user_id'] and not session.get('is_admin'):
+        # Проверяем права доступа
+        if post['author_id'] != user.id and not user.is_admin:
             flash('Недостаточно прав для удаления!', 'danger')
             return jsonify({'message': 'Permission denied'}), 403
 
@@ -247,7 +285,8 @@ def delete_post(post_id):
         conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
         conn.execute('DELETE FROM comments WHERE post_id = ?', (post_id,))
         conn.commit()
-        conn.close()
+        Post.forget_count()
+        invalidate('feed', f'post:{post_id}')
         
         flash('Пост удален!', 'success')
         return jsonify({'message': 'Post deleted'})
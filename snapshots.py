@@ -0,0 +1,260 @@
+"""Online backups and read-only snapshots of the database.
+
+``backup`` copies the live database with the SQLite backup API a few
+hundred pages at a time, sleeping between steps so the copy does not hog
+the disk. The source connection holds one read transaction for the whole
+copy: in WAL mode that does not block writers, and it keeps SQLite from
+restarting the backup every time a comment is committed mid-copy.
+
+The ``snapshot`` maintenance job publishes such a copy every
+``SNAPSHOT_INTERVAL`` seconds as ``<SNAPSHOT_DIR>/blog-<timestamp>.db`` and
+points the ``current.db`` symlink at it. Read-heavy scopes listed in
+``SNAPSHOT_READ_SCOPES`` (``'search'``, ``'admin'``) read from the latest
+snapshot through ``get_snapshot_db`` instead of the live file, accepting up
+to ``SNAPSHOT_MAX_AGE`` seconds of staleness; a snapshot is never modified
+after publishing, so it is opened with ``immutable=1`` and read without any
+locking. ``flask restore`` copies a snapshot back over the live database.
+"""
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app, g
+from db import ConnectionPool, connect, get_read_db
+from migrations import migrate
+
+CURRENT_LINK = 'current.db'
+SNAPSHOT_PREFIX = 'blog-'
+
+
+class SnapshotError(Exception):
+    """A backup or restore could not be completed; the live database is left as it was."""
+
+
+def backup(source_path, target_path, pages=256, sleep=0.005):
+    """Copy ``source_path`` into a new file at ``target_path``; return the number of pages copied.
+
+    The copy is written next to the target and renamed into place only after
+    ``PRAGMA quick_check`` passes, so readers never see a partial file.
+    """
+    tmp_path = f'{target_path}.{os.getpid()}.tmp'
+    source = connect(source_path, pragmas={}, readonly=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        # Одна читающая транзакция на всё копирование: снимок не меняется между шагами,
+        # поэтому коммиты других соединений не перезапускают backup с начала
+        source.execute('BEGIN')
+        source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        total = [0]
+
+        def throttle(status, remaining, count):
+            total[0] = count
+            if remaining and sleep:
+                time.sleep(sleep)
+
+        source.backup(target, pages=pages, progress=throttle)
+        source.rollback()
+        # Заголовок копируется из источника вместе с режимом WAL; снимку он не нужен
+        target.execute('PRAGMA journal_mode = DELETE')
+        check = target.execute('PRAGMA quick_check').fetchone()[0]
+        target.close()
+        if check != 'ok':
+            raise SnapshotError(f'quick_check failed on the copy: {check}')
+        os.chmod(tmp_path, 0o600)  # в копии есть хэши паролей
+        os.replace(tmp_path, target_path)
+        return total[0]
+    except BaseException:
+        target.close()
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    finally:
+        source.close()
+
+
+def snapshot_dir(app):
+    return app.config['SNAPSHOT_DIR']
+
+
+def list_snapshots(app):
+    """Published snapshot paths, newest first."""
+    directory = snapshot_dir(app)
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith(SNAPSHOT_PREFIX) and name.endswith('.db')]
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def publish_snapshot(app):
+    """Back up the live database into a new snapshot, make it current and prune old ones; return a summary."""
+    directory = snapshot_dir(app)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    name = f'{SNAPSHOT_PREFIX}{time.strftime("%Y%m%d-%H%M%S")}.db'
+    pages = backup(app.config['DATABASE'], os.path.join(directory, name),
+                   app.config['SNAPSHOT_PAGES_PER_STEP'], app.config['SNAPSHOT_STEP_SLEEP'])
+    link_tmp = os.path.join(directory, f'.{CURRENT_LINK}.{os.getpid()}')
+    os.symlink(name, link_tmp)
+    os.replace(link_tmp, os.path.join(directory, CURRENT_LINK))
+    # Старые снимки удаляются с запасом: воркеры переключаются на новый за SNAPSHOT_CHECK_INTERVAL
+    pruned = list_snapshots(app)[max(app.config['SNAPSHOT_KEEP'], 2):]
+    for path in pruned:
+        os.unlink(path)
+    size = os.path.getsize(os.path.join(directory, name))
+    return f'{name}: {pages} pages, {size:,} B' + (f', {len(pruned)} old removed' if pruned else '')
+
+
+class SnapshotReader:
+    """Per-worker pool of immutable read-only connections to the current snapshot.
+
+    The ``current.db`` link is re-read at most every ``check_interval``
+    seconds; when it points at a new file a new pool is opened for it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.check_interval = app.config['SNAPSHOT_CHECK_INTERVAL']
+        self.max_age = app.config['SNAPSHOT_MAX_AGE']
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._path = None
+        self._published_at = 0.0
+        self._pool = None
+
+    def _refresh(self):
+        link = os.path.join(snapshot_dir(self.app), CURRENT_LINK)
+        try:
+            path = os.path.realpath(link, strict=True)
+            published_at = os.stat(path).st_mtime
+        except OSError:
+            path, published_at = None, 0.0
+        if path != self._path:
+            if self._pool is not None:
+                # Выданные соединения вернутся в старый пул и закроются вместе с ним
+                self._pool.close_all()
+            read_pool = self.app.extensions['db_read_pool']
+            self._pool = None if path is None else ConnectionPool(
+                path, size=read_pool.size, timeout=read_pool.timeout, pragmas=read_pool.pragmas,
+                readonly=True, immutable=True, factory=read_pool.factory)
+            self._path = path
+        self._published_at = published_at
+
+    def pool(self):
+        """The pool for the current snapshot, or None if there is none or it is older than ``max_age``."""
+        now = time.time()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._refresh()
+                    self._checked_at = now
+        if self._pool is None or now - self._published_at > self.max_age:
+            return None
+        return self._pool
+
+
+def get_snapshot_db(scope):
+    """Return a connection to the latest snapshot if ``scope`` reads from snapshots, else ``get_read_db()``.
+
+    Falls back to the live database when no fresh snapshot is available.
+    """
+    if scope not in current_app.config['SNAPSHOT_READ_SCOPES']:
+        return get_read_db()
+    if 'snapshot_db' not in g:
+        pool = current_app.extensions['snapshot_reader'].pool()
+        if pool is None:
+            return get_read_db()
+        try:
+            g.snapshot_db = (pool, pool.acquire())
+        except sqlite3.Error:
+            return get_read_db()
+    return g.snapshot_db[1]
+
+
+def close_snapshot_db(exc=None):
+    checked_out = g.pop('snapshot_db', None)
+    if checked_out is not None:
+        pool, conn = checked_out
+        pool.release(conn)
+
+
+def resolve_snapshot(app, name):
+    """Accept a path or the name of a file in SNAPSHOT_DIR (``current.db`` included)."""
+    if os.path.sep not in name:
+        candidate = os.path.join(snapshot_dir(app), name)
+        if os.path.exists(candidate):
+            return os.path.realpath(candidate)
+    return os.path.realpath(name)
+
+
+def content_versions(conn):
+    try:
+        return {key: version for key, version in conn.execute('SELECT key, version FROM content_versions')}
+    except sqlite3.OperationalError:
+        return {}
+
+
+def bump_content_versions(conn, previous):
+    """Move every content version past both its restored and its pre-restore value.
+
+    The snapshot carries older counters; without this, pages changed by the
+    restore would get version numbers (and ETags) that clients already hold
+    for different content and would be answered with a stale 304.
+    """
+    with conn:
+        conn.execute('UPDATE content_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP')
+        conn.executemany(
+            '''INSERT INTO content_versions (key, version) VALUES (?, ?)
+               ON CONFLICT (key) DO UPDATE SET version = max(version, excluded.version),
+                                               updated_at = CURRENT_TIMESTAMP''',
+            [(key, version + 1) for key, version in previous.items()])
+
+
+def restore(app, snapshot_path):
+    """Copy a snapshot over the live database; return the path of the safety backup taken first.
+
+    The live file is written through the backup API rather than replaced,
+    so open connections see the restored content on their next transaction.
+    Writers wait for the duration of the copy.
+    """
+    live = app.config['DATABASE']
+    if os.path.realpath(snapshot_path) == os.path.realpath(live):
+        raise SnapshotError('Cannot restore the live database onto itself')
+    try:
+        source = connect(snapshot_path, pragmas={}, readonly=True, immutable=True)
+        check = source.execute('PRAGMA quick_check').fetchone()[0]
+    except sqlite3.Error as e:
+        raise SnapshotError(f'{snapshot_path} is not a readable database: {e}')
+    if check != 'ok':
+        source.close()
+        raise SnapshotError(f'quick_check failed on {snapshot_path}: {check}')
+
+    try:
+        directory = snapshot_dir(app)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        safety = os.path.join(directory, f'pre-restore-{time.strftime("%Y%m%d-%H%M%S")}.db')
+        backup(live, safety, app.config['SNAPSHOT_PAGES_PER_STEP'], 0)
+
+        target = connect(live)
+        try:
+            previous = content_versions(target)
+            source.backup(target, pages=-1)
+            # Снимок мог быть сделан до последних миграций
+            migrate(target)
+            bump_content_versions(target, previous)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return safety
+
+
+def init_app(app):
+    app.config.setdefault('SNAPSHOT_DIR', os.path.join(app.instance_path, 'snapshots'))
+    app.config.setdefault('SNAPSHOT_INTERVAL', 3600)  # 0 отключает снимки в планировщике
+    app.config.setdefault('SNAPSHOT_KEEP', 3)
+    app.config.setdefault('SNAPSHOT_PAGES_PER_STEP', 256)
+    app.config.setdefault('SNAPSHOT_STEP_SLEEP', 0.005)  # секунды между шагами копирования
+    app.config.setdefault('SNAPSHOT_READ_SCOPES', ())  # например ('search', 'admin')
+    app.config.setdefault('SNAPSHOT_MAX_AGE', 2 * app.config['SNAPSHOT_INTERVAL'] or 7200)
+    app.config.setdefault('SNAPSHOT_CHECK_INTERVAL', 5)
+    app.extensions['snapshot_reader'] = SnapshotReader(app)
+    app.teardown_appcontext(close_snapshot_db)
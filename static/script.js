@@ -210,18 +210,11 @@ function setupSearchAutocomplete() {
         }
 
         const safeQuery = encodeURIComponent(DOMPurify.sanitize(query));
-        const csrfToken = document.querySelector('meta[name="csrf-token"]')?.content;
-        if (!csrfToken) {
-            showNotification('CSRF-токен отсутствует!', 'danger');
-            return;
-        }
 
+        // GET-запросу CSRF-токен не нужен, а у гостей его на странице нет
         searchTimeout = setTimeout(() => {
             fetch(`/search?q=${safeQuery}`, {
-                method: 'GET',
-                headers: {
-                    'X-CSRF-Token': csrfToken
-                }
+                method: 'GET'
             })
                 .then(response => {
                     if (!response.ok) throw new Error(`Ошибка сети: ${response.status}`);
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+from db import STORAGE_PRAGMAS, ConnectionPool, connect
+
+
+def create_database(path):
+    conn = connect(path)
+    conn.execute('CREATE TABLE posts (id INTEGER PRIMARY KEY, title TEXT)')
+    conn.execute("INSERT INTO posts (title) VALUES ('first')")
+    conn.commit()
+    return conn
+
+
+def test_read_pool_opens_and_reads(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    writer = create_database(path)
+    pool = ConnectionPool(path, size=2, pragmas=STORAGE_PRAGMAS, readonly=True)
+    conn = pool.acquire()
+    try:
+        assert conn.execute('SELECT title FROM posts').fetchall()[0][0] == 'first'
+    finally:
+        pool.release(conn)
+        pool.close_all()
+        writer.close()
+
+
+def test_new_database_uses_incremental_auto_vacuum(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    create_database(path).close()
+    conn = connect(path)
+    try:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    finally:
+        conn.close()
+
+
+def test_existing_database_is_left_alone(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (a)')
+    conn.commit()
+    conn.close()
+    assert os.path.getsize(path) > 0
+    conn = connect(path)
+    try:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,12 @@
+from db import connect
+from migrations import LATEST_VERSION, check_query_plans, get_version, migrate
+
+
+def test_hot_queries_use_indexes_after_migrating(tmp_path):
+    conn = connect(str(tmp_path / 'blog.db'))
+    try:
+        migrate(conn)
+        assert get_version(conn) == LATEST_VERSION
+        assert check_query_plans(conn) == {}
+    finally:
+        conn.close()
@@ -0,0 +1,23 @@
+from flask import Flask
+from werkzeug.security import generate_password_hash
+from passwords import needs_rehash
+
+
+def rehash_needed(stored_method, configured_method):
+    app = Flask(__name__)
+    app.config['PASSWORD_HASH_METHOD'] = configured_method
+    with app.app_context():
+        return needs_rehash(generate_password_hash('secret', stored_method))
+
+
+def test_methods_without_parameters_match_their_defaults():
+    assert not rehash_needed('scrypt', 'scrypt')
+    assert not rehash_needed('scrypt:32768:8:1', 'scrypt')
+    assert not rehash_needed('pbkdf2', 'pbkdf2:sha256')
+    assert not rehash_needed('pbkdf2:sha256', 'pbkdf2')
+
+
+def test_other_parameters_need_a_rehash():
+    assert rehash_needed('pbkdf2:sha256:1000', 'pbkdf2:sha256')
+    assert rehash_needed('pbkdf2:sha256', 'scrypt')
+    assert rehash_needed('scrypt:16384:8:1', 'scrypt')
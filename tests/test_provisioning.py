@@ -0,0 +1,33 @@
+import os
+import stat
+from flask import Flask
+import provisioning
+
+
+def test_provision_uses_the_configured_database(tmp_path):
+    database = str(tmp_path / 'data' / 'blog.db')
+    os.makedirs(os.path.dirname(database))
+    app = Flask(__name__, instance_path=str(tmp_path / 'instance'))
+    app.config.update(DATABASE=database, UPLOAD_FOLDER=str(tmp_path / 'uploads'))
+
+    assert not provisioning.is_provisioned(app)
+    assert provisioning.provision(app)
+    assert provisioning.is_provisioned(app)
+    assert stat.S_IMODE(os.stat(database).st_mode) == 0o600
+    assert not os.path.exists(tmp_path / 'blog.db')
+    credentials = tmp_path / 'data' / 'admin_credentials.txt'
+    assert stat.S_IMODE(os.stat(credentials).st_mode) == 0o600
+    with open(provisioning.marker_path(app), encoding='utf-8') as f:
+        assert database in f.read()
+
+
+def test_unprovisioned_app_still_imports_for_the_provision_command(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path / 'instance'))
+    app.config.update(DATABASE=str(tmp_path / 'blog.db'), UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+                      PROVISION_ON_STARTUP=False)
+    app.add_url_rule('/', 'index', lambda: 'ok')
+
+    provisioning.init_app(app)
+    assert app.test_client().get('/').status_code == 503
+    provisioning.provision(app)
+    assert app.test_client().get('/').status_code == 200
@@ -0,0 +1,55 @@
+from content import prepare_body
+from db import connect
+from migrations import migrate
+
+SEARCH_SQL = 'SELECT rowid, snippet(posts_fts, -1, "[", "]", "…", 8) FROM posts_fts WHERE posts_fts MATCH ?'
+
+
+def search(conn, term):
+    return [tuple(row) for row in conn.execute(SEARCH_SQL, (term,))]
+
+
+def create_database(path, version=None):
+    conn = connect(path)
+    if version is None:
+        migrate(conn)
+    else:
+        migrate(conn, version)
+    conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('author', 'a@b.cd', 'xxxxxxxx')")
+    return conn
+
+
+def test_index_holds_unescaped_plain_text(tmp_path):
+    conn = create_database(str(tmp_path / 'blog.db'))
+    body = prepare_body('Tom & Jerry <strong>forever</strong>', 200)
+    conn.execute('INSERT INTO posts (title, content, content_html, excerpt, content_text, author_id) '
+                 'VALUES (?, ?, ?, ?, ?, 1)', ('Cartoons', body.source, body.html, body.excerpt, body.text))
+    conn.commit()
+    assert '&amp;' in body.source
+    assert search(conn, 'amp') == []
+    assert search(conn, 'strong') == []
+    assert search(conn, 'jerry') == [(1, 'Tom & [Jerry] forever')]
+    conn.close()
+
+
+def test_upgrade_reindexes_plain_text(tmp_path):
+    conn = create_database(str(tmp_path / 'blog.db'), version=7)
+    conn.execute("INSERT INTO posts (title, content, author_id) VALUES ('Cartoons', 'Tom &amp; Jerry', 1)")
+    conn.commit()
+    migrate(conn)
+    # До render-content пост находится только по заголовку
+    assert search(conn, 'cartoons') != []
+    assert search(conn, 'amp') == []
+    conn.execute("UPDATE posts SET content_text = 'Tom & Jerry' WHERE id = 1")
+    conn.commit()
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('integrity-check')")
+    assert search(conn, 'jerry') == [(1, 'Tom & [Jerry]')]
+    conn.close()
+
+
+def test_search_does_not_page_past_the_result_cap():
+    from models import Post
+    assert Post.search_pages() * Post.SEARCH_PAGE_SIZE == Post.SEARCH_MAX_RESULTS
+    # За пределом ограничения запрос даже не доходит до базы (здесь нет контекста приложения)
+    assert Post.search('blog', page=Post.search_pages() + 1) == ([], False)
+    assert Post.search('blog', page=1000000, per_page=100) == ([], False)
@@ -0,0 +1,38 @@
+import types
+from db import connect
+from migrations import migrate
+import snapshots
+
+
+def create_database(path):
+    conn = connect(path)
+    migrate(conn)
+    conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('author', 'a@b.cd', 'xxxxxxxx')")
+    conn.execute("INSERT INTO posts (title, content, author_id) VALUES ('first', 'body', 1)")
+    conn.commit()
+    return conn
+
+
+def versions(conn):
+    return dict(conn.execute('SELECT key, version FROM content_versions').fetchall())
+
+
+def test_restore_moves_content_versions_forward(tmp_path):
+    live = str(tmp_path / 'blog.db')
+    app = types.SimpleNamespace(config={'DATABASE': live, 'SNAPSHOT_DIR': str(tmp_path / 'snapshots'),
+                                        'SNAPSHOT_PAGES_PER_STEP': 256})
+    conn = create_database(live)
+    snapshot = str(tmp_path / 'snapshot.db')
+    snapshots.backup(live, snapshot, sleep=0)
+    for title in ('second', 'third'):
+        conn.execute("INSERT INTO posts (title, content, author_id) VALUES (?, 'body', 1)", (title,))
+    conn.execute("UPDATE posts SET title = 'edited' WHERE id = 1")
+    conn.commit()
+    before = versions(conn)
+
+    snapshots.restore(app, snapshot)
+
+    after = versions(conn)
+    assert conn.execute('SELECT count(*) FROM posts').fetchone()[0] == 1
+    assert all(after[key] > version for key, version in before.items())
+    conn.close()
@@ -0,0 +1,72 @@
+import sqlite3
+import time
+import pytest
+from db import connect
+from writequeue import WriteQueue
+
+
+def create_database(path):
+    conn = connect(path)
+    conn.execute('CREATE TABLE comments (id INTEGER PRIMARY KEY, content TEXT NOT NULL)')
+    conn.commit()
+    conn.close()
+
+
+def test_writer_thread_is_restarted(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    create_database(path)
+    write_queue = WriteQueue(path, result_timeout=5)
+    assert write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('one',)) == 1
+    write_queue.stop()
+    assert not write_queue._thread.is_alive()
+    assert write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('two',)) == 2
+    write_queue.stop()
+
+
+def test_failed_batch_keeps_the_writer_alive(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    write_queue = WriteQueue(path, result_timeout=5)
+    # Таблицы ещё нет: ошибка достаётся вызывающему, поток продолжает работу
+    with pytest.raises(sqlite3.OperationalError):
+        write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('lost',))
+    create_database(path)
+    assert write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('kept',)) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        write_queue.execute('INSERT INTO comments (content) VALUES (NULL)')
+    assert write_queue._thread.is_alive()
+    write_queue.stop()
+
+
+def test_non_sqlite_error_fails_the_batch(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    create_database(path)
+    write_queue = WriteQueue(path, result_timeout=5)
+    with pytest.raises(Exception):
+        write_queue.execute('INSERT INTO comments (content) VALUES (?)', (object(),))
+    assert write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('after',)) == 1
+    write_queue.stop()
+
+
+def test_timed_out_statement_still_queued_is_cancelled(tmp_path):
+    path = str(tmp_path / 'blog.db')
+    create_database(path)
+    write_queue = WriteQueue(path, result_timeout=5)
+    blocker = connect(path)
+    blocker.execute('PRAGMA busy_timeout = 0')
+    write_queue.execute('INSERT INTO comments (content) VALUES (?)', ('first',))
+    blocker.execute('BEGIN IMMEDIATE')
+    try:
+        held = write_queue.submit('INSERT INTO comments (content) VALUES (?)', ('held',))
+        # Писатель взял первый запрос и ждёт блокировку; второй остаётся в очереди
+        while not held.running():
+            time.sleep(0.01)
+        queued = write_queue.submit('INSERT INTO comments (content) VALUES (?)', ('queued',))
+        assert queued.cancel()
+    finally:
+        blocker.rollback()
+        blocker.close()
+    held.result(timeout=10)
+    write_queue.stop()
+    conn = connect(path)
+    assert [row[0] for row in conn.execute('SELECT content FROM comments ORDER BY id')] == ['first', 'held']
+    conn.close()
@@ -0,0 +1,226 @@
+"""Content-addressed image uploads with resized variants.
+
+Uploads are copied to disk in fixed-size chunks while being hashed, then
+renamed to ``<sha256>.<ext>``, so the same picture uploaded twice is stored
+once and its URL never changes. Downscaled variants (``<sha256>-thumb.jpg``,
+``<sha256>-thumb.webp`` and so on) are produced by a small thread pool after
+the request has returned. Pillow is optional: without it only originals are
+stored and served.
+"""
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+CHUNK_SIZE = 64 * 1024
+
+# Тип определяется по сигнатуре файла, а не по имени, присланному клиентом
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+SAVE_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'gif': 'GIF'}
+
+VARIANTS = {
+    'thumb': (800, 400),     # карточки в ленте и поиске
+    'medium': (1600, 1600),  # страница поста
+}
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+class InvalidImage(ValueError):
+    """Raised when an upload is not a PNG, JPEG or GIF image."""
+
+
+def sniff_extension(head):
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+def upload_folder():
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+
+def store_upload(file_storage, folder=None):
+    """Stream an uploaded file into content-addressed storage and return its name."""
+    folder = folder or upload_folder()
+    stream = file_storage.stream
+    head = stream.read(CHUNK_SIZE)
+    ext = sniff_extension(head)
+    if ext is None:
+        raise InvalidImage('Unsupported image type')
+
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+        filename = f'{digest.hexdigest()}.{ext}'
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            # Такой файл уже загружали: оставляем существующую копию, а mtime обновляем,
+            # чтобы очистка осиротевших загрузок не удалила его до вставки поста
+            os.unlink(tmp_path)
+            os.utime(path)
+        else:
+            os.chmod(tmp_path, 0o640)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return filename
+
+
+@functools.lru_cache(maxsize=None)
+def pillow():
+    """Import Pillow on first use; return ``(Image, ImageOps)`` or None if it is missing."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+
+def variant_name(filename, variant, webp=False):
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}-{variant}{".webp" if webp else ext}'
+
+
+def _save_atomically(image, path, format, **options):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.variant-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, format=format, **options)
+        os.chmod(tmp_path, 0o640)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def generate_variants(folder, filename):
+    """Write every resized variant of an original; return the names written."""
+    if pillow() is None:
+        return []
+    Image, ImageOps = pillow()
+    ext = os.path.splitext(filename)[1].lstrip('.').lower()
+    written = []
+    with Image.open(os.path.join(folder, filename)) as original:
+        # Анимированные GIF не уменьшаем, чтобы не потерять анимацию:
+        # вариантом становится жесткая ссылка на оригинал
+        if getattr(original, 'is_animated', False):
+            for variant in VARIANTS:
+                native = variant_name(filename, variant)
+                if not os.path.exists(os.path.join(folder, native)):
+                    os.link(os.path.join(folder, filename), os.path.join(folder, native))
+                written.append(native)
+            return written
+        image = ImageOps.exif_transpose(original)
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            native = variant_name(filename, variant)
+            if SAVE_FORMATS[ext] == 'JPEG':
+                if resized.mode not in ('RGB', 'L'):
+                    resized = resized.convert('RGB')
+                _save_atomically(resized, os.path.join(folder, native), 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            else:
+                _save_atomically(resized, os.path.join(folder, native), SAVE_FORMATS[ext], optimize=True)
+            webp = variant_name(filename, variant, webp=True)
+            _save_atomically(resized, os.path.join(folder, webp), 'WEBP', quality=WEBP_QUALITY, method=4)
+            written += [native, webp]
+    return written
+
+
+class VariantWorker:
+    """Thread pool that builds image variants outside the request.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so threads
+    are enough. Each original is queued at most once at a time.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+
+    def _get_executor(self):
+        # Пул создается лениво в каждом воркере gunicorn, а не в мастер-процессе
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-variants')
+            self._pending = set()
+            self._pid = os.getpid()
+        return self._executor
+
+    def schedule(self, folder, filename):
+        if pillow() is None:
+            return
+        path = os.path.join(folder, filename)
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+            self._get_executor().submit(self._run, folder, filename)
+
+    def _run(self, folder, filename):
+        try:
+            generate_variants(folder, filename)
+        except Exception as e:
+            logging.error(f'Image variant error for {filename}: {e}')
+        finally:
+            with self._lock:
+                self._pending.discard(os.path.join(folder, filename))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def schedule_variants(filename):
+    current_app.extensions['image_variants'].schedule(upload_folder(), filename)
+
+
+def resolve(filename, variant=None, accept_webp=False):
+    """Pick the file to serve for a request.
+
+    Returns ``(name, final)``; ``final`` is False when a variant was asked for
+    but is not ready yet and the original is served in its place, in which
+    case generation is (re)scheduled.
+    """
+    if not variant or variant not in VARIANTS:
+        return filename, True
+    folder = upload_folder()
+    candidates = [variant_name(filename, variant, webp=True)] if accept_webp else []
+    candidates.append(variant_name(filename, variant))
+    for name in candidates:
+        if os.path.exists(os.path.join(folder, name)):
+            return name, True
+    if pillow() is not None and os.path.exists(os.path.join(folder, filename)):
+        schedule_variants(filename)
+    return filename, False
+
+
+def init_app(app):
+    app.config.setdefault('UPLOAD_VARIANT_WORKERS', 2)
+    app.extensions['image_variants'] = VariantWorker(app.config['UPLOAD_VARIANT_WORKERS'])
@@ -0,0 +1,187 @@
+"""Single-writer queue that group-commits inserts from request threads.
+
+Request threads enqueue a statement and wait on a future; one background
+thread per worker drains the queue, runs everything that arrived within a
+short window in a single transaction (one fsync, one write-lock
+acquisition) and hands the row ids back. Each statement runs under its own
+savepoint, so a constraint violation fails only that caller.
+
+A caller that gives up waiting (``result_timeout``) cancels its statement
+if it is still queued. If the writer has already picked it up, it may
+still be committed after the caller saw the timeout, so a retry can insert
+the row twice.
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from flask import current_app
+from db import connect, get_db
+
+
+class WriteQueueFull(sqlite3.OperationalError):
+    """Raised when the write queue stays full for longer than the enqueue timeout."""
+
+
+class WriteQueue:
+    def __init__(self, database, pragmas=None, max_size=1000, batch_window=0.0,
+                 max_batch=200, enqueue_timeout=1.0, result_timeout=10.0):
+        self.database = database
+        self.pragmas = pragmas
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.enqueue_timeout = enqueue_timeout
+        self.result_timeout = result_timeout
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Поток-писатель запускается в каждом воркере после fork() и перезапускается, если умер
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+
+    def submit(self, sql, params=()):
+        """Enqueue a statement and return a Future resolving to its lastrowid."""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put((sql, params, future), timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise WriteQueueFull('Write queue is full')
+        return future
+
+    def execute(self, sql, params=()):
+        """Enqueue a statement and wait until it is committed.
+
+        On timeout a statement still in the queue is cancelled; one already
+        in a batch may yet be committed.
+        """
+        future = self.submit(sql, params)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise sqlite3.OperationalError('Timed out waiting for the write queue')
+            raise sqlite3.OperationalError('Timed out waiting for the write queue; the write may still be committed')
+
+    def _collect(self, first):
+        """Gather what is already queued, waiting up to the batch window for more.
+
+        With a zero window batching is purely opportunistic: statements that
+        pile up while the previous commit is syncing go into the next one.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _commit_batch(self, conn, batch):
+        # Отменённые по таймауту запросы пропускаем; остальные после этого отменить уже нельзя
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, params, future in batch:
+                conn.execute('SAVEPOINT write_item')
+                try:
+                    cursor = conn.execute(sql, params)
+                    results.append((future, cursor.lastrowid, None))
+                    conn.execute('RELEASE write_item')
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO write_item')
+                    conn.execute('RELEASE write_item')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for future, row_id, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(row_id)
+
+    def _run(self):
+        conn = None
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            try:
+                if conn is None:
+                    conn = connect(self.database, pragmas=self.pragmas)
+                    conn.isolation_level = None
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                # Поток должен пережить любую ошибку: иначе все следующие запросы ждали бы до таймаута
+                logging.error(f'Write queue batch failed: {e}')
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None:
+                    conn.close()
+                    conn = None  # переподключимся на следующем пакете
+        if conn is not None:
+            conn.close()
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout=self.result_timeout)
+
+
+def execute_write(sql, params=()):
+    """Run a single INSERT/UPDATE and return its lastrowid, through the queue when enabled."""
+    write_queue = current_app.extensions.get('write_queue')
+    if write_queue is not None:
+        return write_queue.execute(sql, params)
+    conn = get_db()
+    cursor = conn.execute(sql, params)
+    conn.commit()
+    return cursor.lastrowid
+
+
+def init_app(app):
+    app.config.setdefault('WRITE_QUEUE_ENABLED', True)
+    app.config.setdefault('WRITE_QUEUE_SIZE', 1000)
+    app.config.setdefault('WRITE_QUEUE_WINDOW', 0.0)
+    if not app.config['WRITE_QUEUE_ENABLED']:
+        app.extensions['write_queue'] = None
+        return
+    write_queue = WriteQueue(
+        app.config['DATABASE'],
+        pragmas=app.config['SQLITE_PRAGMAS'],
+        max_size=app.config['WRITE_QUEUE_SIZE'],
+        batch_window=app.config['WRITE_QUEUE_WINDOW'],
+    )
+    app.extensions['write_queue'] = write_queue
+    atexit.register(write_queue.stop)